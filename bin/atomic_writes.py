@@ -0,0 +1,117 @@
+# -* encoding: utf8 *-
+
+# SPDX-FileCopyrightText: 2026 MASH project contributors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Writes generated files atomically, so that nothing (e.g. a concurrent `just run`) ever sees a half-written file,
+# and an interrupted run leaves either the old or the new version of each file behind, never a truncated one.
+#
+# Files are first written to temporary files next to their destination.
+# Once everything has been written, all temporary files are fsynced in one batch and renamed over their destinations,
+# in the order in which they were written. This lets callers write "derived file" before "hash of derived file".
+# Files whose contents are unchanged are not rewritten at all.
+
+import os
+import tempfile
+
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+class PendingWrites:
+    """Collects file writes and applies them all at once when committed.
+
+    Use it as a context manager: pending writes are committed when the block succeeds, and discarded otherwise.
+    """
+
+    def __init__(self):
+        # Destination path => temporary file path, in write order
+        self.temporary_paths = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+    def write(self, path, contents):
+        """Schedules writing contents (str or bytes) to path. Writing the same path again replaces the earlier contents."""
+        if isinstance(contents, str):
+            contents = contents.encode("utf-8")
+
+        # A re-written file moves to the end of the write order
+        self.discard_path(path)
+
+        try:
+            with open(path, "rb") as file:
+                if file.read() == contents:
+                    return
+        except FileNotFoundError:
+            pass
+
+        directory_path = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory_path, exist_ok=True)
+
+        fd, temporary_path = tempfile.mkstemp(
+            dir=directory_path, prefix="." + os.path.basename(path) + "."
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(contents)
+            # mkstemp creates files only readable by us, but the result should look like any other written file
+            try:
+                mode = os.stat(path).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o666 & ~get_umask()
+            os.chmod(temporary_path, mode)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+        self.temporary_paths[path] = temporary_path
+
+    def discard_path(self, path):
+        temporary_path = self.temporary_paths.pop(path, None)
+        if temporary_path is not None:
+            os.unlink(temporary_path)
+
+    def discard(self):
+        for path in list(self.temporary_paths.keys()):
+            self.discard_path(path)
+
+    def commit(self):
+        """Makes all pending writes durable and moves them into place."""
+        for temporary_path in self.temporary_paths.values():
+            fd = os.open(temporary_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        directory_paths = set()
+        for path, temporary_path in self.temporary_paths.items():
+            os.replace(temporary_path, path)
+            directory_paths.add(os.path.dirname(os.path.abspath(path)))
+        self.temporary_paths = {}
+
+        # The renames themselves only become durable once their directories are synced
+        for directory_path in sorted(directory_paths):
+            try:
+                fd = os.open(directory_path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            except OSError:
+                # Some platforms and filesystems don't support syncing directories
+                pass
+            finally:
+                os.close(fd)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+# -* encoding: utf8 *-
+
+# SPDX-FileCopyrightText: 2026 MASH project contributors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Controller-side alternative to playbooks/discover-and-update.yml.
+#
+# Instead of running the docker_traefik_discovery role on each host (copy, command, set_fact loop, module, uri
+# and cleanup tasks, each being a round trip), this opens one SSH connection to every host of the group concurrently,
+# feeds inspect-docker.sh to `bash -s` on its stdin and reads the host's container labels back (compact JSON, gzipped).
+# All labels are then processed centrally (with the parse_docker_labels module's own functions)
+# and the Proxmox notes are updated in one batch, over a single keep-alive connection to the Proxmox API.
+#
+# SSH connections are multiplexed (ControlPersist), so repeated runs reuse already established connections.
+# Hosts, their addresses and their Proxmox VM IDs come from the Ansible inventory (via `ansible-inventory --list`).
+#
+# As all hosts are seen at once, routers replicated on several hosts (same rule) are merged into one load-balanced
+# Gateway service, with one server per host. A host's weight can be set with the `traefik_gateway_weight` host var.
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import ssl
+import subprocess
+import sys
+
+root_directory_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+role_directory_path = os.path.join(root_directory_path, "roles", "docker_traefik_discovery")
+inspect_script_path = os.path.join(role_directory_path, "files", "inspect-docker.sh")
+
+sys.path.insert(0, os.path.join(role_directory_path, "library"))
+
+from parse_docker_labels import (
+    collect_container_labels,
+    decode_discovery_output,
+    merge_replicated_results,
+    process_labels,
+    validate_transport_options,
+)
+from traefik_rules import RouteIndex, RuleSyntaxError, format_routing_report
+
+default_ssh_options = [
+    "-o",
+    "BatchMode=yes",
+    "-o",
+    "ControlMaster=auto",
+    "-o",
+    "ControlPersist=60s",
+    "-o",
+    "ControlPath=~/.ssh/mash-discovery-%C",
+]
+
+
+def load_inventory(inventory_path):
+    """Returns the inventory as dumped by `ansible-inventory --list` (so that dynamic inventories work too)."""
+    result = subprocess.run(
+        ["ansible-inventory", "-i", inventory_path, "--list"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise Exception(
+            "Failed loading inventory {0}: {1}".format(
+                inventory_path, result.stderr.strip()
+            )
+        )
+    return json.loads(result.stdout)
+
+
+def get_group_host_names(inventory, group_name):
+    """Returns the names of all hosts in the group (including its child groups), in a stable order."""
+    host_names = []
+    pending_group_names = [group_name]
+    seen_group_names = set()
+    while pending_group_names:
+        current_group_name = pending_group_names.pop(0)
+        if current_group_name in seen_group_names:
+            continue
+        seen_group_names.add(current_group_name)
+
+        group = inventory.get(current_group_name, {})
+        for host_name in group.get("hosts", []):
+            if host_name not in host_names:
+                host_names.append(host_name)
+        pending_group_names.extend(group.get("children", []))
+    return host_names
+
+
+def get_discovery_hosts(inventory, group_name):
+    """Returns (hosts, errors) for the group.
+
+    hosts is a list of host dicts (name, address, user, port, proxmox_node, proxmox_vmid, weight).
+    Hosts without proxmox_node or proxmox_vmid variables are left out, as (host, error) pairs in errors,
+    since their notes can't be updated.
+    """
+    hostvars = inventory.get("_meta", {}).get("hostvars", {})
+
+    hosts = []
+    errors = []
+    for host_name in get_group_host_names(inventory, group_name):
+        host_vars = hostvars.get(host_name, {})
+        host = {
+            "name": host_name,
+            "address": host_vars.get("ansible_host", host_name),
+            "user": host_vars.get("ansible_user"),
+            "port": host_vars.get("ansible_port"),
+            "proxmox_node": host_vars.get("proxmox_node"),
+            "proxmox_vmid": host_vars.get("proxmox_vmid"),
+            "weight": host_vars.get("traefik_gateway_weight"),
+        }
+        missing_variables = [
+            variable
+            for variable in ("proxmox_node", "proxmox_vmid")
+            if host[variable] in (None, "")
+        ]
+        if missing_variables:
+            errors.append(
+                (
+                    host,
+                    "skipped, missing inventory variable(s): {0}".format(
+                        ", ".join(missing_variables)
+                    ),
+                )
+            )
+            continue
+        hosts.append(host)
+    return hosts, errors
+
+
+def get_proxmox_api_host(inventory, hosts):
+    """Returns the `proxmox_api_host` variable the hosts have in the inventory (like the playbooks use).
+
+    Raises ValueError when it is not set for all hosts, or differs between them.
+    """
+    hostvars = inventory.get("_meta", {}).get("hostvars", {})
+    proxmox_api_hosts = set(
+        hostvars.get(host["name"], {}).get("proxmox_api_host") for host in hosts
+    )
+    if None in proxmox_api_hosts:
+        raise ValueError(
+            "the proxmox_api_host variable is not set for all hosts in the inventory, pass --proxmox-api-host"
+        )
+    if len(proxmox_api_hosts) > 1:
+        raise ValueError(
+            "the hosts have different proxmox_api_host variables ({0}), pass --proxmox-api-host".format(
+                ", ".join(sorted(proxmox_api_hosts))
+            )
+        )
+    return proxmox_api_hosts.pop() if proxmox_api_hosts else None
+
+
+def build_ssh_args(ssh_command, ssh_options, host):
+    args = list(ssh_command) + list(ssh_options)
+    if host["port"] is not None:
+        args.extend(["-p", str(host["port"])])
+    destination = host["address"]
+    if host["user"] is not None:
+        destination = "{0}@{1}".format(host["user"], destination)
+    args.extend([destination, "bash -s -- --gzip"])
+    return args
+
+
+async def inspect_host(host, script, ssh_command, ssh_options, semaphore, timeout):
+    """Runs the inspection script on the host and returns (host, inspection data or None, error or None)."""
+    async with semaphore:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *build_ssh_args(ssh_command, ssh_options, host),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            return host, None, str(e)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(script), timeout
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return host, None, "timed out after {0}s".format(timeout)
+
+    if process.returncode != 0:
+        return (
+            host,
+            None,
+            "ssh exited with code {0}: {1}".format(
+                process.returncode, stderr.decode("utf-8", "replace").strip()
+            ),
+        )
+
+    try:
+        inspection = decode_discovery_output(stdout.decode("utf-8", "replace"))
+    except ValueError as e:
+        return host, None, "invalid inspection output: {0}".format(e)
+
+    if inspection.get("error"):
+        return host, None, inspection["error"]
+    return host, inspection, None
+
+
+async def inspect_hosts(hosts, script, ssh_command, ssh_options, forks, timeout):
+    """Inspects all hosts concurrently (at most `forks` at a time). Results are in the order of `hosts`."""
+    semaphore = asyncio.Semaphore(forks)
+    return await asyncio.gather(
+        *[
+            inspect_host(host, script, ssh_command, ssh_options, semaphore, timeout)
+            for host in hosts
+        ]
+    )
+
+
+def discover(
+    hosts,
+    ssh_command=("ssh",),
+    ssh_options=default_ssh_options,
+    forks=50,
+    timeout=60,
+    snapshot=None,
+    **process_options
+):
+    """Inspects all hosts and processes their labels.
+
+    Returns (updates, errors), where updates is a list of (host, process_labels() result) for hosts with labels
+    and errors is a list of (host, error message) for hosts which could not be inspected.
+    If snapshot is a dict, the inspection of each host is stored in it, by host name.
+    See process_inspections() for process_options.
+    """
+    with open(inspect_script_path, "rb") as file:
+        script = file.read()
+
+    results = asyncio.run(
+        inspect_hosts(hosts, script, ssh_command, ssh_options, forks, timeout)
+    )
+
+    inspections = []
+    errors = []
+    for host, inspection, error in results:
+        if error is not None:
+            errors.append((host, error))
+            continue
+        inspections.append((host, inspection))
+        if snapshot is not None:
+            snapshot[host["name"]] = inspection
+
+    return process_inspections(inspections, **process_options), errors
+
+
+def process_inspections(
+    inspections,
+    gateway_mode="filter",
+    traefik_local_port=8080,
+    gateway_service_name="homelab-traefik",
+    merge_replicas=True,
+    transport_options=None,
+):
+    """Processes the labels of (host, inspect-docker.sh output) pairs.
+
+    Returns a list of (host, process_labels() result) for hosts with labels.
+    With merge_replicas, routers replicated on several hosts are merged into load-balanced services.
+    """
+    updates = []
+    hosts_local_labels = []
+    for host, inspection in inspections:
+        labels = collect_container_labels(inspection.get("containers", []))
+        if len(labels) == 0:
+            continue
+
+        result = process_labels(
+            labels,
+            gateway_mode=gateway_mode,
+            traefik_local_port=traefik_local_port,
+            gateway_service_name=gateway_service_name,
+            containers=inspection.get("containers", []),
+            transport_options=transport_options,
+        )
+        if result["labels_count"] == 0:
+            continue
+        updates.append((host, result))
+        hosts_local_labels.append(labels)
+
+    if merge_replicas:
+        merge_replicated_results(
+            [result for _, result in updates],
+            hosts_local_labels,
+            weights=[host.get("weight") for host, _ in updates],
+            service_name=gateway_service_name,
+        )
+    return updates
+
+
+def build_route_index(updates):
+    """Indexes the routers of all hosts' Gateway labels. Returns (index, backends, errors).
+
+    Routers are identified by name, a router replicated on several hosts (same name and rule) being indexed once.
+    Routers with the same name but different rules on different hosts are identified as "router@host".
+    backends is a router => {"service": Gateway service name, "hosts": [names of the hosts serving it]} dict.
+    errors is a list of (host, error message) for routers whose rule could not be parsed.
+    """
+    index = RouteIndex()
+    rules = {}
+    backends = {}
+    errors = []
+    for host, result in updates:
+        for router_name, router in result["parsed_labels"]["routers"].items():
+            rule = router.get("rule")
+            if rule is None:
+                continue
+            if rules.setdefault(router_name, rule) != rule:
+                router_name = "{0}@{1}".format(router_name, host["name"])
+
+            if router_name not in index.routers:
+                priority = router.get("priority")
+                try:
+                    index.add_router(
+                        router_name,
+                        rule,
+                        priority=int(priority) if priority is not None else None,
+                    )
+                except (RuleSyntaxError, ValueError) as e:
+                    errors.append((host, "router {0}: {1}".format(router_name, e)))
+                    continue
+                backends[router_name] = {"service": router.get("service"), "hosts": []}
+            backends[router_name]["hosts"].append(host["name"])
+    return index, backends, errors
+
+
+def push_proxmox_notes(
+    updates, api_host, api_user, api_token_id, api_token_secret, validate_certs=False
+):
+    """Updates the notes of all VMs over a single keep-alive connection. Returns a list of (host, error) failures."""
+    context = ssl.create_default_context()
+    if not validate_certs:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    connection = http.client.HTTPSConnection(api_host, 8006, context=context)
+    headers = {
+        "Authorization": "PVEAPIToken={0}!{1}={2}".format(
+            api_user, api_token_id, api_token_secret
+        ),
+        "Content-Type": "application/json",
+    }
+
+    failures = []
+    try:
+        for host, result in updates:
+            path = "/api2/json/nodes/{0}/qemu/{1}/config".format(
+                host["proxmox_node"], host["proxmox_vmid"]
+            )
+            try:
+                connection.request(
+                    "PUT",
+                    path,
+                    body=json.dumps({"description": result["proxmox_notes"]}),
+                    headers=headers,
+                )
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                # The connection may have been dropped, a new one is established on the next request
+                connection.close()
+                failures.append((host, str(e)))
+                continue
+            if response.status != 200:
+                failures.append(
+                    (host, "HTTP {0} {1}".format(response.status, response.reason))
+                )
+    finally:
+        connection.close()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Discovers Traefik labels on all hosts of a group concurrently and updates their Proxmox notes in one batch"
+    )
+    parser.add_argument(
+        "-i", "--inventory", required=True, help="Path to the Ansible inventory"
+    )
+    parser.add_argument(
+        "--group", default="exposed", help="Inventory group to discover (default: exposed)"
+    )
+    parser.add_argument(
+        "--gateway-mode",
+        default="filter",
+        choices=["filter", "passthrough", "direct"],
+        help="How labels are turned into Gateway labels (default: filter)",
+    )
+    parser.add_argument("--traefik-local-port", type=int, default=8080)
+    parser.add_argument("--gateway-service-name", default="homelab-traefik")
+    parser.add_argument(
+        "--forks",
+        type=int,
+        default=50,
+        help="Maximum number of concurrent SSH connections (default: 50)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=60,
+        help="Seconds after which inspecting a host is given up (default: 60)",
+    )
+    parser.add_argument(
+        "--ssh-command",
+        default="ssh",
+        help="SSH client command (default: ssh). Split on spaces.",
+    )
+    parser.add_argument(
+        "--proxmox-api-host",
+        help="Proxmox API host (default: the proxmox_api_host variable of the hosts in the inventory)",
+    )
+    parser.add_argument("--proxmox-api-user", default="root@pam")
+    parser.add_argument("--proxmox-api-token-id", default="ansible")
+    parser.add_argument(
+        "--transport-option",
+        action="append",
+        default=[],
+        metavar="PROPERTY=VALUE",
+        help="Transport option of the Gateway service pointing to the local Traefik (e.g. loadbalancer.server.scheme=h2c). Can be given multiple times.",
+    )
+    parser.add_argument(
+        "--no-merge-replicas",
+        action="store_true",
+        help="Don't merge routers replicated on several hosts into load-balanced services",
+    )
+    parser.add_argument(
+        "--routing-report",
+        action="store_true",
+        help="Print the routes served by the Gateway per domain, and overlapping routes",
+    )
+    parser.add_argument(
+        "--save-snapshot",
+        metavar="PATH",
+        help="Save the inspection of all hosts to a JSON file, for bin/simulate_traefik_routes.py",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print the notes each VM would get, without updating Proxmox",
+    )
+    args = parser.parse_args()
+
+    transport_options = {}
+    for transport_option in args.transport_option:
+        if "=" not in transport_option:
+            parser.error("invalid --transport-option: {0}".format(transport_option))
+        property_name, value = transport_option.split("=", 1)
+        transport_options[property_name] = value
+    try:
+        validate_transport_options(transport_options)
+    except ValueError as e:
+        parser.error(str(e))
+
+    inventory = load_inventory(args.inventory)
+    hosts, host_errors = get_discovery_hosts(inventory, args.group)
+    proxmox_api_host = args.proxmox_api_host
+    if proxmox_api_host is None and not args.dry_run:
+        try:
+            proxmox_api_host = get_proxmox_api_host(inventory, hosts)
+        except ValueError as e:
+            parser.error(str(e))
+    snapshot = {} if args.save_snapshot else None
+    updates, errors = discover(
+        hosts,
+        snapshot=snapshot,
+        ssh_command=args.ssh_command.split(),
+        forks=args.forks,
+        timeout=args.timeout,
+        gateway_mode=args.gateway_mode,
+        traefik_local_port=args.traefik_local_port,
+        gateway_service_name=args.gateway_service_name,
+        merge_replicas=not args.no_merge_replicas,
+        transport_options=transport_options,
+    )
+    errors = host_errors + errors
+
+    for host, error in errors:
+        print("{0}: {1}".format(host["name"], error), file=sys.stderr)
+
+    if snapshot is not None:
+        with open(args.save_snapshot, "w") as file:
+            json.dump(snapshot, file, indent=2, sort_keys=True)
+
+    for host, result in updates:
+        print("{0} (VMID {1}): {2}".format(host["name"], host["proxmox_vmid"], result["msg"]))
+        for warning in result["warnings"]:
+            print("{0}: {1}".format(host["name"], warning), file=sys.stderr)
+        if args.dry_run:
+            print(result["proxmox_notes"])
+
+    if args.routing_report:
+        route_index, _, rule_errors = build_route_index(updates)
+        for host, error in rule_errors:
+            print("{0}: {1}".format(host["name"], error), file=sys.stderr)
+        print(format_routing_report(route_index))
+
+    updated_count = 0
+    if not args.dry_run and len(updates) > 0:
+        # The secret is deliberately not a command-line argument, so that it doesn't show up in process lists
+        api_token_secret = os.environ.get("PROXMOX_API_TOKEN_SECRET")
+        if api_token_secret is None:
+            sys.exit("Error: the PROXMOX_API_TOKEN_SECRET environment variable is not set")
+
+        failures = push_proxmox_notes(
+            updates,
+            proxmox_api_host,
+            args.proxmox_api_user,
+            args.proxmox_api_token_id,
+            api_token_secret,
+        )
+        for host, error in failures:
+            print(
+                "{0}: failed updating Proxmox notes: {1}".format(host["name"], error),
+                file=sys.stderr,
+            )
+        errors.extend(failures)
+        updated_count = len(updates) - len(failures)
+
+    print(
+        "Discovered {0} host(s): {1} updated, {2} failed".format(
+            len(hosts) + len(host_errors), updated_count, len(errors)
+        )
+    )
+    if len(errors) > 0:
+        sys.exit(1)
@@ -12,6 +12,9 @@ import sys
 import argparse
 from urllib.parse import urlparse
 import xml.etree.ElementTree as ET
+import yaml
+
+from roles_scanner import default_cache_path, project_source_url_str, scan_role_defaults
 
 parser = argparse.ArgumentParser(description="Extracts release feeds from roles")
 parser.add_argument(
@@ -22,6 +25,24 @@ parser.add_argument(
     "action",
     help='Pass "check" to list roles with missing feeds or "dump" to dump an OPML file',
 )
+parser.add_argument(
+    "--requirements-yml-path",
+    help="Path to a requirements.yml file, whose role repositories also get feeds (default: ROOT_DIR/templates/requirements.yml, if it exists)",
+)
+parser.add_argument(
+    "--forges-config-path",
+    help='Path to a YAML file mapping additional git hosts to forge types (e.g. `git.example.com: gitea`). Known forge types: "github", "gitlab", "gitea", "forgejo", "cgit", "radicle"',
+)
+parser.add_argument(
+    "--verbose",
+    action="store_true",
+    help="In check mode, list every repository without a release feed (e.g. radicle ones) instead of only counting them",
+)
+parser.add_argument(
+    "--cache-path",
+    default=default_cache_path,
+    help="Path to the role defaults metadata cache (default: %(default)s). Pass an empty value to disable the cache",
+)
 args = parser.parse_args()
 if args.action not in ["check", "dump"]:
     sys.exit('Error: possible arguments are "check" or "dump"')
@@ -31,43 +52,28 @@ excluded_paths = [
     # It doesn't have any tags anyway.
     "./upstream/roles/custom/matrix-bridge-appservice-kakaotalk/defaults",
 ]
-project_source_url_str = "# Project source code URL:"
 
 
-def get_roles_files_from_dir(root_dir):
-    file_paths = []
-    for dir_name, sub_dur_list, file_list in os.walk(root_dir):
-        for file_name in file_list:
-            if not dir_name.endswith("defaults") or file_name != "main.yml":
-                continue
-            if dir_name in excluded_paths:
-                continue
-            file_paths.append(os.path.join(dir_name, file_name))
-    return file_paths
-
-
-def get_git_repos_from_files(file_paths, break_on_missing_repos=False):
+def get_git_repos_from_defaults(role_defaults, break_on_missing_repos=False):
     git_repos = {}
     missing_repos = []
 
-    for file in file_paths:
-        file_lines = open(file, "r").readlines()
+    for defaults in role_defaults:
+        file = defaults["path"]
         found_project_repo = False
-        for line in file_lines:
-            project_repo_val = ""
-            if project_source_url_str in line:
-                # extract the value from a line like this:
-                # Project source code URL: https://github.com/mautrix/signal
-                project_repo_val = line.split(project_source_url_str)[1].strip()
-                if not validate_url(project_repo_val):
-                    print("Invalid url for line ", line)
-                    break
-            if project_repo_val != "":
-                if file not in git_repos:
-                    git_repos[file] = []
-
-                git_repos[file].append(project_repo_val)
-                found_project_repo = True
+        for project_repo_val in defaults["source_urls"]:
+            if not validate_url(project_repo_val):
+                print(
+                    "Invalid url for line ",
+                    "{0} {1}".format(project_source_url_str, project_repo_val),
+                )
+                break
+
+            if file not in git_repos:
+                git_repos[file] = []
+
+            git_repos[file].append(project_repo_val)
+            found_project_repo = True
 
         if not found_project_repo:
             missing_repos.append(file)
@@ -92,28 +98,171 @@ def validate_url(text):
         return False
 
 
+def get_feed_urls_github(repo_url):
+    return repo_url, repo_url.removesuffix(".git") + "/releases.atom"
+
+
+def get_feed_urls_gitlab(repo_url):
+    return repo_url, repo_url.removesuffix(".git") + "/-/tags?format=atom"
+
+
+def get_feed_urls_gitea(repo_url):
+    return repo_url, repo_url.removesuffix(".git") + ".atom"
+
+
+def get_feed_urls_forgejo(repo_url):
+    return repo_url, repo_url.removesuffix(".git") + "/releases.atom"
+
+
+def get_feed_urls_cgit(repo_url):
+    return repo_url, repo_url + "/atom/"
+
+
+def get_feed_urls_radicle(repo_url):
+    # Radicle repositories do not provide an Atom/RSS feed, so we can only point to them in the web explorer.
+    # Example: https://seed.radicle.garden/z2chD7Kt74JwEMafxTooxN7MaeYtK.git
+    parsed_url = urlparse(repo_url)
+    repository_id = parsed_url.path.strip("/").removesuffix(".git")
+    html_url = "https://app.radicle.xyz/nodes/{0}/rad:{1}".format(
+        parsed_url.hostname, repository_id
+    )
+    return html_url, None
+
+
+# Forge type => function returning the (html URL, Atom feed URL or None) for a repository URL
+feed_url_getters_by_forge_type = {
+    "github": get_feed_urls_github,
+    "gitlab": get_feed_urls_gitlab,
+    "gitea": get_feed_urls_gitea,
+    "forgejo": get_feed_urls_forgejo,
+    "cgit": get_feed_urls_cgit,
+    "radicle": get_feed_urls_radicle,
+}
+
+# Git host => forge type.
+# Additional hosts can be defined without changing this file, via --forges-config-path.
+forge_types_by_host = {
+    "github.com": "github",
+    "gitlab.com": "gitlab",
+    "mau.dev": "gitlab",
+    "framagit.org": "gitlab",
+    "dev.funkwhale.audio": "gitlab",
+    "git.zx2c4.com": "cgit",
+    "git.osgeo.org": "gitea",
+    "codeberg.org": "forgejo",
+    "code.forgejo.org": "forgejo",
+    "seed.radicle.garden": "radicle",
+    "seed.radicle.xyz": "radicle",
+    "iris.radicle.xyz": "radicle",
+    "rosa.radicle.xyz": "radicle",
+}
+
+# First host label => forge type, for self-hosted instances which are not listed in forge_types_by_host.
+# Example: `gitlab.gnome.org`
+forge_types_by_host_label = {
+    "gitlab": "gitlab",
+    "gitea": "gitea",
+    "forgejo": "forgejo",
+    "cgit": "cgit",
+}
+
+
+def load_forges_config(path):
+    with open(path, "r") as file:
+        config = yaml.safe_load(file) or {}
+
+    if not isinstance(config, dict):
+        sys.exit(
+            "Error: expected a mapping of git hosts to forge types in {0}".format(path)
+        )
+
+    forge_types = {}
+    for host, forge_type in config.items():
+        if forge_type not in feed_url_getters_by_forge_type:
+            sys.exit(
+                'Error: unknown forge type "{0}" for host {1} in {2}. Known forge types: {3}'.format(
+                    forge_type,
+                    host,
+                    path,
+                    ", ".join(feed_url_getters_by_forge_type),
+                )
+            )
+        forge_types[str(host).lower()] = forge_type
+    return forge_types
+
+
+def get_forge_type(repo_url):
+    host = urlparse(repo_url).hostname
+    if host is None:
+        return None
+
+    forge_type = forge_types_by_host.get(host)
+    if forge_type is not None:
+        return forge_type
+    return forge_types_by_host_label.get(host.split(".", 1)[0])
+
+
+# (forge type, git repository) of the repositories whose forge doesn't provide release feeds
+feedless_repos = []
+
+
+def resolve_feed_urls(git_repo):
+    """Returns the (html URL, Atom feed URL) for a repository. Either may be None, if the forge is unknown or has no feeds."""
+    # requirements.yml sources look like this: git+https://github.com/mother-of-all-self-hosting/ansible-role-miniflux.git
+    repo_url = git_repo.removeprefix("git+").rstrip("/")
+
+    forge_type = get_forge_type(repo_url)
+    if forge_type is None:
+        print("Unrecognized git repository: %s" % git_repo)
+        return None, None
+
+    html_url, feed_url = feed_url_getters_by_forge_type[forge_type](repo_url)
+    if feed_url is None:
+        feedless_repos.append((forge_type, git_repo))
+    return html_url, feed_url
+
+
+def print_feedless_repos(verbose=False):
+    """Lists repositories without release feeds, or only counts them per forge type, so that real problems stand out."""
+    if verbose:
+        for forge_type, git_repo in feedless_repos:
+            print(
+                "No release feed available for %s repository: %s" % (forge_type, git_repo)
+            )
+        return
+
+    counts_by_forge_type = {}
+    for forge_type, _ in feedless_repos:
+        counts_by_forge_type[forge_type] = counts_by_forge_type.get(forge_type, 0) + 1
+    if counts_by_forge_type:
+        print(
+            "No release feed available for %d repositories (%s), pass --verbose to list them"
+            % (
+                len(feedless_repos),
+                ", ".join(
+                    "%s: %d" % (forge_type, count)
+                    for forge_type, count in sorted(counts_by_forge_type.items())
+                ),
+            )
+        )
+
+
+def format_feed(name, html_url, feed_url):
+    return {
+        "text": name,
+        "title": name,
+        "type": "rss",
+        "htmlUrl": html_url,
+        "xmlUrl": feed_url,
+    }
+
+
 def format_feeds_from_git_repos(git_repos):
     feeds = {}
     for role, git_repos in git_repos.items():
         for idx, git_repo in enumerate(git_repos):
-            if "github" in git_repo:
-                atomFilePath = git_repo.replace(".git", "") + "/releases.atom"
-            elif "gitlab" in git_repo or "mau.dev" in git_repo:
-                atomFilePath = git_repo.replace(".git", "") + "/-/tags?format=atom"
-            elif "git.zx2c4.com" in git_repo:  # cgit
-                atomFilePath = git_repo + "/atom/"
-            elif "framagit.org" in git_repo:  # gitlab
-                atomFilePath = git_repo.replace(".git", "") + "/-/tags?format=atom"
-            elif "git.osgeo.org" in git_repo:  # gitea
-                atomFilePath = git_repo.replace(".git", "") + ".atom"
-            elif "dev.funkwhale.audio" in git_repo:  # gitlab
-                atomFilePath = git_repo.replace(".git", "") + "/-/tags?format=atom"
-            elif "codeberg.org" in git_repo:
-                atomFilePath = git_repo.replace(".git", "") + "/releases.atom"
-            elif "code.forgejo.org" in git_repo:
-                atomFilePath = git_repo.replace(".git", "") + "/releases.atom"
-            else:
-                print("Unrecognized git repository: %s" % git_repo)
+            html_url, atomFilePath = resolve_feed_urls(git_repo)
+            if atomFilePath is None:
                 continue
 
             role_name = role.split("/")[4]
@@ -129,18 +278,28 @@ def format_feeds_from_git_repos(git_repos):
                 # there is more than 1 project source code for this role
                 role_name += "-" + str(idx + 1)
 
-            feeds[role_name] = {
-                "text": role_name,
-                "title": role_name,
-                "type": "rss",
-                "htmlUrl": git_repo,
-                "xmlUrl": atomFilePath,
-            }
+            feeds[role_name] = format_feed(role_name, html_url, atomFilePath)
 
     feeds = {key: val for key, val in sorted(feeds.items(), key=lambda item: item[0])}
     return feeds
 
 
+def format_feeds_from_requirements(role_definitions):
+    """Formats feeds for the Ansible role repositories themselves, as defined in a requirements.yml file."""
+    feeds = {}
+    for role_definition in role_definitions:
+        if "src" not in role_definition or "name" not in role_definition:
+            continue
+
+        html_url, feed_url = resolve_feed_urls(role_definition["src"])
+        if feed_url is None:
+            continue
+
+        feed_name = "ansible-role-" + role_definition["name"]
+        feeds[feed_name] = format_feed(feed_name, html_url, feed_url)
+    return feeds
+
+
 def dump_opml_file_from_feeds(feeds):
     tree = ET.ElementTree()
 
@@ -162,12 +321,35 @@ def dump_opml_file_from_feeds(feeds):
 
 
 if __name__ == "__main__":
-    file_paths = get_roles_files_from_dir(root_dir=args.root_dir)
+    if args.forges_config_path is not None:
+        forge_types_by_host.update(load_forges_config(args.forges_config_path))
+
+    role_defaults = scan_role_defaults(
+        args.root_dir,
+        excluded_paths=excluded_paths,
+        cache_path=args.cache_path or None,
+        extract=("source_urls",),
+    )
     break_on_missing = args.action == "check"
-    git_repos = get_git_repos_from_files(
-        file_paths=file_paths, break_on_missing_repos=break_on_missing
+    git_repos = get_git_repos_from_defaults(
+        role_defaults=role_defaults, break_on_missing_repos=break_on_missing
     )
     feeds = format_feeds_from_git_repos(git_repos)
 
+    requirements_yml_path = args.requirements_yml_path
+    if requirements_yml_path is None:
+        requirements_yml_path = os.path.join(
+            args.root_dir, "templates", "requirements.yml"
+        )
+        if not os.path.isfile(requirements_yml_path):
+            requirements_yml_path = None
+    if requirements_yml_path is not None:
+        with open(requirements_yml_path, "r") as file:
+            feeds.update(format_feeds_from_requirements(yaml.safe_load(file) or []))
+        feeds = {key: feeds[key] for key in sorted(feeds)}
+
+    if args.action == "check":
+        print_feedless_repos(verbose=args.verbose)
+
     if args.action == "dump":
         dump_opml_file_from_feeds(feeds)
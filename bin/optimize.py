@@ -7,76 +7,253 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import argparse
+import bisect
+import itertools
+import json
+import os
 import regex
 import sys
 import yaml
 
-parser = argparse.ArgumentParser(
-    description="Optimizes the playbook based on enabled components found in vars.yml files"
-)
-parser.add_argument(
-    "--vars-paths",
-    help="Path to vars.yml configuration files to process",
-    required=True,
-)
-parser.add_argument(
-    "--src-requirements-yml-path",
-    help="Path to source requirements.yml file with all role definitions",
-    required=True,
-)
-parser.add_argument(
-    "--src-setup-yml-path", help="Path to source setup.yml file", required=True
-)
-parser.add_argument(
-    "--src-group-vars-yml-path", help="Path to source group vars file", required=True
-)
-parser.add_argument(
-    "--dst-requirements-yml-path",
-    help="Path to destination requirements.yml file, where role definitions will be saved",
-    required=True,
-)
-parser.add_argument(
-    "--dst-setup-yml-path", help="Path to destination setup.yml file", required=True
+import atomic_writes
+import vars_collector
+
+default_roles_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "roles"
 )
-parser.add_argument(
-    "--dst-group-vars-yml-path",
-    help="Path to destination group vars file",
-    required=True,
+default_templates_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"
 )
 
-args = parser.parse_args()
 
+def load_yaml_file(path):
+    with open(path, "r") as file:
+        return yaml.safe_load(file)
 
-def load_combined_variable_names_from_files(vars_yml_file_paths):
-    variable_names = set({})
-    for vars_path in vars_yml_file_paths:
-        with open(vars_path, "r") as file:
-            yaml_data = yaml.safe_load(file)
 
-            variable_names = variable_names | set(yaml_data.keys())
-    return variable_names
+def build_activation_index(role_definitions, variable_names):
+    """Returns a role name => variable names matching its activation_prefix dict, for all roles in use.
 
+    Variable names are sorted once, so that the names starting with each role's prefix are found via a binary search,
+    instead of checking every variable name against every role.
+    """
+    sorted_variable_names = sorted(variable_names)
 
-def load_yaml_file(path):
-    with open(path, "r") as file:
-        return yaml.safe_load(file)
+    activation_index = {}
+    for role_definition in role_definitions:
+        if "activation_prefix" not in role_definition:
+            continue
+
+        activation_prefix = role_definition["activation_prefix"]
+        if activation_prefix == "":
+            # Special value indicating "always activate".
+            activation_index[role_definition["name"]] = []
+            continue
+
+        start_idx = bisect.bisect_left(sorted_variable_names, activation_prefix)
+        end_idx = start_idx
+        while end_idx < len(sorted_variable_names) and sorted_variable_names[
+            end_idx
+        ].startswith(activation_prefix):
+            end_idx += 1
+
+        if end_idx > start_idx:
+            activation_index[role_definition["name"]] = sorted_variable_names[
+                start_idx:end_idx
+            ]
+
+    return activation_index
+
+
+def find_overlapping_activation_prefixes(role_definitions):
+    """Returns (role definition, other role definition) pairs where the first one's activation_prefix is a prefix of the other one's.
+
+    Variables meant for the other role then activate the first one as well.
+    """
+    prefixed_role_definitions = sorted(
+        [
+            definition
+            for definition in role_definitions
+            if definition.get("activation_prefix", "") != ""
+        ],
+        key=lambda definition: definition["activation_prefix"],
+    )
+
+    # Once sorted, all prefixes starting with a given prefix directly follow it
+    overlaps = []
+    for idx, role_definition in enumerate(prefixed_role_definitions):
+        for other_role_definition in itertools.islice(
+            prefixed_role_definitions, idx + 1, None
+        ):
+            if not other_role_definition["activation_prefix"].startswith(
+                role_definition["activation_prefix"]
+            ):
+                break
+            overlaps.append((role_definition, other_role_definition))
+    return overlaps
+
+
+def build_activation_report(role_definitions, activation_index, variable_files_by_name):
+    """Describes why each enabled role got enabled and which activation prefixes overlap."""
+    enabled_roles = []
+    for role_definition in role_definitions:
+        if role_definition["name"] not in activation_index:
+            continue
+        enabled_roles.append(
+            {
+                "name": role_definition["name"],
+                "activation_prefix": role_definition["activation_prefix"],
+                "variables": [
+                    {
+                        "name": variable_name,
+                        "files": variable_files_by_name.get(variable_name, []),
+                    }
+                    for variable_name in activation_index[role_definition["name"]]
+                ],
+            }
+        )
+
+    overlapping_activation_prefixes = []
+    for role_definition, other_role_definition in find_overlapping_activation_prefixes(
+        role_definitions
+    ):
+        overlapping_activation_prefixes.append(
+            {
+                "name": role_definition["name"],
+                "activation_prefix": role_definition["activation_prefix"],
+                "overlapped_name": other_role_definition["name"],
+                "overlapped_activation_prefix": other_role_definition[
+                    "activation_prefix"
+                ],
+            }
+        )
+
+    return {
+        "enabled_roles": enabled_roles,
+        "overlapping_activation_prefixes": overlapping_activation_prefixes,
+    }
+
+
+def format_activation_report(report):
+    """Formats an activation report as a human-readable table."""
+    rows = [("ROLE", "PREFIX", "VARIABLE", "FILES")]
+    for role in report["enabled_roles"]:
+        if len(role["variables"]) == 0:
+            rows.append((role["name"], '""', "(always enabled)", ""))
+            continue
+        for idx, variable in enumerate(role["variables"]):
+            rows.append(
+                (
+                    role["name"] if idx == 0 else "",
+                    role["activation_prefix"] if idx == 0 else "",
+                    variable["name"],
+                    ", ".join(variable["files"]),
+                )
+            )
+
+    column_widths = [max(len(row[idx]) for row in rows) for idx in range(3)]
+    lines = []
+    for row in rows:
+        lines.append(
+            "  ".join(
+                [value.ljust(column_widths[idx]) for idx, value in enumerate(row[:3])]
+                + [row[3]]
+            ).rstrip()
+        )
+
+    if len(report["overlapping_activation_prefixes"]) > 0:
+        lines.append("")
+        lines.append(
+            "Overlapping activation prefixes (variables of the second role also enable the first one):"
+        )
+        for overlap in report["overlapping_activation_prefixes"]:
+            lines.append(
+                "- {0} ({1}) overlaps {2} ({3})".format(
+                    overlap["name"],
+                    overlap["activation_prefix"],
+                    overlap["overlapped_name"],
+                    overlap["overlapped_activation_prefix"],
+                )
+            )
+
+    return "\n".join(lines)
+
+
+def write_activation_report(report, path, pending_writes):
+    write_to_file(json.dumps(report, indent=2) + "\n", path, pending_writes)
+
+
+# Matches the start of top-level sequence items (role definitions in requirements.yml).
+# Example: `- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-miniflux.git`
+regex_top_level_sequence_item = regex.compile("^-(\\s|$)")
 
+# Matches `name` keys of role definitions.
+# Example: `  name: miniflux`
+regex_role_definition_name = regex.compile("^(?:-\\s+|\\s+)name:\\s*(.+?)\\s*$")
 
-def is_role_definition_in_use(role_definition, used_variable_names):
-    for variable_name in used_variable_names:
-        if "activation_prefix" in role_definition:
-            if role_definition["activation_prefix"] == "":
-                # Special value indicating "always activate".
-                # We don't really need this dedicated if, but it's more obvious with it.
-                return True
-            if variable_name.startswith(role_definition["activation_prefix"]):
-                return True
-    return False
 
+def split_requirements_yml_contents(contents):
+    """Splits requirements.yml contents into the lines before the first role definition and the lines of each definition.
 
-def write_yaml_to_file(definitions, path):
-    with open(path, "w") as file:
-        yaml.dump(definitions, file)
+    A definition's lines start with the comments directly above it and end where the next definition's lines start.
+    """
+    header_lines = []
+    definitions_lines = []
+    for line in contents.split("\n"):
+        if regex_top_level_sequence_item.match(line) is None:
+            if len(definitions_lines) == 0:
+                header_lines.append(line)
+            else:
+                definitions_lines[-1].append(line)
+            continue
+
+        # Comments right above a definition belong to it
+        previous_lines = header_lines
+        if len(definitions_lines) > 0:
+            previous_lines = definitions_lines[-1]
+        comment_lines = []
+        while len(previous_lines) > 0 and previous_lines[-1].startswith("#"):
+            comment_lines.insert(0, previous_lines.pop())
+        definitions_lines.append(comment_lines + [line])
+    return header_lines, definitions_lines
+
+
+def get_role_definition_name(definition_lines):
+    for line in definition_lines:
+        name_matches = regex_role_definition_name.match(line)
+        if name_matches is not None:
+            return name_matches.group(1).strip("'\"")
+    return None
+
+
+def filter_requirements_yml_contents(contents, all_role_definitions, enabled_role_names):
+    """Returns requirements.yml contents with only the enabled role definitions.
+
+    The enabled definitions are sliced out of the source verbatim (keeping their order, formatting and comments),
+    instead of being serialized again. If the source's layout can't be matched to the parsed role definitions
+    (e.g. flow-style definitions), they get serialized with `yaml.dump` instead.
+    """
+    header_lines, definitions_lines = split_requirements_yml_contents(contents)
+
+    layout_matches = len(definitions_lines) == len(all_role_definitions) and all(
+        get_role_definition_name(lines) == definition["name"]
+        for lines, definition in zip(definitions_lines, all_role_definitions)
+    )
+    if not layout_matches or len(enabled_role_names) == 0:
+        return yaml.dump(
+            [
+                definition
+                for definition in all_role_definitions
+                if definition["name"] in enabled_role_names
+            ]
+        )
+
+    lines = list(header_lines)
+    for definition_lines, definition in zip(definitions_lines, all_role_definitions):
+        if definition["name"] in enabled_role_names:
+            lines.extend(definition_lines)
+    pop_trailing_blank_lines(lines)
+    return "\n".join(lines) + "\n"
 
 
 def read_file(path):
@@ -84,9 +261,8 @@ def read_file(path):
         return file.read()
 
 
-def write_to_file(contents, path):
-    with open(path, "w") as file:
-        file.write(contents)
+def write_to_file(contents, path, pending_writes):
+    pending_writes.write(path, contents)
 
 
 # Matches the beginning of role-specific blocks.
@@ -100,24 +276,33 @@ regex_role_specific_block_start = regex.compile(
 regex_role_specific_block_end = regex.compile("^\\s*#\\s*/role-specific:\\s*([^\\s]+)$")
 
 
-def process_file_contents(file_name, enabled_role_names, known_role_names):
-    contents = read_file(file_name)
+def read_source_file(path, source_contents):
+    """Reads a source file, unless its contents were already provided (keyed by path) in source_contents."""
+    if path not in source_contents:
+        source_contents[path] = read_file(path)
+    return source_contents[path]
+
+
+def process_file_contents(
+    file_name, enabled_role_names, known_role_names, contents=None
+):
+    if contents is None:
+        contents = read_file(file_name)
 
     lines_preserved = []
     role_specific_stack = []
 
-    for line_number, line in enumerate(contents.split("\n")):
+    for line_number, line in enumerate(contents.split("\n"), start=1):
         # Stage 1: looking for a role-specific starting block
         start_role_matches = regex_role_specific_block_start.match(line)
         if start_role_matches is not None:
             role_name = start_role_matches.group(1)
             if role_name not in known_role_names:
                 raise Exception(
-                    "Found start block for role {0} on line {1} in file {2}, but it is not a known role name found among: {3}".format(
+                    "Found start block for role {0} on line {1} in file {2}, but it is not a known role name (see requirements.yml)".format(
                         role_name,
                         line_number,
                         file_name,
-                        known_role_names,
                     )
                 )
             role_specific_stack.append(role_name)
@@ -129,11 +314,10 @@ def process_file_contents(file_name, enabled_role_names, known_role_names):
             role_name = end_role_matches.group(1)
             if role_name not in known_role_names:
                 raise Exception(
-                    "Found end block for role {0} on line {1} in file {2}, but it is not a known role name found among: {3}".format(
+                    "Found end block for role {0} on line {1} in file {2}, but it is not a known role name (see requirements.yml)".format(
                         role_name,
                         line_number,
                         file_name,
-                        known_role_names,
                     )
                 )
 
@@ -178,9 +362,172 @@ def process_file_contents(file_name, enabled_role_names, known_role_names):
             )
         )
 
+    return "\n".join(collapse_blank_lines(lines_preserved))
+
+
+def validate_template_contents(file_name, contents, known_role_names):
+    """Checks all role-specific blocks in the contents in a single pass, without stopping at the first problem.
+
+    Returns a list of (line number, message) problems and the set of role references (e.g. `galaxy/miniflux`) found.
+    """
+    problems = []
+    role_references = set()
+    # (role name, line number) of the currently open blocks
+    role_specific_stack = []
+
+    for line_number, line in enumerate(contents.split("\n"), start=1):
+        # Both markers and role references contain this, so most lines are skipped without running any regex
+        if "role" not in line:
+            continue
+
+        start_role_matches = regex_role_specific_block_start.match(line)
+        if start_role_matches is not None:
+            role_name = start_role_matches.group(1)
+            if role_name not in known_role_names:
+                problems.append(
+                    (line_number, "start block for unknown role {0}".format(role_name))
+                )
+            role_specific_stack.append((role_name, line_number))
+            continue
+
+        end_role_matches = regex_role_specific_block_end.match(line)
+        if end_role_matches is None:
+            role_matches = regex_role_reference.match(line)
+            if role_matches is not None:
+                role_references.add(role_matches.group(1))
+            continue
+
+        role_name = end_role_matches.group(1)
+        if role_name not in known_role_names:
+            problems.append(
+                (line_number, "end block for unknown role {0}".format(role_name))
+            )
+
+        if len(role_specific_stack) == 0:
+            problems.append(
+                (
+                    line_number,
+                    "end block for role {0} without a start block".format(role_name),
+                )
+            )
+            continue
+
+        last_role_name, last_line_number = role_specific_stack[-1]
+        if role_name == last_role_name:
+            role_specific_stack.pop()
+            continue
+
+        if role_name not in [name for name, _ in role_specific_stack]:
+            problems.append(
+                (
+                    line_number,
+                    "end block for role {0}, but the last start block was for role {1} (line {2})".format(
+                        role_name, last_role_name, last_line_number
+                    ),
+                )
+            )
+            # Most likely a typo, so we treat it as the end of the last block to avoid follow-up problems
+            role_specific_stack.pop()
+            continue
+
+        # The blocks started after this role's block were not closed before it
+        while role_specific_stack[-1][0] != role_name:
+            unclosed_role_name, unclosed_line_number = role_specific_stack.pop()
+            problems.append(
+                (
+                    unclosed_line_number,
+                    "start block for role {0} is not closed before the end block for role {1} (line {2})".format(
+                        unclosed_role_name, role_name, line_number
+                    ),
+                )
+            )
+        role_specific_stack.pop()
+
+    for role_name, line_number in role_specific_stack:
+        problems.append(
+            (line_number, "start block for role {0} is never closed".format(role_name))
+        )
+
+    problems.sort(key=lambda problem: problem[0])
+    return problems, role_references
+
+
+def load_role_names_with_line_numbers(requirements_yml_contents):
+    """Returns (role name or None, line number) for each role definition in the requirements.yml contents."""
+    root_node = yaml.compose(requirements_yml_contents, Loader=yaml.SafeLoader)
+    if not isinstance(root_node, yaml.SequenceNode):
+        return []
+
+    role_names = []
+    for definition_node in root_node.value:
+        role_name = None
+        if isinstance(definition_node, yaml.MappingNode):
+            for key_node, value_node in definition_node.value:
+                if key_node.value == "name" and isinstance(value_node, yaml.ScalarNode):
+                    role_name = value_node.value
+        role_names.append((role_name, definition_node.start_mark.line + 1))
+    return role_names
+
+
+def validate_templates(
+    requirements_yml_path, setup_yml_path, group_vars_yml_path, source_contents=None
+):
+    """Returns `FILE:LINE: message` strings for all problems found in the given template files."""
+    if source_contents is None:
+        source_contents = {}
+
+    errors = []
+
+    known_role_names = set()
+    requirements_line_numbers = {}
+    for role_name, line_number in load_role_names_with_line_numbers(
+        read_source_file(requirements_yml_path, source_contents)
+    ):
+        if role_name is None:
+            errors.append(
+                "{0}:{1}: role definition without a name".format(
+                    requirements_yml_path, line_number
+                )
+            )
+            continue
+        if role_name in known_role_names:
+            errors.append(
+                "{0}:{1}: role {2} is already defined on line {3}".format(
+                    requirements_yml_path,
+                    line_number,
+                    role_name,
+                    requirements_line_numbers[role_name],
+                )
+            )
+            continue
+        known_role_names.add(role_name)
+        requirements_line_numbers[role_name] = line_number
+
+    setup_yml_role_references = set()
+    for path in (setup_yml_path, group_vars_yml_path):
+        problems, role_references = validate_template_contents(
+            path, read_source_file(path, source_contents), known_role_names
+        )
+        for line_number, message in problems:
+            errors.append("{0}:{1}: {2}".format(path, line_number, message))
+        if path == setup_yml_path:
+            setup_yml_role_references = role_references
+
+    for role_name, line_number in requirements_line_numbers.items():
+        if "galaxy/" + role_name not in setup_yml_role_references:
+            errors.append(
+                "{0}:{1}: role {2} is not used in {3}".format(
+                    requirements_yml_path, line_number, role_name, setup_yml_path
+                )
+            )
+
+    return errors
+
+
+def collapse_blank_lines(lines):
     lines_final = []
     sequential_blank_lines_count = 0
-    for line in lines_preserved:
+    for line in lines:
         if line != "":
             lines_final.append(line)
             sequential_blank_lines_count = 0
@@ -191,40 +538,889 @@ def process_file_contents(file_name, enabled_role_names, known_role_names):
             sequential_blank_lines_count += 1
             continue
 
-    return "\n".join(lines_final)
+    return lines_final
 
 
-vars_paths = args.vars_paths.split(" ")
-used_variable_names = load_combined_variable_names_from_files(vars_paths)
+# Matches identifiers (variable names, Jinja names, prefixes like `'miniflux_'`, etc.) in YAML and Jinja text.
+regex_identifier = regex.compile("[A-Za-z_][A-Za-z0-9_]*")
 
-all_role_definitions = load_yaml_file(args.src_requirements_yml_path)
+# Matches the beginning of a top-level variable definition.
+# Example: `miniflux_hostname: "{{ mash_playbook_hostname }}"`
+regex_top_level_definition = regex.compile("^([A-Za-z_][A-Za-z0-9_]*)\\s*:")
 
-enabled_role_definitions = []
-for role_definition in all_role_definitions:
-    if "name" not in role_definition:
-        raise Exception(
-            "Role definition does not have a name and should be adjusted to have one: {0}".format(
-                role_definition
+# Matches role references in setup.yml.
+# Example: `- role: galaxy/miniflux`
+regex_role_reference = regex.compile("^\\s*(?:-\\s+)?role:\\s*([^\\s]+)\\s*$")
+
+
+def pop_trailing_blank_lines(lines):
+    trailing_blank_lines = []
+    while len(lines) > 0 and lines[-1] == "":
+        trailing_blank_lines.append(lines.pop())
+    return trailing_blank_lines
+
+
+def split_top_level_definitions(contents):
+    """Splits YAML contents into (variable name, lines) chunks, one per top-level definition.
+
+    Lines which are not part of any definition (document markers, comments, blank lines between definitions)
+    are returned as chunks with a variable name of None.
+    """
+    chunks = []
+    current_name = None
+    current_lines = []
+
+    for line in contents.split("\n"):
+        definition_matches = regex_top_level_definition.match(line)
+        if definition_matches is None and (
+            line == "" or line[0] in " \t" or current_name is None
+        ):
+            current_lines.append(line)
+            continue
+
+        # A column-0 line (a new definition or a comment) ends the current definition.
+        # Trailing blank lines are not considered part of it.
+        trailing_blank_lines = []
+        if current_name is not None:
+            trailing_blank_lines = pop_trailing_blank_lines(current_lines)
+        chunks.append((current_name, current_lines))
+
+        if definition_matches is None:
+            current_name = None
+            current_lines = trailing_blank_lines + [line]
+        else:
+            if len(trailing_blank_lines) > 0:
+                chunks.append((None, trailing_blank_lines))
+            current_name = definition_matches.group(1)
+            current_lines = [line]
+
+    trailing_blank_lines = []
+    if current_name is not None:
+        trailing_blank_lines = pop_trailing_blank_lines(current_lines)
+    chunks.append((current_name, current_lines))
+    if len(trailing_blank_lines) > 0:
+        chunks.append((None, trailing_blank_lines))
+
+    return chunks
+
+
+def collect_identifiers(text, identifiers):
+    identifiers.update(regex_identifier.findall(text))
+
+
+def collect_identifiers_from_directory(directory_path, identifiers):
+    for dir_name, sub_dir_list, file_list in os.walk(directory_path):
+        for file_name in file_list:
+            with open(os.path.join(dir_name, file_name), "rb") as file:
+                collect_identifiers(file.read().decode("utf-8", "ignore"), identifiers)
+
+
+def collect_definition_identifiers(chunks, identifiers_by_name):
+    """Collects the identifiers each definition (from split_top_level_definitions() chunks) refers to, by variable name."""
+    for name, lines in chunks:
+        if name is not None:
+            identifiers = identifiers_by_name.setdefault(name, set())
+            # The variable name itself (on the first line) is not a reference
+            collect_identifiers(lines[0][len(name) :], identifiers)
+            collect_identifiers("\n".join(lines[1:]), identifiers)
+
+
+def build_names_by_prefix(names):
+    names_by_prefix = {}
+    for name in names:
+        for idx, character in enumerate(name):
+            if character == "_":
+                names_by_prefix.setdefault(name[: idx + 1], []).append(name)
+    return names_by_prefix
+
+
+def find_referenced_names(identifiers, names, names_by_prefix):
+    """Returns the names which are referenced by the given identifiers.
+
+    Besides exact matches, identifiers ending with `_` (e.g. `'miniflux_' + item`) reference all names they're a prefix of,
+    because variable names may be put together dynamically.
+    """
+    referenced_names = set(identifiers & names)
+    for identifier in identifiers:
+        if identifier.endswith("_") and identifier in names_by_prefix:
+            referenced_names.update(names_by_prefix[identifier])
+    return referenced_names
+
+
+def prune_unused_variables(contents, root_texts, role_directory_paths):
+    """Drops top-level variable definitions that nothing reachable uses.
+
+    Variables are reachable if they're referenced from any of root_texts or any file in role_directory_paths,
+    or from the definition of another reachable variable.
+    Matching is on identifiers appearing anywhere in the text, which over-approximates real usage,
+    so that only definitions which certainly can't be used get dropped.
+
+    Returns the new contents and the sorted list of pruned variable names.
+    """
+    chunks = split_top_level_definitions(contents)
+
+    identifiers_by_name = {}
+    collect_definition_identifiers(chunks, identifiers_by_name)
+
+    names = set(identifiers_by_name.keys())
+    names_by_prefix = build_names_by_prefix(names)
+
+    root_identifiers = set()
+    for text in root_texts:
+        collect_identifiers(text, root_identifiers)
+    for role_directory_path in role_directory_paths:
+        collect_identifiers_from_directory(role_directory_path, root_identifiers)
+
+    reachable_names = set()
+    pending_names = list(find_referenced_names(root_identifiers, names, names_by_prefix))
+    while len(pending_names) > 0:
+        name = pending_names.pop()
+        if name in reachable_names:
+            continue
+        reachable_names.add(name)
+        pending_names.extend(
+            find_referenced_names(identifiers_by_name[name], names, names_by_prefix)
+            - reachable_names
+        )
+
+    lines_preserved = []
+    for name, lines in chunks:
+        if name is None or name in reachable_names:
+            lines_preserved.extend(lines)
+
+    return "\n".join(collapse_blank_lines(lines_preserved)), sorted(
+        names - reachable_names
+    )
+
+
+def find_role_directory_paths(roles_path, setup_yml_contents, enabled_role_names):
+    """Returns the directories of all roles which the (optimized) setup.yml may run.
+
+    These are the roles referenced in setup.yml (e.g. `galaxy/miniflux`, `mash/playbook_base`)
+    and all enabled roles from requirements.yml, as those can also be included by other roles.
+    """
+    role_directory_paths = set()
+    for line in setup_yml_contents.split("\n"):
+        role_matches = regex_role_reference.match(line)
+        if role_matches is not None:
+            role_directory_paths.add(os.path.join(roles_path, role_matches.group(1)))
+    for role_name in enabled_role_names:
+        role_directory_paths.add(os.path.join(roles_path, "galaxy", role_name))
+    return sorted(role_directory_paths)
+
+
+# Matches the beginning of a play's roles list.
+regex_play_roles = regex.compile("^(\\s*)roles:\\s*$")
+
+
+def split_role_entries(contents):
+    """Splits setup.yml contents into chunks of lines, where each role list entry is its own chunk."""
+    chunks = []
+    current_lines = []
+    entries_indentation = None
+    roles_indentation = None
+
+    for line in contents.split("\n"):
+        indentation = len(line) - len(line.lstrip(" "))
+        is_blank = line.strip() == ""
+
+        if roles_indentation is None:
+            roles_matches = regex_play_roles.match(line)
+            current_lines.append(line)
+            if roles_matches is not None:
+                roles_indentation = len(roles_matches.group(1))
+            continue
+
+        if (
+            entries_indentation is None
+            and not is_blank
+            and line.lstrip().startswith("- ")
+        ):
+            entries_indentation = indentation
+
+        if not is_blank and indentation <= roles_indentation:
+            # End of the roles list
+            chunks.append(current_lines)
+            current_lines = [line]
+            roles_indentation = None
+            entries_indentation = None
+            continue
+
+        is_entry_start = entries_indentation is not None and line.startswith(
+            " " * entries_indentation + "- "
+        )
+
+        if is_entry_start or (
+            entries_indentation is not None
+            and not is_blank
+            and indentation == entries_indentation
+        ):
+            # Comments between entries are not part of any entry
+            chunks.append(current_lines)
+            current_lines = [line]
+        else:
+            current_lines.append(line)
+
+    chunks.append(current_lines)
+    return chunks
+
+
+# Matches `tags:` keys, with an optional inline value.
+# Example: `tags: [setup-all, install-all]`, `- tags:`
+regex_tags_key = regex.compile("^(\\s*(?:-\\s+)?)tags:\\s*(.*?)\\s*$")
+
+# Matches list items.
+# Example: `        - install-miniflux`
+regex_list_item = regex.compile("^(\\s*)-\\s+(.+?)\\s*$")
+
+# Tasks with this tag run no matter which tags were requested, so roles having them can never be skipped.
+always_tag = "always"
+
+
+def extract_tags(contents):
+    """Returns all tags found in `tags:` definitions (inline or as lists) in the given YAML contents."""
+    tags = set()
+    tags_key_column = None
+
+    for line in contents.split("\n"):
+        if tags_key_column is not None:
+            if line.strip() == "":
+                continue
+            item_matches = regex_list_item.match(line)
+            if item_matches is not None and len(item_matches.group(1)) >= tags_key_column:
+                tags.add(item_matches.group(2).strip("'\""))
+                continue
+            tags_key_column = None
+
+        tags_matches = regex_tags_key.match(line)
+        if tags_matches is None:
+            continue
+
+        inline_value = tags_matches.group(2)
+        if inline_value == "":
+            tags_key_column = len(tags_matches.group(1))
+            continue
+        for tag in inline_value.strip("[]").split(","):
+            tag = tag.strip().strip("'\"")
+            if tag != "" and "{{" not in tag:
+                tags.add(tag)
+
+    return tags
+
+
+def find_role_reference(lines):
+    for line in lines:
+        role_matches = regex_role_reference.match(line)
+        if role_matches is not None:
+            return role_matches.group(1)
+    return None
+
+
+def build_tag_role_index(setup_yml_contents, roles_path):
+    """Builds a tag => role references (e.g. `galaxy/miniflux`) index for the roles in setup.yml.
+
+    Tags come from the role entries in setup.yml and from the task files of the (installed) roles themselves.
+    Returns the index and the list of role directories which are missing, whose tags are thus unknown.
+    """
+    tag_role_index = {}
+    missing_role_directory_paths = []
+
+    for lines in split_role_entries(setup_yml_contents):
+        role_reference = find_role_reference(lines)
+        if role_reference is None:
+            continue
+
+        role_tags = extract_tags("\n".join(lines))
+
+        role_directory_path = os.path.join(roles_path, role_reference)
+        if not os.path.isdir(role_directory_path):
+            missing_role_directory_paths.append(role_directory_path)
+        tasks_directory_path = os.path.join(role_directory_path, "tasks")
+        for dir_name, sub_dir_list, file_list in os.walk(tasks_directory_path):
+            for file_name in file_list:
+                if file_name.endswith((".yml", ".yaml")):
+                    role_tags |= extract_tags(read_file(os.path.join(dir_name, file_name)))
+
+        for tag in role_tags:
+            tag_role_index.setdefault(tag, set()).add(role_reference)
+
+    return tag_role_index, missing_role_directory_paths
+
+
+def select_roles_for_tags(tags, tag_role_index):
+    """Returns the references of the roles which may have tasks running for the given tags.
+
+    These are the roles carrying any of the tags, and roles with tasks tagged `always`.
+    """
+    role_references = set(tag_role_index.get(always_tag, set()))
+    for tag in tags:
+        role_references |= tag_role_index.get(tag, set())
+    return role_references
+
+
+def find_roles_providing_variables(
+    role_references, setup_yml_contents, vars_texts, roles_path
+):
+    """Returns role_references, along with the other roles of setup.yml whose variables these roles may need.
+
+    The playbook's own local roles (`mash/`), which the minimal playbook always keeps, are included as well.
+
+    Dropping a role from the play also drops its defaults, while group vars still refer to them
+    (e.g. `miniflux_database_hostname: "{{ postgres_connection_hostname }}"`, which needs the postgres role).
+    Starting from the files of the given roles (and the rest of setup.yml), variables are followed through their
+    definitions in vars_texts (group vars, host vars) and through the defaults of other roles, whose roles are then
+    kept as well. Like prune_unused_variables(), this matches identifiers anywhere in the text,
+    so it keeps too many roles rather than too few.
+    """
+    role_entries = split_role_entries(setup_yml_contents)
+
+    identifiers_by_name = {}
+    for vars_text in vars_texts:
+        collect_definition_identifiers(
+            split_top_level_definitions(vars_text), identifiers_by_name
+        )
+
+    pending_role_references = list(role_references)
+    role_references_by_name = {}
+    for lines in role_entries:
+        role_reference = find_role_reference(lines)
+        if role_reference is None:
+            continue
+        if role_reference.startswith("mash/"):
+            pending_role_references.append(role_reference)
+        for file_name in ["defaults/main.yml", "vars/main.yml"]:
+            path = os.path.join(roles_path, role_reference, file_name)
+            if not os.path.isfile(path):
+                continue
+            for name, _ in split_top_level_definitions(read_file(path)):
+                if name is not None:
+                    role_references_by_name.setdefault(name, set()).add(
+                        role_reference
+                    )
+
+    names = set(identifiers_by_name.keys()) | set(role_references_by_name.keys())
+    names_by_prefix = build_names_by_prefix(names)
+
+    identifiers = set()
+    for lines in role_entries:
+        if find_role_reference(lines) is None:
+            collect_identifiers("\n".join(lines), identifiers)
+
+    kept_role_references = set()
+    reachable_names = set()
+    while True:
+        while len(pending_role_references) > 0:
+            role_reference = pending_role_references.pop()
+            if role_reference in kept_role_references:
+                continue
+            kept_role_references.add(role_reference)
+            collect_identifiers_from_directory(
+                os.path.join(roles_path, role_reference), identifiers
             )
+
+        new_names = (
+            find_referenced_names(identifiers, names, names_by_prefix) - reachable_names
         )
-    if is_role_definition_in_use(role_definition, used_variable_names):
-        enabled_role_definitions.append(role_definition)
+        if len(new_names) == 0:
+            return kept_role_references
 
-write_yaml_to_file(enabled_role_definitions, args.dst_requirements_yml_path)
+        identifiers = set()
+        for name in new_names:
+            reachable_names.add(name)
+            identifiers |= identifiers_by_name.get(name, set())
+            pending_role_references.extend(role_references_by_name.get(name, set()))
 
-known_role_names = tuple(
-    map(lambda definition: definition["name"], all_role_definitions)
-)
-enabled_role_names = tuple(
-    map(lambda definition: definition["name"], enabled_role_definitions)
-)
 
-setup_yml_processed = process_file_contents(
-    args.src_setup_yml_path, enabled_role_names, known_role_names
-)
-write_to_file(setup_yml_processed, args.dst_setup_yml_path)
+def generate_minimal_playbook(setup_yml_contents, role_references):
+    """Returns setup.yml contents with only the given role entries, and the playbook's own local roles (`mash/`)."""
+    lines = []
+    for chunk_lines in split_role_entries(setup_yml_contents):
+        # Template markers (left in when the playbook is not optimized) mean nothing to Ansible
+        chunk_lines = [
+            line
+            for line in chunk_lines
+            if regex_role_specific_block_start.match(line) is None
+            and regex_role_specific_block_end.match(line) is None
+        ]
+
+        role_reference = find_role_reference(chunk_lines)
+        if (
+            role_reference is None
+            or role_reference.startswith("mash/")
+            or role_reference in role_references
+        ):
+            lines.extend(chunk_lines)
+            continue
 
-group_vars_yml_processed = process_file_contents(
-    args.src_group_vars_yml_path, enabled_role_names, known_role_names
+        # Comments right above a dropped entry are about it, so they go away too
+        while len(lines) > 0 and lines[-1].lstrip().startswith("#"):
+            lines.pop()
+
+    return "\n".join(collapse_blank_lines(lines))
+
+
+# Matches role entry conditions which depend on a single variable.
+# Example: `- when: devture_timesync_installation_enabled | bool`
+regex_simple_when_condition = regex.compile(
+    "^(\\s*)(-\\s+)?when:\\s*([A-Za-z_][A-Za-z0-9_]*)\\s*(\\|\\s*bool)?\\s*$"
 )
-write_to_file(group_vars_yml_processed, args.dst_group_vars_yml_path)
+
+# Matches the hosts line of a play.
+# Example: `  hosts: "{{ target if target is defined else 'mash_servers' }}"`
+regex_play_hosts = regex.compile("^(\\s*(?:-\\s+)?hosts:\\s*)(.+)$")
+
+# String values which Ansible's `bool` filter turns into false
+false_bool_strings = ("false", "no", "off", "0", "n", "f")
+
+
+def get_host_name_from_vars_path(path):
+    """Returns the host name for a `host_vars/HOST.yml` or `host_vars/HOST/...` path, or None for other paths."""
+    parts = os.path.abspath(path).split(os.sep)
+    if "host_vars" not in parts[:-1]:
+        return None
+    host_idx = len(parts) - parts[::-1].index("host_vars")
+    host_name = parts[host_idx]
+    if host_idx == len(parts) - 1:
+        # Like vars_collector, files without one of the known extensions are named after the host as they are
+        base_name, extension = os.path.splitext(host_name)
+        if extension in vars_collector.vars_file_extensions:
+            host_name = base_name
+    return host_name
+
+
+def find_role_condition(lines):
+    """Returns the (variable name, uses bool filter) condition of a role entry guarded by a single-variable `when:`.
+
+    Returns None for other entries (no condition, or a more complex one).
+    """
+    entry_indentation = None
+    for line in lines:
+        when_matches = regex_simple_when_condition.match(line)
+        if entry_indentation is None:
+            if not line.lstrip().startswith("- "):
+                continue
+            entry_indentation = len(line) - len(line.lstrip(" "))
+            if when_matches is not None and when_matches.group(2) is not None:
+                return when_matches.group(3), when_matches.group(4) is not None
+            continue
+        # Only the entry's own `when:` counts, not one nested in its other keys
+        if (
+            when_matches is not None
+            and when_matches.group(2) is None
+            and len(when_matches.group(1)) == entry_indentation + 2
+        ):
+            return when_matches.group(3), when_matches.group(4) is not None
+    return None
+
+
+def resolve_static_condition(condition, host_vars):
+    """Returns False if the condition is known to be false given the host's own variables, otherwise None.
+
+    Only literal values defined in the host's vars files are considered.
+    Anything templated, or not defined there, may change at runtime (group vars, facts) and is left alone.
+    """
+    variable_name, uses_bool_filter = condition
+    if variable_name not in host_vars:
+        return None
+
+    value = host_vars[variable_name]
+    if value is False:
+        return False
+    if uses_bool_filter and isinstance(value, str):
+        if value.strip().lower() in false_bool_strings:
+            return False
+    if uses_bool_filter and value == 0 and not isinstance(value, bool):
+        return False
+    return None
+
+
+def build_hosts_pattern(hosts_value, host_names, include):
+    """Restricts a play's hosts pattern to (include=True) or away from (include=False) the given hosts."""
+    hosts_pattern = yaml.safe_load(hosts_value)
+    hosts_regex = "~^({0})$".format("|".join(regex.escape(name) for name in host_names))
+    return json.dumps(hosts_pattern + (":&" if include else ":!") + hosts_regex)
+
+
+def restrict_play_hosts(contents, host_names, include):
+    lines = []
+    for line in contents.split("\n"):
+        hosts_matches = regex_play_hosts.match(line)
+        if hosts_matches is not None:
+            line = hosts_matches.group(1) + build_hosts_pattern(
+                hosts_matches.group(2), host_names, include
+            )
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def specialize_setup_yml_per_host(
+    setup_yml_contents, host_vars_by_host_name, vars_texts, roles_path
+):
+    """Adds host-specialized plays to setup.yml, without the role entries which are statically disabled for those hosts.
+
+    A role entry is statically disabled for a host when its single-variable `when:` guard is false given the literal
+    values in the host's vars files (see resolve_static_condition). Its entry is only dropped if none of the roles
+    remaining for the host need its variables (see find_roles_providing_variables): otherwise it is kept, so that its
+    defaults are still loaded, and its tasks are skipped as usual.
+
+    Hosts with the same dropped roles share a play, the other hosts run the original play, which excludes them.
+    As Ansible runs plays one after another, this trades some parallelism across differently configured hosts
+    for not evaluating and skipping the dropped roles' tasks on each of them.
+    Extra vars (`-e`) can't bring dropped roles back in the specialized plays.
+    """
+    role_entries = split_role_entries(setup_yml_contents)
+    all_role_references = set()
+    role_conditions = {}
+    for lines in role_entries:
+        role_reference = find_role_reference(lines)
+        if role_reference is None:
+            continue
+        all_role_references.add(role_reference)
+        condition = find_role_condition(lines)
+        if condition is not None:
+            role_conditions[role_reference] = condition
+
+    host_names_by_dropped_role_references = {}
+    for host_name, host_vars in sorted(host_vars_by_host_name.items()):
+        disabled_role_references = set(
+            role_reference
+            for role_reference, condition in role_conditions.items()
+            if resolve_static_condition(condition, host_vars) is False
+        )
+        if len(disabled_role_references) == 0:
+            continue
+        kept_role_references = find_roles_providing_variables(
+            all_role_references - disabled_role_references,
+            setup_yml_contents,
+            vars_texts,
+            roles_path,
+        )
+        dropped_role_references = frozenset(
+            disabled_role_references - kept_role_references
+        )
+        if len(dropped_role_references) > 0:
+            host_names_by_dropped_role_references.setdefault(
+                dropped_role_references, []
+            ).append(host_name)
+
+    if len(host_names_by_dropped_role_references) == 0:
+        return setup_yml_contents
+
+    specialized_host_names = sorted(
+        host_name
+        for host_names in host_names_by_dropped_role_references.values()
+        for host_name in host_names
+    )
+    plays = [
+        restrict_play_hosts(
+            setup_yml_contents.rstrip("\n"), specialized_host_names, include=False
+        )
+    ]
+    for dropped_role_references, host_names in sorted(
+        host_names_by_dropped_role_references.items(), key=lambda item: item[1]
+    ):
+        play = generate_minimal_playbook(
+            setup_yml_contents, all_role_references - dropped_role_references
+        )
+        # The document start marker (`---`) is kept only once, at the top
+        if play.startswith("---\n"):
+            play = play[len("---\n") :]
+        plays.append(restrict_play_hosts(play.rstrip("\n"), host_names, include=True))
+    return "\n\n".join(plays) + "\n"
+
+
+def load_host_vars_by_host_name(vars_paths):
+    """Returns a host name => variables dict, for the hosts whose host_vars files are among vars_paths."""
+    host_vars_by_host_name = {}
+    for vars_path in vars_paths:
+        host_name = get_host_name_from_vars_path(vars_path)
+        if host_name is None:
+            continue
+        host_vars = vars_collector.load_vars_file(vars_path)
+        # Like with Ansible, files loaded later (in sorted order) take precedence
+        host_vars_by_host_name.setdefault(host_name, {}).update(
+            host_vars if isinstance(host_vars, dict) else {}
+        )
+    return host_vars_by_host_name
+
+
+def optimize_playbook(
+    vars_paths,
+    src_requirements_yml_path,
+    dst_requirements_yml_path,
+    src_setup_yml_path,
+    dst_setup_yml_path,
+    src_group_vars_yml_path,
+    dst_group_vars_yml_path,
+    source_contents=None,
+    prune_unused_variables_enabled=False,
+    roles_path=default_roles_path,
+    activation_report_path=None,
+    specialize_plays_per_host_enabled=False,
+    pending_writes=None,
+):
+    """Writes optimized versions of the requirements.yml, setup.yml and group vars files.
+
+    source_contents optionally holds the already-read contents of source files (keyed by path),
+    so that callers which have read them anyway do not cause them to be read again.
+
+    With prune_unused_variables_enabled, group vars definitions which neither setup.yml, the vars files,
+    the enabled roles (installed in roles_path) nor other used group vars refer to are dropped as well.
+
+    With an activation_report_path, a JSON report of which variables (from which files) enabled each role is written there.
+
+    With specialize_plays_per_host_enabled, setup.yml gets host-specialized plays for the hosts (whose host_vars files
+    are among vars_paths) which statically disable some roles, see specialize_setup_yml_per_host().
+
+    All files are written atomically, once everything has been generated (see atomic_writes).
+    Callers passing their own pending_writes need to commit them.
+    """
+    if pending_writes is None:
+        with atomic_writes.PendingWrites() as pending_writes:
+            optimize_playbook(
+                vars_paths,
+                src_requirements_yml_path,
+                dst_requirements_yml_path,
+                src_setup_yml_path,
+                dst_setup_yml_path,
+                src_group_vars_yml_path,
+                dst_group_vars_yml_path,
+                source_contents=source_contents,
+                prune_unused_variables_enabled=prune_unused_variables_enabled,
+                roles_path=roles_path,
+                activation_report_path=activation_report_path,
+                specialize_plays_per_host_enabled=specialize_plays_per_host_enabled,
+                pending_writes=pending_writes,
+            )
+        return
+
+    if source_contents is None:
+        source_contents = {}
+
+    variable_files_by_name = vars_collector.collect_variable_files_by_name(vars_paths)
+
+    all_role_definitions = yaml.safe_load(
+        read_source_file(src_requirements_yml_path, source_contents)
+    )
+
+    for role_definition in all_role_definitions:
+        if "name" not in role_definition:
+            raise Exception(
+                "Role definition does not have a name and should be adjusted to have one: {0}".format(
+                    role_definition
+                )
+            )
+
+    activation_index = build_activation_index(
+        all_role_definitions, variable_files_by_name.keys()
+    )
+    enabled_role_definitions = [
+        role_definition
+        for role_definition in all_role_definitions
+        if role_definition["name"] in activation_index
+    ]
+
+    requirements_yml_processed = filter_requirements_yml_contents(
+        read_source_file(src_requirements_yml_path, source_contents),
+        all_role_definitions,
+        activation_index,
+    )
+    write_to_file(requirements_yml_processed, dst_requirements_yml_path, pending_writes)
+
+    if activation_report_path is not None:
+        write_activation_report(
+            build_activation_report(
+                all_role_definitions, activation_index, variable_files_by_name
+            ),
+            activation_report_path,
+            pending_writes,
+        )
+
+    known_role_names = set(
+        map(lambda definition: definition["name"], all_role_definitions)
+    )
+    enabled_role_names = set(
+        map(lambda definition: definition["name"], enabled_role_definitions)
+    )
+
+    setup_yml_processed = process_file_contents(
+        src_setup_yml_path,
+        enabled_role_names,
+        known_role_names,
+        contents=read_source_file(src_setup_yml_path, source_contents),
+    )
+
+    group_vars_yml_processed = process_file_contents(
+        src_group_vars_yml_path,
+        enabled_role_names,
+        known_role_names,
+        contents=read_source_file(src_group_vars_yml_path, source_contents),
+    )
+
+    if specialize_plays_per_host_enabled:
+        missing_role_directory_paths = [
+            path
+            for path in find_role_directory_paths(
+                roles_path, setup_yml_processed, enabled_role_names
+            )
+            if not os.path.isdir(path)
+        ]
+        if len(missing_role_directory_paths) > 0:
+            # Without a role's files we can't know whether other roles need its defaults, so we can't drop it safely
+            print(
+                "Not specializing plays per host, because some roles are not installed (run `just roles` first): {0}".format(
+                    ", ".join(missing_role_directory_paths)
+                ),
+                file=sys.stderr,
+            )
+        else:
+            setup_yml_processed = specialize_setup_yml_per_host(
+                setup_yml_processed,
+                load_host_vars_by_host_name(vars_paths),
+                [group_vars_yml_processed] + vars_collector.read_vars_files(vars_paths),
+                roles_path,
+            )
+
+    write_to_file(setup_yml_processed, dst_setup_yml_path, pending_writes)
+
+    if prune_unused_variables_enabled:
+        role_directory_paths = find_role_directory_paths(
+            roles_path, setup_yml_processed, enabled_role_names
+        )
+        missing_role_directory_paths = [
+            path for path in role_directory_paths if not os.path.isdir(path)
+        ]
+        if len(missing_role_directory_paths) > 0:
+            # Without a role's files we can't know which variables it uses, so we can't prune anything safely
+            print(
+                "Not pruning unused variables, because some roles are not installed (run `just roles` first): {0}".format(
+                    ", ".join(missing_role_directory_paths)
+                ),
+                file=sys.stderr,
+            )
+        else:
+            root_texts = [setup_yml_processed] + vars_collector.read_vars_files(vars_paths)
+            group_vars_yml_processed, pruned_variable_names = prune_unused_variables(
+                group_vars_yml_processed, root_texts, role_directory_paths
+            )
+            print(
+                "Pruned {0} unused variables from {1}".format(
+                    len(pruned_variable_names), dst_group_vars_yml_path
+                )
+            )
+
+    write_to_file(group_vars_yml_processed, dst_group_vars_yml_path, pending_writes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Optimizes the playbook based on enabled components found in vars.yml files"
+    )
+    parser.add_argument(
+        "--vars-paths",
+        help="Path to vars.yml configuration files to process",
+    )
+    parser.add_argument(
+        "--src-requirements-yml-path",
+        default=os.path.join(default_templates_path, "requirements.yml"),
+        help="Path to source requirements.yml file with all role definitions",
+    )
+    parser.add_argument(
+        "--src-setup-yml-path",
+        default=os.path.join(default_templates_path, "setup.yml"),
+        help="Path to source setup.yml file",
+    )
+    parser.add_argument(
+        "--src-group-vars-yml-path",
+        default=os.path.join(default_templates_path, "group_vars_mash_servers"),
+        help="Path to source group vars file",
+    )
+    parser.add_argument(
+        "--dst-requirements-yml-path",
+        help="Path to destination requirements.yml file, where role definitions will be saved",
+    )
+    parser.add_argument(
+        "--dst-setup-yml-path", help="Path to destination setup.yml file"
+    )
+    parser.add_argument(
+        "--dst-group-vars-yml-path",
+        help="Path to destination group vars file",
+    )
+    parser.add_argument(
+        "--activation-report-path",
+        help="Path to a JSON file where to save a report of which variables (from which files) enabled each role. The report is also printed as a table.",
+    )
+    parser.add_argument(
+        "--show-activation-report",
+        help="Only print a previously saved activation report (see --activation-report-path) as a table, instead of optimizing",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Only check the source files (role-specific blocks, role definitions) and report all problems found, instead of optimizing",
+    )
+
+    parser.add_argument(
+        "--prune-unused-variables",
+        action="store_true",
+        help="Also drop group vars definitions which nothing in setup.yml, the vars files, the enabled roles or other used group vars refers to (requires installed roles)",
+    )
+    parser.add_argument(
+        "--roles-path",
+        default=default_roles_path,
+        help="Path to the roles directory (containing galaxy/ and mash/), used when pruning unused variables and specializing plays per host",
+    )
+    parser.add_argument(
+        "--specialize-plays-per-host",
+        action="store_true",
+        help="Add host-specialized plays to setup.yml, without the `when:`-guarded roles which a host's vars statically disable and no other role needs (requires installed roles)",
+    )
+    args = parser.parse_args()
+
+    if args.validate:
+        errors = validate_templates(
+            args.src_requirements_yml_path,
+            args.src_setup_yml_path,
+            args.src_group_vars_yml_path,
+        )
+        for error in errors:
+            print(error, file=sys.stderr)
+        if len(errors) > 0:
+            sys.exit("Found {0} problems".format(len(errors)))
+        sys.exit(0)
+
+    if args.show_activation_report is not None:
+        with open(args.show_activation_report, "r") as file:
+            print(format_activation_report(json.load(file)))
+        sys.exit(0)
+
+    for required_arg in (
+        "vars_paths",
+        "dst_requirements_yml_path",
+        "dst_setup_yml_path",
+        "dst_group_vars_yml_path",
+    ):
+        if getattr(args, required_arg) is None:
+            parser.error(
+                "the following argument is required: --{0}".format(
+                    required_arg.replace("_", "-")
+                )
+            )
+
+    optimize_playbook(
+        vars_paths=args.vars_paths.split(" "),
+        src_requirements_yml_path=args.src_requirements_yml_path,
+        dst_requirements_yml_path=args.dst_requirements_yml_path,
+        src_setup_yml_path=args.src_setup_yml_path,
+        dst_setup_yml_path=args.dst_setup_yml_path,
+        src_group_vars_yml_path=args.src_group_vars_yml_path,
+        dst_group_vars_yml_path=args.dst_group_vars_yml_path,
+        prune_unused_variables_enabled=args.prune_unused_variables,
+        specialize_plays_per_host_enabled=args.specialize_plays_per_host,
+        roles_path=args.roles_path,
+        activation_report_path=args.activation_report_path,
+    )
+
+    if args.activation_report_path is not None:
+        with open(args.activation_report_path, "r") as file:
+            print(format_activation_report(json.load(file)))
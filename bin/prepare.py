@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -* encoding: utf8 *-
+
+# SPDX-FileCopyrightText: 2026 MASH project contributors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Prepares the files derived from the templates directory (requirements.yml, setup.yml, group_vars/mash_servers).
+#
+# The md5 hash of the template each derived file was last prepared from is kept in `run/<file name>.srchash`.
+# When a template changes, its derived file is refreshed by copying the template over it,
+# and if the playbook had been optimized (see `just optimize`), the optimization is re-applied.
+#
+# All derived files are checked, hashed and refreshed in this single process, reading each template only once,
+# instead of going through separate `just`, `md5sum`, `cat` and `cp` invocations for each file.
+# Everything is written atomically (see atomic_writes.py), with hashes being committed last.
+#
+# It can also generate a minimal playbook (see `--minimal-playbook-for-tags`), which only lists the roles
+# that have tasks for the given tags and the roles whose variables those need,
+# so that `just install-service-minimal` does not make Ansible load every role.
+
+import argparse
+import hashlib
+import os
+import sys
+
+import atomic_writes
+
+root_directory_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+templates_directory_path = os.path.join(root_directory_path, "templates")
+run_directory_path = os.path.join(root_directory_path, "run")
+inventory_directory_path = os.path.join(root_directory_path, "inventory")
+optimization_vars_files_file_path = os.path.join(
+    run_directory_path, "optimization-vars-files.state"
+)
+# Report of which variables enabled each role, as of the last optimization (see `just optimize-activation-report`)
+activation_report_file_path = os.path.join(
+    run_directory_path, "optimization-activation-report.json"
+)
+# optimize_playbook() option => state file which enables it when present.
+# These are created by `just optimize-prune-variables` and `just optimize-per-host-plays` and removed by `just optimize-reset`.
+optimization_option_file_paths = {
+    "prune_unused_variables_enabled": os.path.join(
+        run_directory_path, "optimization-prune-unused-variables.state"
+    ),
+    "specialize_plays_per_host_enabled": os.path.join(
+        run_directory_path, "optimization-specialize-plays-per-host.state"
+    ),
+}
+
+# Generated next to setup.yml, so that Ansible loads the same playbook-adjacent group_vars/ for it
+minimal_playbook_file_path = os.path.join(root_directory_path, "setup-minimal.yml")
+
+# Derived file name => (source template path, destination path)
+template_derived_files = {
+    "requirements.yml": (
+        os.path.join(templates_directory_path, "requirements.yml"),
+        os.path.join(root_directory_path, "requirements.yml"),
+    ),
+    "setup.yml": (
+        os.path.join(templates_directory_path, "setup.yml"),
+        os.path.join(root_directory_path, "setup.yml"),
+    ),
+    "group_vars/mash_servers": (
+        os.path.join(templates_directory_path, "group_vars_mash_servers"),
+        os.path.join(root_directory_path, "group_vars", "mash_servers"),
+    ),
+}
+
+
+def get_hash_path(dst_path):
+    return os.path.join(run_directory_path, os.path.basename(dst_path) + ".srchash")
+
+
+def read_saved_hash(hash_path):
+    try:
+        with open(hash_path, "r") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def save_hash(hash_path, src_hash, pending_writes):
+    pending_writes.write(hash_path, src_hash + "\n")
+
+
+def read_source_files(names, source_contents):
+    """Reads (once) the source templates for the given derived file names into source_contents, keyed by path."""
+    for name in names:
+        src_path, _ = template_derived_files[name]
+        if src_path not in source_contents:
+            with open(src_path, "rb") as file:
+                source_contents[src_path] = file.read()
+
+
+def load_optimization_vars_paths():
+    if not os.path.isfile(optimization_vars_files_file_path):
+        return None
+    with open(optimization_vars_files_file_path, "r") as file:
+        return file.read().split()
+
+
+def load_optimization_options():
+    return {
+        option: os.path.isfile(path)
+        for option, path in optimization_option_file_paths.items()
+    }
+
+
+def optimize_for_vars_paths(vars_paths, source_contents=None, pending_writes=None):
+    """Optimizes the playbook for the given vars.yml paths, remembers them and saves the hashes of all templates.
+
+    Hashes are written (and renamed into place) after the files derived from the templates,
+    so an interrupted run never leaves a hash claiming that a stale or missing file is up-to-date.
+    """
+    if pending_writes is None:
+        with atomic_writes.PendingWrites() as pending_writes:
+            optimize_for_vars_paths(vars_paths, source_contents, pending_writes)
+        return
+
+    # Imported lazily, because the optimizer has extra dependencies (regex) which only `just optimize` users need
+    import optimize
+
+    if source_contents is None:
+        source_contents = {}
+    read_source_files(template_derived_files.keys(), source_contents)
+
+    requirements_yml_src, requirements_yml_dst = template_derived_files[
+        "requirements.yml"
+    ]
+    setup_yml_src, setup_yml_dst = template_derived_files["setup.yml"]
+    group_vars_src, group_vars_dst = template_derived_files["group_vars/mash_servers"]
+
+    optimize.optimize_playbook(
+        vars_paths=vars_paths,
+        src_requirements_yml_path=requirements_yml_src,
+        dst_requirements_yml_path=requirements_yml_dst,
+        src_setup_yml_path=setup_yml_src,
+        dst_setup_yml_path=setup_yml_dst,
+        src_group_vars_yml_path=group_vars_src,
+        dst_group_vars_yml_path=group_vars_dst,
+        source_contents={
+            path: contents.decode("utf-8") for path, contents in source_contents.items()
+        },
+        activation_report_path=activation_report_file_path,
+        pending_writes=pending_writes,
+        **load_optimization_options(),
+    )
+
+    pending_writes.write(
+        optimization_vars_files_file_path, " ".join(vars_paths) + "\n"
+    )
+
+    for src_path, dst_path in template_derived_files.values():
+        src_hash = hashlib.md5(source_contents[src_path]).hexdigest()
+        save_hash(get_hash_path(dst_path), src_hash, pending_writes)
+
+
+def prepare_files(names):
+    """Makes sure the given derived files exist and are up-to-date with their templates."""
+    source_contents = {}
+    read_source_files(names, source_contents)
+
+    with atomic_writes.PendingWrites() as pending_writes:
+        changed_names = []
+        for name in names:
+            src_path, dst_path = template_derived_files[name]
+            contents = source_contents[src_path]
+            src_hash = hashlib.md5(contents).hexdigest()
+            hash_path = get_hash_path(dst_path)
+
+            if not os.path.isfile(dst_path) or not os.path.isfile(hash_path):
+                pending_writes.write(dst_path, contents)
+                save_hash(hash_path, src_hash, pending_writes)
+                continue
+
+            if read_saved_hash(hash_path) != src_hash:
+                pending_writes.write(dst_path, contents)
+                save_hash(hash_path, src_hash, pending_writes)
+                changed_names.append(name)
+
+        if len(changed_names) == 0:
+            return
+
+        vars_paths = load_optimization_vars_paths()
+        if vars_paths is not None:
+            # The playbook was optimized before, so the fresh copies need to be optimized again.
+            # This is done once, no matter how many templates changed, and replaces the pending copies.
+            optimize_for_vars_paths(vars_paths, source_contents, pending_writes)
+
+
+def generate_minimal_playbook_for_tags(tags):
+    """Writes a playbook with only the roles relevant to the given tags and returns its path.
+
+    Falls back to returning the path of the full setup.yml when the relevant roles can't be determined reliably.
+    """
+    prepare_files(list(template_derived_files.keys()))
+    _, setup_yml_path = template_derived_files["setup.yml"]
+
+    try:
+        # Imported lazily, because the optimizer has extra dependencies (regex)
+        import optimize
+        import vars_collector
+    except ImportError as e:
+        print(
+            "Not generating a minimal playbook ({0}), using the full one".format(e),
+            file=sys.stderr,
+        )
+        return setup_yml_path
+
+    with open(setup_yml_path, "r") as file:
+        setup_yml_contents = file.read()
+
+    tag_role_index, missing_role_directory_paths = optimize.build_tag_role_index(
+        setup_yml_contents, optimize.default_roles_path
+    )
+    if len(missing_role_directory_paths) > 0:
+        # The tags of roles which are not installed are unknown, so any of them may be needed
+        print(
+            "Not generating a minimal playbook ({0} roles are not installed, see `just roles`), using the full one".format(
+                len(missing_role_directory_paths)
+            ),
+            file=sys.stderr,
+        )
+        return setup_yml_path
+
+    # Roles whose defaults the selected roles (or the group/host vars they use) need are kept, along with their tasks
+    vars_texts = []
+    _, group_vars_path = template_derived_files["group_vars/mash_servers"]
+    vars_texts.append(optimize.read_file(group_vars_path))
+    try:
+        vars_texts.extend(
+            vars_collector.read_vars_files(
+                vars_collector.find_vars_file_paths(inventory_directory_path)
+            )
+        )
+    except Exception as e:
+        print(
+            "Not generating a minimal playbook ({0}), using the full one".format(e),
+            file=sys.stderr,
+        )
+        return setup_yml_path
+
+    role_references = optimize.find_roles_providing_variables(
+        optimize.select_roles_for_tags(tags, tag_role_index),
+        setup_yml_contents,
+        vars_texts,
+        optimize.default_roles_path,
+    )
+    contents = optimize.generate_minimal_playbook(setup_yml_contents, role_references)
+    with atomic_writes.PendingWrites() as pending_writes:
+        pending_writes.write(minimal_playbook_file_path, contents)
+    return minimal_playbook_file_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prepares the playbook files derived from templates (requirements.yml, setup.yml, group_vars/mash_servers)"
+    )
+    parser.add_argument(
+        "names",
+        nargs="*",
+        help="Derived files to prepare, among: {0} (default: all)".format(
+            ", ".join(template_derived_files.keys())
+        ),
+    )
+    parser.add_argument(
+        "--optimize-for-vars-paths",
+        help="Space-separated paths to vars.yml files to remember and optimize the playbook for (instead of only preparing files)",
+    )
+    parser.add_argument(
+        "--minimal-playbook-for-tags",
+        help="Comma-separated tags to generate a minimal playbook for (after preparing all files). The path of the playbook to run is printed.",
+    )
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in template_derived_files:
+            parser.error("unknown derived file: {0}".format(name))
+
+    if args.optimize_for_vars_paths is not None:
+        optimize_for_vars_paths(args.optimize_for_vars_paths.split())
+    elif args.minimal_playbook_for_tags is not None:
+        print(
+            generate_minimal_playbook_for_tags(
+                [tag for tag in args.minimal_playbook_for_tags.split(",") if tag != ""]
+            )
+        )
+    else:
+        prepare_files(args.names or list(template_derived_files.keys()))
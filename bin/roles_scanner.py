@@ -0,0 +1,374 @@
+# -* encoding: utf8 *-
+
+# SPDX-FileCopyrightText: 2026 MASH project contributors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Walks the roles tree once and extracts release metadata from each role's defaults/main.yml file.
+# This is shared by feeds.py (project source code URLs) and versions.py (component versions),
+# so that each defaults file is found and read a single time for both kinds of data.
+#
+# Extracted metadata is cached on disk (see `default_cache_path`), keyed by file path, for all scanned roots.
+# A cached entry is reused as-is while the file's mtime and size are unchanged.
+# If those changed, but the file's content hash did not (e.g. after a fresh `git clone` or `agru` re-install),
+# the entry is reused as well, so only roles whose defaults really changed get re-parsed.
+# Deleting the cache file is always safe.
+#
+# Each consumer only asks for the kinds of metadata it reads (see `metadata_kinds`): feeds.py only needs
+# source URLs, which a line scan finds, so it never pays for extracting versions.
+# Files whose versions do need parsing are parsed on a process pool (see `extract_role_defaults_metadata_many`).
+# Most defaults files define their `*_version` variables as simple one-line scalars,
+# which are picked up by a line-based fast path without a full (and slow, pure-Python) YAML parse.
+
+import concurrent.futures
+import datetime
+import functools
+import hashlib
+import json
+import os
+import re
+import yaml
+
+from atomic_writes import PendingWrites
+
+project_source_url_str = "# Project source code URL:"
+
+default_cache_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "var",
+    "roles-scanner-cache.json",
+)
+
+# Bump this whenever the extracted data changes shape or meaning, to invalidate existing caches.
+cache_format_version = 1
+
+# Below this many files to parse, the cost of starting worker processes outweighs the gains.
+parallel_parsing_min_files = 16
+
+# Directories which never contain the defaults/main.yml files we're after.
+# They're skipped entirely instead of being traversed.
+pruned_dir_names = frozenset(
+    [
+        ".git",
+        ".github",
+        "__pycache__",
+        "docs",
+        "files",
+        "handlers",
+        "meta",
+        "molecule",
+        "node_modules",
+        "tasks",
+        "templates",
+        "tests",
+        "var",
+        "vars",
+    ]
+)
+
+
+def iter_defaults_files(root_dir, excluded_paths=()):
+    """Yields the path of every `defaults/main.yml` file found under root_dir, in a stable order."""
+    pending_dirs = [root_dir]
+    while pending_dirs:
+        dir_path = pending_dirs.pop()
+        try:
+            with os.scandir(dir_path) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        is_defaults_dir = os.path.basename(dir_path) == "defaults"
+
+        sub_dirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in pruned_dir_names:
+                    sub_dirs.append(entry.path)
+                continue
+
+            if is_defaults_dir and entry.name == "main.yml":
+                if dir_path in excluded_paths:
+                    continue
+                yield entry.path
+
+        # Reversed, so that directories are popped (visited) in alphabetical order
+        pending_dirs.extend(reversed(sub_dirs))
+
+
+def extract_source_urls(contents):
+    """Extracts the values of all `# Project source code URL:` comments, in the order they appear."""
+    source_urls = []
+    for line in contents.splitlines():
+        if project_source_url_str in line:
+            # extract the value from a line like this:
+            # Project source code URL: https://github.com/mautrix/signal
+            source_urls.append(line.split(project_source_url_str)[1].strip())
+    return source_urls
+
+
+# Matches top-level `*_version` variable definitions.
+# Example: `miniflux_version: 2.2.1`
+regex_version_definition = re.compile(r"^([A-Za-z0-9_]+_version):(?:[ \t]+(.*?))?[ \t]*$")
+
+# Matches one-line scalar values that can be handled without a YAML parser, optionally followed by a comment.
+# Example: `2.2.1`, `"{{ miniflux_container_image_tag }}"`, `'v1.0' # some comment`
+regex_simple_scalar = re.compile(
+    r"""^(?:"([^"\\]*)"|'([^']*)'|([A-Za-z0-9][A-Za-z0-9._+\-/]*))(?:[ \t]+#.*)?$"""
+)
+
+# Characters which start something other than a simple `key: value` mapping entry at the top level
+# (documents markers, sequences, quoted or complex keys, anchors, merge keys, flow collections, directives, etc.)
+top_level_unsupported_start_chars = frozenset("-.?\"'{[&*!|>%@`<")
+
+yaml_resolver = yaml.resolver.Resolver()
+
+
+def extract_versions_fast(contents):
+    """Extracts all top-level `*_version` variables using a line-based scan.
+
+    Returns None if the file uses YAML constructs which this can't handle exactly the way a YAML parser would.
+    """
+    versions = {}
+    seen_content = False
+    last_key_was_version = False
+
+    for line in contents.splitlines():
+        if line == "" or line.startswith("#"):
+            continue
+
+        if line[0] in " \t":
+            if last_key_was_version:
+                # The value continues on the next lines (multi-line scalars, nested structures, etc.)
+                return None
+            seen_content = True
+            continue
+
+        if line == "---" and not seen_content:
+            seen_content = True
+            continue
+        seen_content = True
+
+        if line[0] in top_level_unsupported_start_chars:
+            return None
+
+        last_key_was_version = False
+
+        definition_matches = regex_version_definition.match(line)
+        if definition_matches is None:
+            key_part, _, value_part = line.partition(":")
+            if key_part.rstrip().endswith("_version"):
+                # Spelled in a way we don't handle (e.g. `some_version : 1`)
+                return None
+            if is_unterminated_flow_value(value_part.strip()):
+                # A quoted scalar or flow collection spanning multiple lines may contain anything
+                return None
+            continue
+
+        value_matches = regex_simple_scalar.match(definition_matches.group(2) or "")
+        if value_matches is None:
+            return None
+
+        double_quoted, single_quoted, plain = value_matches.groups()
+        if plain is None:
+            value = double_quoted if double_quoted is not None else single_quoted
+        elif (
+            yaml_resolver.resolve(yaml.ScalarNode, plain, (True, False))
+            == "tag:yaml.org,2002:str"
+        ):
+            value = plain
+        else:
+            # Numbers, dates, booleans, etc. - let YAML convert just this one scalar
+            value = yaml.safe_load(plain)
+
+        versions[definition_matches.group(1)] = to_cacheable_value(value)
+        last_key_was_version = True
+
+    return versions
+
+
+def is_unterminated_flow_value(value):
+    if value.startswith('"'):
+        return value.count('"') - value.count('\\"') < 2
+    if value.startswith("'"):
+        return value.count("'") < 2
+    if value.startswith(("[", "{")):
+        opening_count = value.count("[") + value.count("{")
+        return opening_count > value.count("]") + value.count("}")
+    return False
+
+
+def extract_versions(contents):
+    """Extracts all top-level `*_version` variables (unfiltered) from the YAML contents."""
+    versions = extract_versions_fast(contents)
+    if versions is not None:
+        return versions
+
+    data = yaml.safe_load(contents)
+    if not isinstance(data, dict):
+        return {}
+
+    versions = {}
+    for key, value in data.items():
+        if isinstance(key, str) and key.endswith("_version"):
+            versions[key] = to_cacheable_value(value)
+    return versions
+
+
+def to_cacheable_value(value):
+    # YAML may give us dates (e.g. `x_version: 2024-01-01`) and other types which JSON can't hold.
+    # Those are only ever used as strings, so we convert them early on to get the same results with or without a cache.
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+# Kind of metadata => function extracting it from a defaults file's contents
+metadata_kinds = {
+    "source_urls": extract_source_urls,
+    "versions": extract_versions,
+}
+
+
+def extract_role_defaults_metadata(contents, extract=tuple(metadata_kinds)):
+    """Extracts the given kinds of metadata (keys of `metadata_kinds`) from a defaults file's contents."""
+    return {kind: metadata_kinds[kind](contents) for kind in extract}
+
+
+def extract_role_defaults_metadata_many(contents_list, jobs=None, extract=tuple(metadata_kinds)):
+    """Extracts metadata for each of the given file contents, in order, using up to `jobs` worker processes."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    # Only the YAML parsing of versions is worth spreading over worker processes
+    if jobs <= 1 or len(contents_list) < parallel_parsing_min_files or "versions" not in extract:
+        return [extract_role_defaults_metadata(contents, extract) for contents in contents_list]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        # `map` returns results in submission order, so the outcome doesn't depend on scheduling
+        return list(
+            executor.map(
+                functools.partial(extract_role_defaults_metadata, extract=extract),
+                contents_list,
+                chunksize=max(1, len(contents_list) // (jobs * 4)),
+            )
+        )
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "r") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(cache, dict) or cache.get("version") != cache_format_version:
+        return {}
+
+    entries = cache.get("entries")
+    if not isinstance(entries, dict):
+        return {}
+    return entries
+
+
+def save_cache(cache_path, entries):
+    # Written atomically, so that concurrent runs never see a half-written cache
+    with PendingWrites() as pending_writes:
+        pending_writes.write(
+            cache_path,
+            json.dumps({"version": cache_format_version, "entries": entries}),
+        )
+
+
+def metadata_from_cache_entry(path, cache_entry, extract):
+    metadata = {"path": path}
+    for kind in extract:
+        metadata[kind] = cache_entry[kind]
+    return metadata
+
+
+def scan_role_defaults(
+    root_dir,
+    excluded_paths=(),
+    cache_path=default_cache_path,
+    jobs=None,
+    extract=tuple(metadata_kinds),
+):
+    """Returns the extracted metadata of each defaults/main.yml file under root_dir.
+
+    Only the kinds of metadata listed in `extract` (keys of `metadata_kinds`) are extracted and returned.
+    Results are in the stable order of `iter_defaults_files`, regardless of how many `jobs` parse files in parallel.
+    Pass `cache_path=None` to disable the on-disk cache.
+    The cache is rewritten once the whole tree has been scanned, dropping entries for files that are gone.
+    """
+    cache_entries = {} if cache_path is None else load_cache(cache_path)
+    new_cache_entries = {}
+
+    results = []
+    # (index in results, path, cache key, kinds to extract, decoded contents) for files which need parsing
+    pending = []
+
+    for path in iter_defaults_files(root_dir, excluded_paths):
+        cache_key = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = cache_entries.get(cache_key)
+        contents = None
+
+        if cached is not None and not (
+            cached.get("mtime_ns") == stat.st_mtime_ns
+            and cached.get("size") == stat.st_size
+        ):
+            with open(path, "rb") as file:
+                contents = file.read()
+            if cached.get("sha256") == hashlib.sha256(contents).hexdigest():
+                cached = dict(cached, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            else:
+                cached = None
+
+        if cached is None:
+            if contents is None:
+                with open(path, "rb") as file:
+                    contents = file.read()
+            cached = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": hashlib.sha256(contents).hexdigest(),
+            }
+        new_cache_entries[cache_key] = cached
+
+        # Kinds of metadata which another consumer didn't need are extracted now, and kept for next time
+        missing_kinds = tuple(kind for kind in extract if kind not in cached)
+        if not missing_kinds:
+            results.append(metadata_from_cache_entry(path, cached, extract))
+            continue
+
+        if contents is None:
+            with open(path, "rb") as file:
+                contents = file.read()
+        pending.append(
+            (len(results), path, cache_key, missing_kinds, contents.decode("utf-8"))
+        )
+        results.append(None)
+
+    for kinds in sorted(set(entry[3] for entry in pending)):
+        kinds_pending = [entry for entry in pending if entry[3] == kinds]
+        parsed = extract_role_defaults_metadata_many(
+            [entry[4] for entry in kinds_pending], jobs=jobs, extract=kinds
+        )
+        for (idx, path, cache_key, _, _), metadata in zip(kinds_pending, parsed):
+            new_cache_entries[cache_key] = dict(new_cache_entries[cache_key], **metadata)
+            results[idx] = metadata_from_cache_entry(path, new_cache_entries[cache_key], extract)
+
+    # The cache is shared by all roots (e.g. feeds.py scanning another checkout, and versions.py scanning "."):
+    # entries of other roots, and of files skipped by excluded_paths, are kept.
+    # Only entries of files which are gone (from any root, e.g. a deleted temporary checkout) are dropped.
+    for cache_key, cached in cache_entries.items():
+        if cache_key not in new_cache_entries and os.path.isfile(cache_key):
+            new_cache_entries[cache_key] = cached
+
+    if cache_path is not None and new_cache_entries != cache_entries:
+        save_cache(cache_path, new_cache_entries)
+
+    return results
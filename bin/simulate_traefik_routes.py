@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -* encoding: utf8 *-
+
+# SPDX-FileCopyrightText: 2026 MASH project contributors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Offline route-matching simulator for the Gateway.
+#
+# Takes a discovery snapshot (the inspect-docker.sh output of many hosts, as saved by
+# `bin/discover_traefik_labels.py --save-snapshot`: a host name => inspection JSON object), processes it exactly like
+# the controller would (same gateway mode, replicas merging, ...) and tells, for each request of a stream of
+# host/path pairs, which router the Gateway would route it to, and to which service and hosts.
+#
+# With --benchmark, measures how route matching scales instead, on synthetic rule sets of the given sizes.
+
+import argparse
+import json
+import random
+import sys
+import time
+import urllib.parse
+
+from discover_traefik_labels import build_route_index, decode_discovery_output, process_inspections
+from traefik_rules import RouteIndex, parse_rule
+
+
+def load_snapshot(snapshot_path):
+    """Returns (host, inspection) pairs from a snapshot file, hosts being ordered by name.
+
+    Inspections may also be raw inspect-docker.sh outputs (compact JSON objects with a "labels" table, or strings
+    for --gzip outputs): they are decoded like the controller does.
+    Raises ValueError if the inspection of a host can't be decoded.
+    """
+    with open(snapshot_path) as file:
+        snapshot = json.load(file)
+    pairs = []
+    for host_name in sorted(snapshot.keys()):
+        output = snapshot[host_name]
+        try:
+            inspection = decode_discovery_output(
+                output if isinstance(output, str) else json.dumps(output)
+            )
+        except ValueError as e:
+            raise ValueError("{0}: {1}".format(host_name, e))
+        pairs.append(({"name": host_name, "weight": None}, inspection))
+    return pairs
+
+
+def parse_request(line):
+    """Returns (host, path) for a "https://host/path" URL or a "host /path" line, or None for an empty line."""
+    line = line.strip()
+    if line == "" or line.startswith("#"):
+        return None
+    if "://" in line:
+        url = urllib.parse.urlsplit(line)
+        return url.netloc, url.path or "/"
+    host, _, path = line.partition(" ")
+    path = path.strip()
+    return host, path if path.startswith("/") else "/" + path
+
+
+def simulate_requests(index, backends, requests):
+    """Yields (host, path, entry, backend, shadowing entries) for each (host, path) request.
+
+    entry is the matching route entry (None if no router matches) and backend that of its router.
+    shadowing entries are the conditional entries taking precedence over it, if their other matchers match.
+    """
+    for host, path in requests:
+        entry = None
+        shadowing_entries = []
+        for candidate in index.lookup(host, path):
+            if not candidate.route.conditional:
+                entry = candidate
+                break
+            shadowing_entries.append(candidate)
+        backend = backends.get(entry.router) if entry is not None else None
+        yield host, path, entry, backend, shadowing_entries
+
+
+def format_simulation(host, path, entry, backend, shadowing_entries):
+    if entry is None:
+        routed = "no router"
+    else:
+        routed = "{0}\t{1}\t{2}".format(
+            entry.router, backend["service"], ",".join(backend["hosts"])
+        )
+    line = "{0}\t{1}\t{2}".format(host, path, routed)
+    if shadowing_entries:
+        line += "\t({0} {1})".format(
+            "may match" if entry is None else "unless matched by",
+            ", ".join(shadowing_entry.router for shadowing_entry in shadowing_entries),
+        )
+    return line
+
+
+def generate_rules(router_count, seed=0):
+    """Generates a synthetic rule set, with MASH's usual rule shapes.
+
+    Half of the routers have their own subdomain, the other half share a domain (20 services per domain)
+    with a path prefix each, a tenth of them with an extra matcher.
+    """
+    rng = random.Random(seed)
+    rules = []
+    for idx in range(router_count):
+        if idx % 2 == 0:
+            rule = "Host(`service{0}.example.com`)".format(idx)
+        else:
+            rule = "Host(`homelab{0}.example.com`) && PathPrefix(`/service{1}`)".format(
+                idx // 40, idx
+            )
+        if rng.random() < 0.1:
+            rule += " && Method(`GET`, `POST`)"
+        rules.append(("service{0}".format(idx), rule))
+    return rules
+
+
+def generate_requests(rules, request_count, seed=0):
+    """Generates requests, mostly for existing routes, with a few for unknown hosts."""
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(request_count):
+        if rng.random() < 0.05:
+            requests.append(("unknown.example.com", "/"))
+            continue
+        _, rule = rules[rng.randrange(len(rules))]
+        host = rule.split("`")[1]
+        if "PathPrefix" in rule:
+            requests.append((host, rule.split("`")[3] + "/items/42"))
+        else:
+            requests.append((host, "/api/items/42"))
+    return requests
+
+
+def benchmark(router_count, request_count):
+    """Returns a dict with the timings of indexing router_count routers and looking request_count requests up."""
+    rules = generate_rules(router_count)
+    requests = generate_requests(rules, request_count)
+    parse_rule.cache_clear()
+
+    start_time = time.perf_counter()
+    index = RouteIndex()
+    for router, rule in rules:
+        index.add_router(router, rule)
+    index_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    matched_count = 0
+    for host, path in requests:
+        if index.match(host, path) is not None:
+            matched_count += 1
+    lookup_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    overlap_count = len(index.find_overlaps())
+    overlaps_time = time.perf_counter() - start_time
+
+    return {
+        "routers": router_count,
+        "hosts": len(index.get_hosts()),
+        "index_time": index_time,
+        "requests": request_count,
+        "matched": matched_count,
+        "lookup_time": lookup_time,
+        "lookups_per_second": request_count / lookup_time if lookup_time > 0 else 0,
+        "overlaps": overlap_count,
+        "overlaps_time": overlaps_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tells which Gateway router requests would be routed to, given a discovery snapshot, or benchmarks route matching"
+    )
+    parser.add_argument(
+        "snapshot",
+        nargs="?",
+        help="Discovery snapshot (see discover_traefik_labels.py --save-snapshot)",
+    )
+    parser.add_argument(
+        "--requests",
+        default="-",
+        help='File of requests, one "https://host/path" URL or "host /path" per line (default: stdin)',
+    )
+    parser.add_argument(
+        "--gateway-mode",
+        default="filter",
+        choices=["filter", "passthrough", "direct"],
+        help="How labels are turned into Gateway labels (default: filter)",
+    )
+    parser.add_argument("--traefik-local-port", type=int, default=8080)
+    parser.add_argument("--gateway-service-name", default="homelab-traefik")
+    parser.add_argument(
+        "--no-merge-replicas",
+        action="store_true",
+        help="Don't merge routers replicated on several hosts into load-balanced services",
+    )
+    parser.add_argument(
+        "--benchmark",
+        metavar="SIZES",
+        help="Benchmark route matching for these comma-separated numbers of routers (e.g. 10000,100000) instead",
+    )
+    parser.add_argument(
+        "--benchmark-requests",
+        type=int,
+        default=100000,
+        help="Number of requests looked up per benchmark (default: 100000)",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        try:
+            router_counts = [int(size) for size in args.benchmark.split(",")]
+        except ValueError:
+            parser.error("invalid --benchmark sizes: {0}".format(args.benchmark))
+        for router_count in router_counts:
+            results = benchmark(router_count, args.benchmark_requests)
+            print(
+                "{routers} routers ({hosts} hosts): indexed in {index_time:.2f}s, "
+                "{requests} lookups in {lookup_time:.2f}s ({lookups_per_second:.0f}/s, {matched} matched), "
+                "{overlaps} overlaps found in {overlaps_time:.2f}s".format(**results)
+            )
+        sys.exit(0)
+
+    if args.snapshot is None:
+        parser.error("a snapshot is required (unless --benchmark is used)")
+
+    try:
+        inspections = load_snapshot(args.snapshot)
+    except ValueError as e:
+        sys.exit("Error: invalid snapshot, {0}".format(e))
+
+    updates = process_inspections(
+        inspections,
+        gateway_mode=args.gateway_mode,
+        traefik_local_port=args.traefik_local_port,
+        gateway_service_name=args.gateway_service_name,
+        merge_replicas=not args.no_merge_replicas,
+    )
+    index, backends, errors = build_route_index(updates)
+    for host, error in errors:
+        print("{0}: {1}".format(host["name"], error), file=sys.stderr)
+
+    requests_file = sys.stdin if args.requests == "-" else open(args.requests)
+    with requests_file:
+        requests = (parse_request(line) for line in requests_file)
+        for simulation in simulate_requests(
+            index, backends, (request for request in requests if request is not None)
+        ):
+            print(format_simulation(*simulation))
@@ -0,0 +1,469 @@
+# -* encoding: utf8 *-
+
+# SPDX-FileCopyrightText: 2026 MASH project contributors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Parses Traefik router rules (e.g. "Host(`example.com`) && PathPrefix(`/app`)") and indexes them by hostname and path,
+# so that questions like "which router serves https://example.com/app/x?" or "which routers overlap?" can be answered
+# quickly, even across thousands of routers.
+#
+# Rules are parsed into an AST (matchers combined with &&, || and !), which is memoized, as the same rules are
+# typically found on many hosts (e.g. replicated services). Each rule is then reduced to the (host, path) routes
+# it can match: Host/HostRegexp give the host, Path/PathPrefix the path. Other matchers (Method, Header, ...)
+# and negations can only narrow a route down, so routes depending on them are kept, but marked as conditional.
+#
+# Routes are stored in a RouteIndex: hostname => character trie of paths, as Traefik's PathPrefix is a plain string
+# prefix (PathPrefix(`/mini`) matches `/miniflux`). Looking a request up walks its path once.
+
+import collections
+import functools
+import re
+
+# Matchers deciding the host and path of a route. Any other matcher only makes a route conditional.
+host_matcher_names = ("host", "hostregexp")
+path_matcher_names = ("path", "pathprefix")
+
+# Above this many alternatives, a rule's routes are not expanded any further (they're kept as a conditional catch-all)
+max_route_alternatives = 1024
+
+Matcher = collections.namedtuple("Matcher", ["name", "args"])
+And = collections.namedtuple("And", ["operands"])
+Or = collections.namedtuple("Or", ["operands"])
+Not = collections.namedtuple("Not", ["operand"])
+
+# host: lowercase hostname, or None for any host. host_regexp: whether host is a regular expression.
+# path_kind: "prefix" or "exact". conditional: whether other matchers or negations also need to match.
+Route = collections.namedtuple(
+    "Route", ["host", "host_regexp", "path_kind", "path", "conditional"]
+)
+
+# A route of a router in the index. priority is the router's (Traefik defaults to the length of the rule).
+RouteEntry = collections.namedtuple("RouteEntry", ["router", "route", "priority"])
+
+regex_token = re.compile(
+    r"\s*(?:(?P<operator>&&|\|\||!|\(|\)|,)|`(?P<backquoted>[^`]*)`|\"(?P<quoted>(?:[^\"\\]|\\.)*)\"|(?P<name>[A-Za-z]+))"
+)
+
+
+class RuleSyntaxError(Exception):
+    pass
+
+
+def tokenize(rule):
+    tokens = []
+    position = 0
+    rule = rule.rstrip()
+    while position < len(rule):
+        match = regex_token.match(rule, position)
+        if match is None:
+            raise RuleSyntaxError(
+                "Unexpected character at position {0} in rule: {1}".format(
+                    position, rule
+                )
+            )
+        position = match.end()
+        if match.group("operator") is not None:
+            tokens.append(("operator", match.group("operator")))
+        elif match.group("backquoted") is not None:
+            tokens.append(("string", match.group("backquoted")))
+        elif match.group("quoted") is not None:
+            tokens.append(("string", re.sub(r"\\(.)", r"\1", match.group("quoted"))))
+        else:
+            tokens.append(("name", match.group("name")))
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser for rules: or := and ('||' and)*, and := unary ('&&' unary)*, unary := '!' unary | primary"""
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.tokens = tokenize(rule)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def expect(self, kind, value=None):
+        token = self.peek()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise RuleSyntaxError(
+                "Expected {0} but got {1} in rule: {2}".format(
+                    value or kind, token[1] or "end of rule", self.rule
+                )
+            )
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        node = self.parse_or()
+        if self.position != len(self.tokens):
+            raise RuleSyntaxError(
+                "Unexpected {0} in rule: {1}".format(self.peek()[1], self.rule)
+            )
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == ("operator", "||"):
+            self.position += 1
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def parse_and(self):
+        operands = [self.parse_unary()]
+        while self.peek() == ("operator", "&&"):
+            self.position += 1
+            operands.append(self.parse_unary())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def parse_unary(self):
+        if self.peek() == ("operator", "!"):
+            self.position += 1
+            return Not(self.parse_unary())
+        if self.peek() == ("operator", "("):
+            self.position += 1
+            node = self.parse_or()
+            self.expect("operator", ")")
+            return node
+        return self.parse_matcher()
+
+    def parse_matcher(self):
+        name = self.expect("name")
+        self.expect("operator", "(")
+        args = []
+        if self.peek() != ("operator", ")"):
+            args.append(self.expect("string"))
+            # Traefik v2 allows several values, e.g. Host(`a.com`, `b.com`)
+            while self.peek() == ("operator", ","):
+                self.position += 1
+                args.append(self.expect("string"))
+        self.expect("operator", ")")
+        return Matcher(name, tuple(args))
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rule(rule):
+    """Returns the AST of a rule. Identical rules are only parsed once."""
+    return Parser(rule).parse()
+
+
+def merge_routes(first, second):
+    """Returns the route matching both routes (the intersection of both), or None if they can't both match."""
+    host, host_regexp = first.host, first.host_regexp
+    if second.host is not None:
+        if host is None:
+            host, host_regexp = second.host, second.host_regexp
+        elif host_regexp or second.host_regexp:
+            # Not worth intersecting regular expressions: keep the most specific host, which may or may not match
+            if host_regexp:
+                host, host_regexp = second.host, second.host_regexp
+            return merge_paths(
+                Route(host, host_regexp, first.path_kind, first.path, True), second
+            )
+        elif host != second.host:
+            return None
+    return merge_paths(
+        Route(host, host_regexp, first.path_kind, first.path, first.conditional),
+        second,
+    )
+
+
+def merge_paths(first, second):
+    conditional = first.conditional or second.conditional
+    if second.path_kind is None:
+        return first._replace(conditional=conditional)
+    if first.path_kind is None:
+        return first._replace(
+            path_kind=second.path_kind, path=second.path, conditional=conditional
+        )
+
+    kinds = (first.path_kind, second.path_kind)
+    if kinds == ("prefix", "prefix"):
+        if first.path.startswith(second.path):
+            return first._replace(conditional=conditional)
+        if second.path.startswith(first.path):
+            return first._replace(path=second.path, conditional=conditional)
+        return None
+    if kinds == ("exact", "exact"):
+        if first.path != second.path:
+            return None
+        return first._replace(conditional=conditional)
+    exact, prefix = (first, second) if first.path_kind == "exact" else (second, first)
+    if not exact.path.startswith(prefix.path):
+        return None
+    return first._replace(path_kind="exact", path=exact.path, conditional=conditional)
+
+
+any_route = Route(None, False, None, None, False)
+conditional_route = Route(None, False, None, None, True)
+
+
+def get_node_routes(node):
+    if isinstance(node, Matcher):
+        name = node.name.lower()
+        if name == "host":
+            return [Route(arg.lower(), False, None, None, False) for arg in node.args]
+        if name == "hostregexp":
+            return [Route(arg, True, None, None, False) for arg in node.args]
+        if name == "pathprefix":
+            return [Route(None, False, "prefix", arg, False) for arg in node.args]
+        if name == "path":
+            return [Route(None, False, "exact", arg, False) for arg in node.args]
+        return [conditional_route]
+
+    if isinstance(node, Not):
+        # A negation can only exclude requests
+        return [conditional_route]
+
+    if isinstance(node, Or):
+        routes = []
+        for operand in node.operands:
+            routes.extend(get_node_routes(operand))
+        if len(routes) > max_route_alternatives:
+            return [conditional_route]
+        return routes
+
+    routes = [any_route]
+    for operand in node.operands:
+        operand_routes = get_node_routes(operand)
+        merged_routes = []
+        for route in routes:
+            for operand_route in operand_routes:
+                merged_route = merge_routes(route, operand_route)
+                if merged_route is not None:
+                    merged_routes.append(merged_route)
+        if len(merged_routes) > max_route_alternatives:
+            return [conditional_route]
+        routes = merged_routes
+    return routes
+
+
+@functools.lru_cache(maxsize=None)
+def get_rule_routes(rule):
+    """Returns the (deduplicated) routes a rule can match, as a tuple of Route. Rules which can never match have none."""
+    routes = []
+    for route in get_node_routes(parse_rule(rule)):
+        if route.path_kind is None:
+            # Traefik paths always start with /, so no path matcher is the same as PathPrefix(`/`)
+            route = route._replace(path_kind="prefix", path="/")
+        if route not in routes:
+            routes.append(route)
+    return tuple(routes)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_host_regexp(pattern):
+    # Traefik v2 syntax: {name:regexp} and {name} (any label), named by an identifier unlike quantifiers ({2,3})
+    pattern = re.sub(r"\{[A-Za-z_][A-Za-z0-9_]*:([^{}]+)\}", r"(?:\1)", pattern)
+    pattern = re.sub(r"\{[A-Za-z_][A-Za-z0-9_]*\}", r"[^.]+", pattern)
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def get_host_name(hostname):
+    # Requests for example.com:443 are for example.com
+    return hostname.lower().split(":", 1)[0]
+
+
+def get_entry_precedence(entry):
+    # Highest priority first and, among equal priorities, longest (most specific) path first
+    return (-entry.priority, -len(entry.route.path))
+
+
+class PathTrie:
+    """Character trie of paths, with the route entries of each path (prefixes and exact paths)."""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, path, entry):
+        node = self.root
+        for char in path:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(entry)
+
+    def lookup(self, path):
+        """Returns the entries whose prefix (or exact path) matches path, from the shortest path to the longest."""
+        entries = []
+        node = self.root
+        for idx in range(len(path) + 1):
+            for entry in node.get(None, []):
+                if entry.route.path_kind == "prefix" or idx == len(path):
+                    entries.append(entry)
+            if idx == len(path):
+                break
+            node = node.get(path[idx])
+            if node is None:
+                break
+        return entries
+
+    def iterate(self):
+        """Yields (path, entries) for all paths, in depth-first order, along with the entries of each path's ancestors."""
+        stack = [("", self.root, [])]
+        while stack:
+            path, node, ancestor_entries = stack.pop()
+            entries = node.get(None, [])
+            if entries:
+                yield path, entries, ancestor_entries
+                ancestor_entries = ancestor_entries + [
+                    entry for entry in entries if entry.route.path_kind == "prefix"
+                ]
+            for char in sorted(
+                (key for key in node.keys() if key is not None), reverse=True
+            ):
+                stack.append((path + char, node[char], ancestor_entries))
+
+
+class RouteIndex:
+    """Index of the routes of many routers, by hostname and path."""
+
+    def __init__(self):
+        # Hostname (or None, for routes matching any host) => PathTrie
+        self.tries = {}
+        # (pattern, PathTrie) for HostRegexp routes
+        self.regexp_tries = {}
+        # Router => rule
+        self.routers = {}
+
+    def add_router(self, router, rule, priority=None):
+        """Indexes a router's rule. router is any identifier (e.g. "vm106/miniflux"). Raises RuleSyntaxError."""
+        if priority is None:
+            priority = len(rule)
+        for route in get_rule_routes(rule):
+            entry = RouteEntry(router, route, priority)
+            if route.host_regexp:
+                trie = self.regexp_tries.setdefault(route.host, PathTrie())
+            else:
+                trie = self.tries.setdefault(route.host, PathTrie())
+            trie.add(route.path, entry)
+        self.routers[router] = rule
+
+    def lookup(self, host, path):
+        """Returns the entries which may match a request, highest priority (the one Traefik picks) first."""
+        host = get_host_name(host)
+        entries = []
+        for trie_host in (host, None):
+            trie = self.tries.get(trie_host)
+            if trie is not None:
+                entries.extend(trie.lookup(path))
+        for pattern, trie in self.regexp_tries.items():
+            if compile_host_regexp(pattern).fullmatch(host):
+                entries.extend(trie.lookup(path))
+        entries.sort(key=get_entry_precedence)
+        return entries
+
+    def match(self, host, path):
+        """Returns the entry Traefik would route the request to, ignoring conditional entries, or None."""
+        for entry in self.lookup(host, path):
+            if not entry.route.conditional:
+                return entry
+        return None
+
+    def get_hosts(self):
+        """Returns the hostnames routed to (None standing for routes matching any host), sorted."""
+        return sorted(
+            self.tries.keys(), key=lambda host: (host is not None, host or "")
+        )
+
+    def find_overlaps(self):
+        """Returns (host, entry, other entry) for each pair of entries of different routers matching the same requests.
+
+        An entry overlaps another when its path is equal to, or starts with, the other's prefix on the same host
+        (routes matching any host overlapping with all hosts). HostRegexp routes are not considered.
+        """
+        overlaps = []
+        any_host_trie = self.tries.get(None)
+        for host in self.get_hosts():
+            trie = self.tries[host]
+            if host is not None and any_host_trie is not None:
+                # Routes for any host also serve this one
+                merged_trie = PathTrie()
+                for source_trie in (trie, any_host_trie):
+                    for path, entries, _ in source_trie.iterate():
+                        for entry in entries:
+                            merged_trie.add(path, entry)
+                trie = merged_trie
+
+            for path, entries, ancestor_entries in trie.iterate():
+                for idx, entry in enumerate(entries):
+                    candidates = ancestor_entries + entries[:idx]
+                    for other_entry in candidates:
+                        if other_entry.router == entry.router:
+                            continue
+                        if (
+                            host is not None
+                            and entry.route.host is None
+                            and other_entry.route.host is None
+                        ):
+                            # Already reported for any host
+                            continue
+                        overlaps.append((host, entry, other_entry))
+        return overlaps
+
+    def get_routing_report(self):
+        """Returns a hostname (None for any host) => [(path kind, path, router, conditional)] dict, sorted by path."""
+        report = {}
+        for host in self.get_hosts():
+            routes = []
+            for path, entries, _ in self.tries[host].iterate():
+                for entry in entries:
+                    routes.append(
+                        (
+                            entry.route.path_kind,
+                            path,
+                            entry.router,
+                            entry.route.conditional,
+                        )
+                    )
+            report[host] = sorted(
+                routes, key=lambda route: (route[1], route[0], str(route[2]))
+            )
+        return report
+
+
+def format_routing_report(index):
+    lines = []
+    for host, routes in index.get_routing_report().items():
+        lines.append(host if host is not None else "(any host)")
+        for path_kind, path, router, conditional in routes:
+            lines.append(
+                "  {0:<7} {1:<40} {2}{3}".format(
+                    path_kind,
+                    path,
+                    router,
+                    " (conditional)" if conditional else "",
+                )
+            )
+    for pattern in sorted(index.regexp_tries.keys()):
+        lines.append("{0} (HostRegexp)".format(pattern))
+        for path, entries, _ in index.regexp_tries[pattern].iterate():
+            for entry in entries:
+                lines.append(
+                    "  {0:<7} {1:<40} {2}{3}".format(
+                        entry.route.path_kind,
+                        path,
+                        entry.router,
+                        " (conditional)" if entry.route.conditional else "",
+                    )
+                )
+
+    overlaps = index.find_overlaps()
+    if overlaps:
+        lines.append("")
+        lines.append("Overlapping routes ({0}):".format(len(overlaps)))
+        for host, entry, other_entry in overlaps:
+            winner = min(entry, other_entry, key=get_entry_precedence)
+            lines.append(
+                "  {0}: {1} {2} and {3} {4} (wins: {5})".format(
+                    host if host is not None else "(any host)",
+                    entry.router,
+                    entry.route.path,
+                    other_entry.router,
+                    other_entry.route.path,
+                    winner.router,
+                )
+            )
+    return "\n".join(lines)
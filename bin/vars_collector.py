@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -* encoding: utf8 *-
+
+# SPDX-FileCopyrightText: 2026 MASH project contributors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Finds the variable files of an Ansible inventory and collects the variable names defined in them.
+#
+# Like Ansible itself, this understands both `host_vars/HOST.yml` files and `host_vars/HOST/` directories
+# containing any number of files (e.g. `vars.yml` and `vault.yml`), and the same for `group_vars`.
+#
+# Only the top-level keys of each file are needed, so files are composed into a YAML node tree, but never constructed.
+# This means that values with custom tags (like `!vault |` encrypted strings) don't need decrypting to get their keys.
+# Files which are vault-encrypted as a whole are decrypted via `ansible-vault view`,
+# which uses the vault password configured for Ansible (e.g. via `ANSIBLE_VAULT_PASSWORD_FILE`).
+# Each decryption is a slow subprocess, so files are read concurrently, while parsing them stays serial.
+#
+# For a single host, the groups it belongs to are resolved via `ansible-inventory --graph`,
+# so that only the group_vars which apply to that host are included.
+
+import argparse
+import concurrent.futures
+import functools
+import os
+import subprocess
+import yaml
+
+vault_header_prefix = "$ANSIBLE_VAULT;"
+
+# Ansible loads files with these extensions (or no extension at all) from host_vars/group_vars
+vars_file_extensions = (".yml", ".yaml", ".json")
+
+vars_directory_names = ("host_vars", "group_vars")
+
+
+def is_vars_file_name(file_name):
+    if file_name.startswith("."):
+        return False
+    extension = os.path.splitext(file_name)[1]
+    return extension == "" or extension in vars_file_extensions
+
+
+def find_vars_file_paths_in_directory(directory_path):
+    paths = []
+    for dir_name, sub_dir_list, file_list in os.walk(directory_path):
+        # Hidden directories are skipped by Ansible as well
+        sub_dir_list[:] = [name for name in sub_dir_list if not name.startswith(".")]
+        for file_name in file_list:
+            if is_vars_file_name(file_name):
+                paths.append(os.path.join(dir_name, file_name))
+    return paths
+
+
+def find_host_group_names(inventory_path, host_name):
+    """Returns the names of the groups the host belongs to, directly or through child groups (`all` included)."""
+    # The playbook is run with `-i inventory/hosts`, so group membership comes from there as well
+    inventory_source_path = os.path.join(inventory_path, "hosts")
+    if not os.path.isfile(inventory_source_path):
+        inventory_source_path = inventory_path
+
+    try:
+        result = subprocess.run(
+            ["ansible-inventory", "-i", inventory_source_path, "--graph"],
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError:
+        raise Exception(
+            "ansible-inventory (needed to find the groups of host {0}) was not found".format(
+                host_name
+            )
+        )
+    if result.returncode != 0:
+        raise Exception(
+            "Failed listing the groups of inventory {0}: {1}".format(
+                inventory_path, result.stderr.strip()
+            )
+        )
+
+    # The graph is indented by depth, e.g. `@all:`, `  |--@mash_servers:`, `  |  |--mash.example.com`
+    group_names = set()
+    parent_groups = []
+    for line in result.stdout.split("\n"):
+        name = line.lstrip(" |-")
+        if name == "":
+            continue
+        indentation = len(line) - len(name)
+        while len(parent_groups) > 0 and parent_groups[-1][0] >= indentation:
+            parent_groups.pop()
+
+        if name.startswith("@"):
+            parent_groups.append((indentation, name[1:].rstrip(":")))
+        elif name == host_name:
+            group_names.update(group_name for _, group_name in parent_groups)
+
+    if len(group_names) == 0:
+        raise Exception(
+            "Host {0} is not in inventory {1}".format(host_name, inventory_path)
+        )
+    return group_names
+
+
+def find_vars_file_paths(inventory_path, host_name=None, group_names=None):
+    """Returns the (absolute, sorted) paths of all host_vars and group_vars files in the inventory.
+
+    With a host_name, only that host's host_vars files are returned.
+    With group_names, only the group_vars files of these groups are returned.
+    """
+    paths = []
+    for vars_directory_name in vars_directory_names:
+        vars_directory_path = os.path.join(inventory_path, vars_directory_name)
+        if not os.path.isdir(vars_directory_path):
+            continue
+
+        for entry in sorted(os.scandir(vars_directory_path), key=lambda e: e.name):
+            if entry.name.startswith("."):
+                continue
+
+            if entry.is_dir():
+                entry_name = entry.name
+            else:
+                if not is_vars_file_name(entry.name):
+                    continue
+                entry_name = os.path.splitext(entry.name)[0]
+
+            if (
+                host_name is not None
+                and vars_directory_name == "host_vars"
+                and entry_name != host_name
+            ):
+                continue
+            if (
+                group_names is not None
+                and vars_directory_name == "group_vars"
+                and entry_name not in group_names
+            ):
+                continue
+
+            if entry.is_dir():
+                paths.extend(find_vars_file_paths_in_directory(entry.path))
+            else:
+                paths.append(entry.path)
+
+    return sorted(os.path.realpath(path) for path in paths)
+
+
+def is_vault_encrypted(contents):
+    return contents.lstrip().startswith(vault_header_prefix)
+
+
+# Cached, as the optimizer needs the same files for variable names, host vars and pruning, and decrypting is slow
+@functools.lru_cache(maxsize=None)
+def read_vars_file(path):
+    """Returns the contents of a vars file, decrypting it first if it's vault-encrypted as a whole."""
+    with open(path, "r") as file:
+        contents = file.read()
+
+    if not is_vault_encrypted(contents):
+        return contents
+
+    try:
+        result = subprocess.run(
+            ["ansible-vault", "view", path], capture_output=True, text=True
+        )
+    except FileNotFoundError:
+        raise Exception(
+            "Vars file {0} is vault-encrypted, but ansible-vault (needed to decrypt it) was not found".format(
+                path
+            )
+        )
+    if result.returncode != 0:
+        raise Exception(
+            "Failed decrypting vault-encrypted vars file {0} (is the vault password configured?): {1}".format(
+                path, result.stderr.strip()
+            )
+        )
+    return result.stdout
+
+
+def read_vars_files(paths, jobs=None):
+    """Returns the contents of the given vars files (see read_vars_file), in the same order.
+
+    Files are read with up to `jobs` threads (by default, as many as ThreadPoolExecutor uses), so that
+    vault-encrypted files are decrypted by concurrent `ansible-vault view` processes.
+    """
+    if len(paths) <= 1 or jobs == 1:
+        return [read_vars_file(path) for path in paths]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(read_vars_file, paths))
+
+
+def extract_variable_names(contents):
+    """Returns the top-level keys defined in the YAML (or JSON) contents. Empty files define none."""
+    root_node = yaml.compose(contents, Loader=yaml.SafeLoader)
+    return extract_mapping_keys(root_node)
+
+
+def extract_mapping_keys(node):
+    variable_names = set()
+    if not isinstance(node, yaml.MappingNode):
+        return variable_names
+
+    for key_node, value_node in node.value:
+        if not isinstance(key_node, yaml.ScalarNode):
+            continue
+        if key_node.tag == "tag:yaml.org,2002:merge":
+            # `<<: *anchor` (or a list of those) brings in the keys of other mappings
+            merged_nodes = [value_node]
+            if isinstance(value_node, yaml.SequenceNode):
+                merged_nodes = value_node.value
+            for merged_node in merged_nodes:
+                variable_names |= extract_mapping_keys(merged_node)
+            continue
+        variable_names.add(key_node.value)
+    return variable_names
+
+
+class VarsLoader(yaml.SafeLoader):
+    pass
+
+
+# Encrypted values are unknown to us, as far as their (runtime) value is concerned
+VarsLoader.add_constructor("!vault", lambda loader, node: None)
+VarsLoader.add_constructor("!unsafe", lambda loader, node: loader.construct_scalar(node))
+
+
+def load_vars_file(path):
+    """Returns the data in a vars file (or None for empty files). Values encrypted with `!vault` are loaded as None."""
+    return yaml.load(read_vars_file(path), Loader=VarsLoader)
+
+
+def collect_variable_files_by_name(paths, jobs=None):
+    """Returns a variable name => paths of the files defining it (in the given order) dict for the given vars files.
+
+    Files are read (and decrypted) concurrently, see read_vars_files.
+    """
+    variable_files_by_name = {}
+    for path, contents in zip(paths, read_vars_files(paths, jobs=jobs)):
+        for variable_name in extract_variable_names(contents):
+            variable_files_by_name.setdefault(variable_name, []).append(path)
+    return variable_files_by_name
+
+
+def collect_variable_names(paths):
+    """Returns the combined variable names defined in all of the given vars files."""
+    return set(collect_variable_files_by_name(paths).keys())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prints the space-separated paths of the vars files (host_vars, group_vars) in an inventory"
+    )
+    parser.add_argument("inventory_path", help="Path to the inventory directory")
+    parser.add_argument(
+        "--host",
+        help="Only include this host's host_vars files and the group_vars files of its groups (resolved with ansible-inventory)",
+    )
+    args = parser.parse_args()
+
+    group_names = None
+    if args.host is not None:
+        group_names = find_host_group_names(args.inventory_path, args.host)
+
+    print(
+        " ".join(
+            find_vars_file_paths(
+                args.inventory_path, host_name=args.host, group_names=group_names
+            )
+        )
+    )
@@ -6,9 +6,14 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import argparse
+import csv
+import json
 import os
 import re
-import yaml
+import sys
+
+from roles_scanner import scan_role_defaults
 
 ignored = [
     "matrix_synapse_default_room_version",
@@ -32,24 +37,41 @@ suffixes = [
 ]
 
 
-def find_versions():
+inventory_fields = ["role", "file", "variable", "value"]
+
+
+def find_version_records(jobs=None):
+    """Returns one record (role, file, original variable name, value) per reportable version variable."""
+    records = []
+    for defaults in scan_role_defaults(".", jobs=jobs, extract=("versions",)):
+        role = get_role_name_from_path(defaults["path"])
+        file = os.path.relpath(defaults["path"])
+        for key, value in defaults["versions"].items():
+            if (
+                value
+                and not re.search(r'{{|master|main|""', str(value))
+                and key not in ignored
+            ):
+                records.append(
+                    {"role": role, "file": file, "variable": key, "value": value}
+                )
+    return records
+
+
+def get_role_name_from_path(path):
+    # extract the role name from a path like this:
+    # ./roles/galaxy/miniflux/defaults/main.yml
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+
+
+def find_versions(jobs=None, records=None):
+    if records is None:
+        records = find_version_records(jobs=jobs)
+
     matches = {}
-    for root, dirs, files in os.walk("."):
-        if root.endswith("defaults"):
-            for file in files:
-                if file.endswith("main.yml"):
-                    path = os.path.join(root, file)
-                    with open(path, "r") as f:
-                        data = yaml.safe_load(f)
-                        for key, value in data.items():
-                            if (
-                                key.endswith("_version")
-                                and value
-                                and not re.search(r'{{|master|main|""', str(value))
-                                and key not in ignored
-                            ):
-                                sanitized_key = sanitize_key(key)
-                                matches[sanitized_key] = value
+    for record in records:
+        sanitized_key = sanitize_key(record["variable"])
+        matches[sanitized_key] = record["value"]
     return matches
 
 
@@ -61,12 +83,123 @@ def sanitize_key(key):
     return key.replace("_", " ").title()
 
 
-def generate_versions():
-    versions = find_versions()
+def is_csv_path(path):
+    return path.lower().endswith(".csv")
+
+
+def write_inventory(records, path):
+    records = sorted(records, key=get_record_key)
+
+    with open(path, "w", newline="") as f:
+        if is_csv_path(path):
+            writer = csv.DictWriter(f, fieldnames=inventory_fields)
+            writer.writeheader()
+            writer.writerows(records)
+            return
+
+        # One compact record per line, so that inventories stay diff-friendly under version control as well
+        f.write("[\n")
+        f.write(
+            ",\n".join(
+                json.dumps(record, separators=(",", ":"), default=str)
+                for record in records
+            )
+        )
+        f.write("\n]\n")
+
+
+def read_inventory(path):
+    with open(path, "r", newline="") as f:
+        if is_csv_path(path):
+            return list(csv.DictReader(f))
+        return json.load(f)
+
+
+def get_record_key(record):
+    # Role names aren't unique (e.g. the same role under roles/custom and roles/galaxy), defaults file paths are
+    return (record["file"], record["variable"])
+
+
+def diff_inventories(old_records, new_records):
+    """Compares two inventories in linear time.
+
+    Returns (added, removed, changed) lists, where records are matched by defaults file and original variable name.
+    Values are compared as strings, so a JSON inventory can be compared with a CSV one.
+    """
+    old_by_key = {get_record_key(record): record for record in old_records}
+    new_by_key = {get_record_key(record): record for record in new_records}
+
+    removed = []
+    changed = []
+    for key, old_record in old_by_key.items():
+        new_record = new_by_key.get(key)
+        if new_record is None:
+            removed.append(old_record)
+        elif str(old_record["value"]) != str(new_record["value"]):
+            changed.append((old_record, new_record))
+
+    added = [record for key, record in new_by_key.items() if key not in old_by_key]
+
+    return added, removed, changed
+
+
+def print_inventory_diff(added, removed, changed):
+    for old_record, new_record in changed:
+        print(
+            "~ {0} {1}: {2} -> {3}".format(
+                new_record["file"],
+                new_record["variable"],
+                old_record["value"],
+                new_record["value"],
+            )
+        )
+    for record in added:
+        print("+ {0} {1}: {2}".format(record["file"], record["variable"], record["value"]))
+    for record in removed:
+        print("- {0} {1}: {2}".format(record["file"], record["variable"], record["value"]))
+
+
+def generate_versions(jobs=None, inventory_path=None):
+    records = find_version_records(jobs=jobs)
+    versions = find_versions(records=records)
     with open(os.path.join(os.getcwd(), "VERSIONS.md"), "w") as f:
         for key, value in sorted(versions.items()):
             f.write(f"* {key}: {value}\n")
 
+    if inventory_path is not None:
+        write_inventory(records, inventory_path)
+
 
 if __name__ == "__main__":
-    generate_versions()
+    parser = argparse.ArgumentParser(
+        description="Dumps versions of the components found in the roles to the VERSIONS.md file"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of processes to parse roles' defaults files with (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--inventory-path",
+        default=None,
+        help="Also write a machine-readable inventory (role, file, variable, value) to this path (.csv for CSV, JSON otherwise)",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    diff_parser = subparsers.add_parser(
+        "diff", help="Compares two inventories written via --inventory-path"
+    )
+    diff_parser.add_argument("old_inventory_path")
+    diff_parser.add_argument("new_inventory_path")
+    args = parser.parse_args()
+
+    if args.command == "diff":
+        added, removed, changed = diff_inventories(
+            read_inventory(args.old_inventory_path),
+            read_inventory(args.new_inventory_path),
+        )
+        print_inventory_diff(added, removed, changed)
+        # Like diff(1), signal differences via the exit code
+        sys.exit(1 if added or removed or changed else 0)
+
+    generate_versions(jobs=args.jobs, inventory_path=args.inventory_path)
@@ -1,7 +1,16 @@
 #!/bin/bash
 set -euo pipefail
 
-OUTPUT_JSON=$(mktemp)
+# Les labels d'un container ne peuvent pas changer sans le recréer : ils sont donc mis en cache,
+# par container (ID + date de création + ID de l'image), et seuls les containers nouveaux ou recréés sont inspectés.
+# Les entrées des containers disparus sont supprimées du cache à chaque exécution.
+CACHE_FILE="${TRAEFIK_DISCOVERY_CACHE_FILE:-${HOME:-/tmp}/.cache/traefik-discovery/labels.cache}"
+
+# --gzip : sortie compressée (gzip puis base64, sur une seule ligne), décodée par parse_docker_labels
+COMPRESS=false
+if [ "${1-}" = "--gzip" ]; then
+    COMPRESS=true
+fi
 
 # Detect if we need sudo for Docker
 DOCKER_CMD="docker"
@@ -19,51 +28,136 @@ if ! command -v docker &> /dev/null; then
     exit 0
 fi
 
-CONTAINERS=$($DOCKER_CMD ps --format '{{.ID}}|{{.Names}}' 2>/dev/null || echo "")
+# Un seul appel bon marché pour lister les containers, sans les inspecter.
+# Les ports publiés (pour le mode direct) peuvent changer à chaque démarrage : ils ne sont jamais mis en cache.
+CONTAINERS=$($DOCKER_CMD ps --no-trunc --format '{{.ID}}|{{.Names}}|{{.CreatedAt}}|{{.Image}}|{{.Ports}}' 2>/dev/null || echo "")
 
 if [ -z "$CONTAINERS" ]; then
     echo '{"containers": []}'
     exit 0
 fi
 
-echo '{"containers": [' > "$OUTPUT_JSON"
+# `docker ps` n'affiche que la référence de l'image (nom:tag), qui peut désigner une autre image au fil des pulls.
+# Elle est résolue en ID d'image avec un seul appel listant les images, sans inspecter les containers
+# (`docker ps` affiche déjà l'ID lorsque le tag ne désigne plus l'image du container).
+declare -A IMAGE_IDS=()
+IMAGES=$($DOCKER_CMD images --no-trunc --digests --format '{{.Repository}}:{{.Tag}}|{{.ID}}{{"\n"}}{{.Repository}}@{{.Digest}}|{{.ID}}' 2>/dev/null || echo "")
+while IFS='|' read -r IMAGE_REFERENCE IMAGE_ID; do
+    if [ -n "$IMAGE_REFERENCE" ] && [ -n "$IMAGE_ID" ]; then
+        IMAGE_IDS[$IMAGE_REFERENCE]="$IMAGE_ID"
+    fi
+done <<< "$IMAGES"
+
+# Résoudre une référence d'image en ID, dans $IMAGE_KEY (la référence elle-même si elle est inconnue)
+resolve_image_id() {
+    IMAGE_KEY="${IMAGE_IDS[$1]-}"
+    if [ -z "$IMAGE_KEY" ] && [[ "${1##*/}" != *[:@]* ]]; then
+        # Référence sans tag : latest
+        IMAGE_KEY="${IMAGE_IDS[$1:latest]-}"
+    fi
+    IMAGE_KEY="${IMAGE_KEY:-$1}"
+}
+
+# Clé de cache => labels Traefik (une ligne par label, vide si le container n'en a aucun)
+declare -A CACHED_LABELS=()
+if [ -f "$CACHE_FILE" ] && [ -r "$CACHE_FILE" ]; then
+    while IFS=$'\t' read -r CACHE_KEY LABEL; do
+        [ -n "$CACHE_KEY" ] || continue
+        CACHED_LABELS[$CACHE_KEY]="${CACHED_LABELS[$CACHE_KEY]-}"
+        if [ -n "$LABEL" ]; then
+            CACHED_LABELS[$CACHE_KEY]+="$LABEL"$'\n'
+        fi
+    done < "$CACHE_FILE"
+fi
+
+declare -A CACHE_KEYS=()
+MISSING_IDS=()
+while IFS='|' read -r CONTAINER_ID CONTAINER_NAME CONTAINER_CREATED CONTAINER_IMAGE CONTAINER_PORTS; do
+    resolve_image_id "$CONTAINER_IMAGE"
+    CACHE_KEY="$CONTAINER_ID|$CONTAINER_CREATED|$IMAGE_KEY"
+    CACHE_KEYS[$CONTAINER_ID]="$CACHE_KEY"
+    if [ -z "${CACHED_LABELS[$CACHE_KEY]+x}" ]; then
+        MISSING_IDS+=("$CONTAINER_ID")
+    fi
+done <<< "$CONTAINERS"
 
-FIRST=true
-while IFS='|' read -r CONTAINER_ID CONTAINER_NAME; do
-    # Récupérer TOUS les labels, on filtrera avec grep
-    LABELS=$($DOCKER_CMD inspect "$CONTAINER_ID" --format '{{range $key, $value := .Config.Labels}}{{printf "%s=%s\n" $key $value}}{{end}}' 2>/dev/null | grep '^traefik\.' || echo "")
-    
-    if [ -n "$LABELS" ]; then
-        if [ "$FIRST" = false ]; then
-            echo "," >> "$OUTPUT_JSON"
+# Inspecter tous les containers absents du cache en un seul appel
+if [ ${#MISSING_IDS[@]} -gt 0 ]; then
+    # Une ligne "ID<tab>" par container (pour mettre en cache ceux sans label Traefik), puis "ID<tab>label" par label
+    INSPECTED=$($DOCKER_CMD inspect --format '{{printf "%s\t\n" .Id}}{{range $key, $value := .Config.Labels}}{{printf "%s\t%s=%s\n" $.Id $key $value}}{{end}}' "${MISSING_IDS[@]}" 2>/dev/null || true)
+    while IFS=$'\t' read -r CONTAINER_ID LABEL; do
+        # Un container supprimé entre-temps n'a pas de clé, et n'est pas mis en cache
+        [ -n "$CONTAINER_ID" ] && [ -n "${CACHE_KEYS[$CONTAINER_ID]+x}" ] || continue
+        CACHE_KEY="${CACHE_KEYS[$CONTAINER_ID]}"
+        CACHED_LABELS[$CACHE_KEY]="${CACHED_LABELS[$CACHE_KEY]-}"
+        if [[ "$LABEL" == traefik.* ]]; then
+            CACHED_LABELS[$CACHE_KEY]+="$LABEL"$'\n'
         fi
-        FIRST=false
-        
-        cat >> "$OUTPUT_JSON" << CONTAINER_JSON
-  {
-    "id": "$CONTAINER_ID",
-    "name": "$CONTAINER_NAME",
-    "labels": [
-CONTAINER_JSON
-        
-        FIRST_LABEL=true
+    done <<< "$INSPECTED"
+fi
+
+# Réécrire le cache avec les seuls containers encore présents.
+# Le cache n'est qu'une optimisation : s'il ne peut pas être écrit (répertoire non accessible en écriture,
+# disque plein, ...), la découverte continue sans lui (set -e ne s'applique pas dans une fonction appelée par `if`,
+# d'où les `|| return 1`).
+write_cache() {
+    mkdir -p "$(dirname "$CACHE_FILE")" || return 1
+    CACHE_TMP=$(mktemp "$CACHE_FILE.XXXXXX") || return 1
+    while IFS='|' read -r CONTAINER_ID CONTAINER_NAME CONTAINER_CREATED CONTAINER_IMAGE CONTAINER_PORTS; do
+        CACHE_KEY="${CACHE_KEYS[$CONTAINER_ID]}"
+        [ -n "${CACHED_LABELS[$CACHE_KEY]+x}" ] || continue
+        printf '%s\t\n' "$CACHE_KEY" || return 1
         while IFS= read -r LABEL; do
             if [ -n "$LABEL" ]; then
-                if [ "$FIRST_LABEL" = false ]; then
-                    echo "," >> "$OUTPUT_JSON"
-                fi
-                FIRST_LABEL=false
-                # Échapper les guillemets et backslashes dans le label
-                ESCAPED_LABEL=$(echo "$LABEL" | sed 's/\\/\\\\/g' | sed 's/"/\\"/g')
-                echo "      \"$ESCAPED_LABEL\"" >> "$OUTPUT_JSON"
+                printf '%s\t%s\n' "$CACHE_KEY" "$LABEL" || return 1
             fi
-        done <<< "$LABELS"
-        
-        echo "    ]" >> "$OUTPUT_JSON"
-        echo "  }" >> "$OUTPUT_JSON"
-    fi
+        done <<< "${CACHED_LABELS[$CACHE_KEY]}"
+    done <<< "$CONTAINERS" > "$CACHE_TMP" || return 1
+    # (mv déplacerait le fichier temporaire dans un répertoire portant le nom du cache)
+    [ ! -d "$CACHE_FILE" ] && mv -f "$CACHE_TMP" "$CACHE_FILE"
+}
+CACHE_TMP=""
+if ! write_cache 2> /dev/null; then
+    [ -z "$CACHE_TMP" ] || rm -f "$CACHE_TMP" 2> /dev/null || true
+fi
+
+# Échapper les guillemets et backslashes d'une chaîne JSON, dans $ESCAPED (sans sous-shell par label)
+json_escape() {
+    ESCAPED="${1//\\/\\\\}"
+    ESCAPED="${ESCAPED//\"/\\\"}"
+}
+
+# Sortie compacte : JSON sans indentation, chaque label distinct n'apparaissant qu'une fois dans "labels",
+# les containers y faisant référence par leur position (les labels communs à tous les containers,
+# comme traefik.enable=true, ne sont donc transmis qu'une fois)
+declare -A LABEL_INDEXES=()
+LABELS_JSON=""
+CONTAINERS_JSON=""
+while IFS='|' read -r CONTAINER_ID CONTAINER_NAME CONTAINER_CREATED CONTAINER_IMAGE CONTAINER_PORTS; do
+    LABELS="${CACHED_LABELS[${CACHE_KEYS[$CONTAINER_ID]}]-}"
+    [ -n "$LABELS" ] || continue
+
+    CONTAINER_LABELS_JSON=""
+    while IFS= read -r LABEL; do
+        [ -n "$LABEL" ] || continue
+        if [ -z "${LABEL_INDEXES[$LABEL]+x}" ]; then
+            LABEL_INDEXES[$LABEL]=${#LABEL_INDEXES[@]}
+            json_escape "$LABEL"
+            LABELS_JSON+="${LABELS_JSON:+,}\"$ESCAPED\""
+        fi
+        CONTAINER_LABELS_JSON+="${CONTAINER_LABELS_JSON:+,}${LABEL_INDEXES[$LABEL]}"
+    done <<< "$LABELS"
+
+    json_escape "$CONTAINER_NAME"
+    CONTAINERS_JSON+="${CONTAINERS_JSON:+,}{\"id\":\"${CONTAINER_ID:0:12}\",\"name\":\"$ESCAPED\","
+    json_escape "$CONTAINER_PORTS"
+    CONTAINERS_JSON+="\"published_ports\":\"$ESCAPED\",\"labels\":[$CONTAINER_LABELS_JSON]}"
 done <<< "$CONTAINERS"
 
-echo "]}" >> "$OUTPUT_JSON"
-cat "$OUTPUT_JSON"
-rm -f "$OUTPUT_JSON"
+OUTPUT="{\"labels\":[$LABELS_JSON],\"containers\":[$CONTAINERS_JSON]}"
+if [ "$COMPRESS" = true ]; then
+    printf '%s' "$OUTPUT" | gzip -c | base64 | tr -d '\n'
+    echo
+else
+    echo "$OUTPUT"
+fi
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2026, Traefik Proxmox Automation
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Resident agent keeping a VM's Proxmox notes in sync with the Traefik labels of its Docker containers.
+
+Instead of periodically re-running playbooks/discover-and-update.yml over the whole fleet, this runs on each
+Docker host and subscribes to the container `start`/`die`/`update` events of the local Docker socket.
+Each event only re-reads the affected container's labels (Docker includes them in the event attributes,
+but not the published ports, which are only listed for started containers in direct mode),
+bursts of events (e.g. during `just install-all`) are debounced, and one coalesced notes update is pushed
+per burst, using the same processing as the parse_docker_labels module.
+
+It is installed as a systemd service by playbooks/install-notes-agent.yml.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import ssl
+import sys
+import threading
+import time
+import urllib.parse
+
+# The module is installed next to this script, but lives in the role's library/ directory in the repository
+script_directory_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_directory_path)
+sys.path.insert(1, os.path.join(script_directory_path, '..', 'library'))
+
+from parse_docker_labels import collect_container_labels, process_labels, validate_transport_options
+
+DEFAULT_DOCKER_SOCKET_PATH = '/var/run/docker.sock'
+
+WATCHED_ACTIONS = ('start', 'die', 'update')
+
+# Put on the events queue when the events stream ends
+STREAM_CLOSED = object()
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def extract_traefik_labels(labels):
+    """
+    Extract the Traefik labels of a container.
+
+    Args:
+        labels (dict): Container labels (or Docker event attributes, which include the container labels)
+
+    Returns:
+        list: Sorted label strings in format "key=value"
+    """
+    return sorted(f'{key}={value}' for key, value in (labels or {}).items() if key.startswith('traefik.'))
+
+
+def format_published_ports(ports):
+    """
+    Format the ports of a container, as listed by the Docker API, like `docker ps --format '{{.Ports}}'` does
+    (which is what inspect-docker.sh outputs, and parse_docker_labels expects).
+
+    Args:
+        ports (list): Port dicts of a container (IP, PrivatePort, PublicPort, Type)
+
+    Returns:
+        str: Port mappings, e.g. "0.0.0.0:32768->8080/tcp, [::]:32768->8080/tcp, 9000/tcp"
+    """
+    mappings = []
+    for port in ports or []:
+        if port.get('PublicPort') is None:
+            mappings.append(f"{port['PrivatePort']}/{port.get('Type', 'tcp')}")
+            continue
+        host_address = port.get('IP', '0.0.0.0')
+        if ':' in host_address:
+            host_address = f'[{host_address}]'
+        mappings.append(f"{host_address}:{port['PublicPort']}->{port['PrivatePort']}/{port.get('Type', 'tcp')}")
+    return ', '.join(sorted(mappings))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to a Unix socket (like the Docker API's)."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class EventsStream:
+    """Iterates over the decoded events of a Docker `/events` response."""
+
+    def __init__(self, connection, response):
+        self.connection = connection
+        self.response = response
+
+    def __iter__(self):
+        for line in self.response:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+    def interrupt(self):
+        """Makes a thread iterating over the stream stop, without closing the connection under its feet."""
+        # Shutting the socket down (rather than closing it) wakes up a thread blocked reading from it
+        if self.connection.sock is not None:
+            try:
+                self.connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.connection.close()
+
+
+class DockerClient:
+    """Minimal client for the parts of the Docker API the agent needs."""
+
+    def __init__(self, socket_path=DEFAULT_DOCKER_SOCKET_PATH, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def list_containers(self, container_id=None):
+        """Returns the running containers (with their labels and ports), or only the given one."""
+        path = '/containers/json'
+        if container_id is not None:
+            path += '?filters=' + urllib.parse.quote(json.dumps({'id': [container_id]}))
+        connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise Exception(f'Docker API returned HTTP {response.status} when listing containers')
+            return json.loads(body)
+        finally:
+            connection.close()
+
+    def open_events(self):
+        """Subscribes to the container events the agent watches and returns an EventsStream."""
+        filters = json.dumps({'type': ['container'], 'event': list(WATCHED_ACTIONS)})
+        # No timeout: the stream stays silent for as long as nothing happens
+        connection = UnixHTTPConnection(self.socket_path)
+        try:
+            connection.request('GET', '/events?filters=' + urllib.parse.quote(filters))
+            response = connection.getresponse()
+            if response.status != 200:
+                raise Exception(f'Docker API returned HTTP {response.status} when subscribing to events')
+        except BaseException:
+            connection.close()
+            raise
+        return EventsStream(connection, response)
+
+
+class ProxmoxNotesClient:
+    """Updates the notes of a single VM through the Proxmox API."""
+
+    def __init__(self, api_host, node, vmid, api_user, api_token_id, api_token_secret, validate_certs=False):
+        self.api_host = api_host
+        self.path = f'/api2/json/nodes/{node}/qemu/{vmid}/config'
+        self.headers = {
+            'Authorization': f'PVEAPIToken={api_user}!{api_token_id}={api_token_secret}',
+            'Content-Type': 'application/json'
+        }
+        self.context = ssl.create_default_context()
+        if not validate_certs:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+
+    def push_notes(self, notes):
+        connection = http.client.HTTPSConnection(self.api_host, 8006, context=self.context, timeout=30)
+        try:
+            connection.request('PUT', self.path, body=json.dumps({'description': notes}), headers=self.headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise Exception(f'Proxmox API returned HTTP {response.status} {response.reason}')
+
+
+class NotesAgent:
+    """
+    Keeps a cache of the Traefik labels of each running container, updated from Docker events,
+    and pushes the resulting notes whenever they change, once per burst of events.
+
+    Args:
+        docker_client (DockerClient): Client for the local Docker API
+        push_notes (callable): Called with the new notes (str) to publish them
+        debounce (float): Seconds without events after which a burst is considered over
+        max_delay (float): Maximum seconds a burst can delay pushing its changes
+        retry_interval (float): Seconds to wait before reconnecting to Docker or retrying a failed push
+        process_options (dict): Keyword arguments for process_labels() (gateway_mode, ...)
+    """
+
+    def __init__(self, docker_client, push_notes, debounce=2.0, max_delay=30.0, retry_interval=5.0,
+                 process_options=None):
+        self.docker_client = docker_client
+        self.push_notes = push_notes
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.retry_interval = retry_interval
+        self.process_options = process_options or {}
+        # Only direct mode routes to the containers' published ports
+        self.direct_mode = self.process_options.get('gateway_mode') == 'direct'
+
+        # Container ID => Traefik labels, only for containers which have some
+        self.labels_by_container_id = {}
+        # Container ID => published ports (as formatted by format_published_ports), only needed in direct mode
+        self.published_ports_by_container_id = {}
+        self.last_pushed_notes = None
+
+        self.stopping = threading.Event()
+        self.events_stream = None
+
+    def sync_containers(self):
+        """Rebuilds the label cache from the running containers (at startup and whenever events may have been missed)."""
+        self.labels_by_container_id = {}
+        self.published_ports_by_container_id = {}
+        for container in self.docker_client.list_containers():
+            labels = extract_traefik_labels(container.get('Labels'))
+            if labels:
+                self.labels_by_container_id[container['Id']] = labels
+                self.published_ports_by_container_id[container['Id']] = (
+                    format_published_ports(container.get('Ports')) if self.direct_mode else ''
+                )
+
+    def find_published_ports(self, container_id):
+        """
+        Find the published ports of a container, which Docker events don't include.
+
+        Returns:
+            str: The container's published ports, or an empty string if they aren't needed (or it is gone)
+        """
+        if not self.direct_mode:
+            return ''
+        for container in self.docker_client.list_containers(container_id):
+            if container['Id'] == container_id:
+                return format_published_ports(container.get('Ports'))
+        return ''
+
+    def handle_event(self, event):
+        """
+        Update the label cache for one Docker event.
+
+        Returns:
+            bool: Whether the cache changed
+        """
+        actor = event.get('Actor', {})
+        container_id = actor.get('ID') or event.get('id')
+        action = event.get('Action') or event.get('status')
+        if container_id is None or action not in WATCHED_ACTIONS:
+            return False
+
+        if action == 'die':
+            self.published_ports_by_container_id.pop(container_id, None)
+            return self.labels_by_container_id.pop(container_id, None) is not None
+
+        labels = extract_traefik_labels(actor.get('Attributes'))
+        if not labels:
+            self.published_ports_by_container_id.pop(container_id, None)
+            return self.labels_by_container_id.pop(container_id, None) is not None
+
+        # Ports are published anew each time a container starts
+        published_ports = self.published_ports_by_container_id.get(container_id)
+        if action == 'start' or published_ports is None:
+            published_ports = self.find_published_ports(container_id)
+        if (self.labels_by_container_id.get(container_id) == labels
+                and self.published_ports_by_container_id.get(container_id) == published_ports):
+            return False
+        self.labels_by_container_id[container_id] = labels
+        self.published_ports_by_container_id[container_id] = published_ports
+        return True
+
+    def generate_notes(self):
+        containers = [
+            {
+                'labels': self.labels_by_container_id[container_id],
+                'published_ports': self.published_ports_by_container_id.get(container_id, '')
+            }
+            for container_id in sorted(self.labels_by_container_id.keys())
+        ]
+        if not containers:
+            # Nothing is exposed anymore, so the Gateway should not route anything here either
+            return ''
+        labels = collect_container_labels(containers)
+        return process_labels(labels, containers=containers, **self.process_options)['proxmox_notes']
+
+    def flush(self):
+        """
+        Push the notes for the current label cache, unless they were already pushed.
+
+        Returns:
+            bool: False if pushing failed (and should be retried)
+        """
+        notes = self.generate_notes()
+        if notes == self.last_pushed_notes:
+            return True
+        try:
+            self.push_notes(notes)
+        except Exception as e:
+            log(f'Failed updating Proxmox notes: {e}')
+            return False
+        self.last_pushed_notes = notes
+        log(f'Updated Proxmox notes ({len(self.labels_by_container_id)} containers with Traefik labels)')
+        return True
+
+    def process_events(self, events_stream):
+        """Handles events until the stream ends, pushing one notes update per burst."""
+        events = queue.Queue()
+
+        def read_events():
+            try:
+                for event in events_stream:
+                    events.put(event)
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                if not self.stopping.is_set():
+                    log(f'Docker events stream failed: {e}')
+            finally:
+                events_stream.close()
+                events.put(STREAM_CLOSED)
+
+        reader = threading.Thread(target=read_events, daemon=True)
+        reader.start()
+
+        # The notes for the freshly synced cache are pushed right away
+        burst_start_time = None
+        flush_time = time.monotonic()
+        while True:
+            timeout = None if flush_time is None else max(flush_time - time.monotonic(), 0)
+            try:
+                event = events.get(timeout=timeout)
+            except queue.Empty:
+                if self.flush():
+                    burst_start_time = None
+                    flush_time = None
+                else:
+                    flush_time = time.monotonic() + self.retry_interval
+                continue
+
+            if event is STREAM_CLOSED:
+                reader.join()
+                if flush_time is not None:
+                    self.flush()
+                return
+
+            if not self.handle_event(event):
+                continue
+            now = time.monotonic()
+            if burst_start_time is None:
+                burst_start_time = now
+            flush_time = min(now + self.debounce, burst_start_time + self.max_delay)
+
+    def run(self):
+        """Runs until stop() is called, reconnecting to Docker whenever the events stream is lost."""
+        while not self.stopping.is_set():
+            try:
+                # Subscribing before listing containers, so that no change between the two goes unnoticed
+                self.events_stream = self.docker_client.open_events()
+                self.sync_containers()
+            except Exception as e:
+                if self.events_stream is not None:
+                    self.events_stream.close()
+                    self.events_stream = None
+                log(f'Failed connecting to Docker: {e}')
+                self.stopping.wait(self.retry_interval)
+                continue
+
+            if self.stopping.is_set():
+                # stop() was called before there was a stream for it to interrupt
+                self.events_stream.interrupt()
+            self.process_events(self.events_stream)
+            self.events_stream = None
+
+            if not self.stopping.is_set():
+                log('Docker events stream ended, reconnecting')
+                self.stopping.wait(self.retry_interval)
+
+    def stop(self):
+        self.stopping.set()
+        events_stream = self.events_stream
+        if events_stream is not None:
+            events_stream.interrupt()
+
+
+def parse_arguments(args=None):
+    """Parses the command line, whose defaults match those of the role (see traefik-notes-agent.service.j2)."""
+    parser = argparse.ArgumentParser(
+        description='Keeps the Proxmox notes of this VM in sync with the Traefik labels of its Docker containers'
+    )
+    parser.add_argument('--docker-socket', default=DEFAULT_DOCKER_SOCKET_PATH)
+    parser.add_argument('--debounce', type=float, default=2.0,
+                        help='Seconds without events after which a burst is pushed (default: 2)')
+    parser.add_argument('--max-delay', type=float, default=30.0,
+                        help='Maximum seconds a long burst can delay an update (default: 30)')
+    parser.add_argument('--gateway-mode', default='filter', choices=['filter', 'passthrough', 'direct'])
+    parser.add_argument('--traefik-local-port', type=int, default=8080)
+    parser.add_argument('--gateway-service-name', default='homelab-traefik')
+    parser.add_argument('--transport-option', action='append', default=[], metavar='PROPERTY=VALUE',
+                        help='Transport option of the service pointing to the local Traefik. Can be given multiple times.')
+    parser.add_argument('--proxmox-api-host')
+    parser.add_argument('--proxmox-api-user', default='root@pam')
+    parser.add_argument('--proxmox-api-token-id', default='ansible')
+    parser.add_argument('--proxmox-node')
+    parser.add_argument('--vmid', type=int)
+    parser.add_argument('--dry-run', action='store_true', help='Print the notes instead of updating Proxmox')
+    args = parser.parse_args(args)
+
+    args.transport_options = {}
+    for transport_option in args.transport_option:
+        if '=' not in transport_option:
+            parser.error(f'invalid --transport-option: {transport_option}')
+        property_name, value = transport_option.split('=', 1)
+        args.transport_options[property_name] = value
+    try:
+        # Rejected at startup, rather than each time the notes are generated
+        args.transport_options = validate_transport_options(args.transport_options)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not args.dry_run and (args.proxmox_api_host is None or args.proxmox_node is None or args.vmid is None):
+        parser.error('--proxmox-api-host, --proxmox-node and --vmid are required (unless using --dry-run)')
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    if args.dry_run:
+        def push_notes(notes):
+            print(notes + '\n', flush=True)
+    else:
+        # The secret is deliberately not a command-line argument, so that it doesn't show up in process lists
+        api_token_secret = os.environ.get('PROXMOX_API_TOKEN_SECRET')
+        if api_token_secret is None:
+            sys.exit('Error: the PROXMOX_API_TOKEN_SECRET environment variable is not set')
+        push_notes = ProxmoxNotesClient(
+            args.proxmox_api_host,
+            args.proxmox_node,
+            args.vmid,
+            args.proxmox_api_user,
+            args.proxmox_api_token_id,
+            api_token_secret
+        ).push_notes
+
+    agent = NotesAgent(
+        DockerClient(args.docker_socket),
+        push_notes,
+        debounce=args.debounce,
+        max_delay=args.max_delay,
+        process_options=dict(
+            gateway_mode=args.gateway_mode,
+            traefik_local_port=args.traefik_local_port,
+            gateway_service_name=args.gateway_service_name,
+            transport_options=args.transport_options
+        )
+    )
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        agent.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -21,13 +21,62 @@ options:
         description:
             - List of Traefik labels from Docker containers
             - Each label should be in format "key=value"
-        required: true
+            - Required unless C(discovery_output) or C(discovery_script) is given
+        required: false
         type: list
         elements: str
     vmid:
         description: Proxmox VM/LXC ID
         required: true
         type: int
+    gateway_mode:
+        description:
+            - How labels are turned into Gateway labels
+            - C(filter) keeps the labels relevant to the Gateway
+            - C(passthrough) sends all routes to the local Traefik
+            - C(direct) sends routes straight to the containers' published ports, falling back to the local Traefik
+        required: false
+        type: str
+        default: filter
+        choices: [filter, passthrough, direct]
+    containers:
+        description:
+            - Containers as output by inspect-docker.sh (with their C(labels) and C(published_ports))
+            - Needed for the C(direct) gateway mode
+        required: false
+        type: list
+        elements: dict
+    discovery_output:
+        description:
+            - Raw output of inspect-docker.sh (compact JSON, or gzip+base64 with C(--gzip)), decoded by the module
+            - Replaces C(labels) and C(containers), which are taken from it
+        required: false
+        type: str
+    discovery_script:
+        description:
+            - Path of inspect-docker.sh on the managed host, which the module runs itself
+            - Like C(discovery_output), but the output never leaves the host nor is registered as a fact
+        required: false
+        type: path
+    transport_options:
+        description:
+            - Transport tuning for the Gateway service pointing to the local Traefik (pass-through and direct modes)
+            - Keys are service properties, among C(loadbalancer.server.scheme) (http, https or h2c),
+              C(loadbalancer.passhostheader), C(loadbalancer.responseforwarding.flushinterval)
+              and C(loadbalancer.serverstransport) (a serversTransport defined on the Gateway, e.g. C(streaming@file))
+            - The same properties are taken from container labels for the services routed to directly
+        required: false
+        type: dict
+    replicas:
+        description:
+            - Results of the module for all hosts, to merge routers replicated on several hosts into load-balanced
+              services, like bin/discover_traefik_labels.py does
+            - Each item has the C(host) name, its C(proxmox_notes) and C(local_labels), and its C(weight) (optional)
+            - Replaces C(labels), C(discovery_output) and C(discovery_script), the merged notes being returned as
+              C(notes_by_host)
+        required: false
+        type: list
+        elements: dict
 author:
     - Traefik Proxmox Automation Team
 '''
@@ -47,6 +96,20 @@ EXAMPLES = r'''
 - name: Display formatted notes
   debug:
     msg: "{{ result.proxmox_notes }}"
+
+- name: Merge routers replicated on several hosts
+  parse_docker_labels:
+    replicas:
+      - host: vm1
+        proxmox_notes: "{{ hostvars['vm1'].result.proxmox_notes }}"
+        local_labels: "{{ hostvars['vm1'].result.local_labels }}"
+      - host: vm2
+        proxmox_notes: "{{ hostvars['vm2'].result.proxmox_notes }}"
+        local_labels: "{{ hostvars['vm2'].result.local_labels }}"
+        weight: 2
+    vmid: 106
+  run_once: true
+  register: merged
 '''
 
 RETURN = r'''
@@ -75,9 +138,32 @@ labels_count:
     type: int
     returned: always
     sample: 10
+containers_count:
+    description: Number of containers with Traefik labels
+    type: int
+    returned: unless replicas are given
+    sample: 3
+local_labels:
+    description: Traefik labels of the host's containers, for merging replicated routers (see C(replicas))
+    type: list
+    returned: unless replicas are given
+notes_by_host:
+    description: Merged Proxmox notes of each host with notes
+    type: dict
+    returned: when replicas are given
+    sample: {"vm1": "traefik.enable=true\n..."}
 '''
 
+import argparse
+import base64
+import binascii
+import concurrent.futures
+import functools
+import gzip
+import json
+import os
 import re
+import sys
 
 # Import AnsibleModule only when running as Ansible module
 try:
@@ -87,6 +173,247 @@ except ImportError:
     HAS_ANSIBLE = False
 
 
+# Service properties tuning how the Gateway talks to backends (protocol, connection reuse, streaming),
+# with the pattern their values must match. Timeouts and keep-alive settings can't be set with labels,
+# they belong to a serversTransport defined on the Gateway, which services can refer to.
+TRANSPORT_PROPERTY_PATTERNS = {
+    'loadbalancer.server.scheme': r'^(http|https|h2c)$',
+    'loadbalancer.passhostheader': r'^(true|false)$',
+    'loadbalancer.responseforwarding.flushinterval': r'^-?\d+(ns|us|ms|s|m|h)?$',
+    'loadbalancer.serverstransport': r'^[A-Za-z0-9_.-]+(@[A-Za-z0-9_-]+)?$',
+}
+
+
+def is_valid_transport_value(property_name, value):
+    """
+    Check a transport property's value.
+
+    Args:
+        property_name (str): Service property (a key of TRANSPORT_PROPERTY_PATTERNS)
+        value (str): Value to check
+
+    Returns:
+        bool: Whether the value is valid for the property
+    """
+    return re.match(TRANSPORT_PROPERTY_PATTERNS[property_name], str(value).lower()) is not None
+
+
+def get_transport_options(service):
+    """
+    Extract the valid transport properties of a service.
+
+    Args:
+        service (dict): Service properties (as parsed by parse_traefik_labels)
+
+    Returns:
+        dict: Transport property => value, for the valid ones
+    """
+    return {
+        property_name.lower(): value
+        for property_name, value in service.items()
+        if property_name.lower() in TRANSPORT_PROPERTY_PATTERNS
+        and is_valid_transport_value(property_name.lower(), value)
+    }
+
+
+def find_invalid_transport_labels(labels):
+    """
+    Find the transport labels whose values are invalid (these are never passed on to the Gateway).
+
+    Args:
+        labels (list): List of label strings in format "key=value"
+
+    Returns:
+        list: The invalid labels
+    """
+    service_pattern = re.compile(r'^traefik\.http\.services\.[^.]+\.(.+)$')
+
+    invalid_labels = []
+    for label in labels:
+        if '=' not in label:
+            continue
+        key, value = label.split('=', 1)
+        match = service_pattern.match(key)
+        if not match:
+            continue
+        property_name = match.group(1).lower()
+        if property_name in TRANSPORT_PROPERTY_PATTERNS and not is_valid_transport_value(property_name, value):
+            invalid_labels.append(label)
+    return invalid_labels
+
+
+def validate_transport_options(transport_options):
+    """
+    Validate transport options given as role variables.
+
+    Args:
+        transport_options (dict): Transport property => value
+
+    Returns:
+        dict: The options, with lowercase property names
+
+    Raises:
+        ValueError: If a property is unknown or has an invalid value
+    """
+    validated = {}
+    for property_name, value in (transport_options or {}).items():
+        property_name = property_name.lower()
+        if property_name not in TRANSPORT_PROPERTY_PATTERNS:
+            raise ValueError(f"Unknown transport option {property_name} (supported: {', '.join(sorted(TRANSPORT_PROPERTY_PATTERNS))})")
+        value = str(value).lower() if isinstance(value, bool) else str(value)
+        if not is_valid_transport_value(property_name, value):
+            raise ValueError(f"Invalid value for transport option {property_name}: {value}")
+        validated[property_name] = value
+    return validated
+
+
+def generate_transport_labels(service_name, transport_options):
+    """
+    Generate the labels of a Gateway service's transport options (the scheme defaults to http).
+
+    Args:
+        service_name (str): Gateway service name
+        transport_options (dict): Transport property => value
+
+    Returns:
+        list: Service labels, sorted by property
+    """
+    options = dict(transport_options)
+    options.setdefault('loadbalancer.server.scheme', 'http')
+    return [
+        f"traefik.http.services.{service_name}.{property_name}={value}"
+        for property_name, value in sorted(options.items())
+    ]
+
+
+# Middleware types which only matter for performance (bandwidth, latency, load), with the options the Gateway keeps
+# (None for all of them). Other middleware types (authentication, redirects, path rewriting, ...) only make sense
+# on the local Traefik, and are dropped.
+PERFORMANCE_MIDDLEWARE_OPTIONS = {
+    'compress': None,
+    'buffering': None,
+    'ratelimit': None,
+    # Only caching headers
+    'headers': (
+        'customresponseheaders.cache-control',
+        'customresponseheaders.expires',
+        'customresponseheaders.vary',
+    ),
+}
+
+# Performance middlewares which the local Traefik defines outside of container labels, and which the Gateway
+# therefore doesn't know (e.g. the compression middleware of the MASH Traefik role, from its file provider).
+# Reference => (Gateway middleware name, Gateway middleware properties)
+MIDDLEWARE_REFERENCE_TRANSLATIONS = {
+    'compression@file': ('gateway-compression', {'compress': 'true'}),
+}
+
+
+def translate_middlewares(labels):
+    """
+    Translate the performance middlewares of local routers into Gateway middlewares.
+
+    Middlewares defined in the labels keep their performance options (see PERFORMANCE_MIDDLEWARE_OPTIONS),
+    known external middlewares are replaced by Gateway-side definitions (see MIDDLEWARE_REFERENCE_TRANSLATIONS),
+    and everything else is dropped.
+
+    Args:
+        labels (list): List of label strings in format "key=value"
+
+    Returns:
+        tuple: (Gateway middleware name => properties, for the middlewares used by routers,
+                router name => (Gateway middleware names, whether all of the router's middlewares were translated))
+    """
+    parsed = parse_traefik_labels(labels)
+
+    kept_middlewares = {}
+    fully_kept_middleware_names = set()
+    for middleware_name, properties in parsed['middlewares'].items():
+        kept_properties = {}
+        for property_name, value in properties.items():
+            middleware_type, _, option = property_name.lower().partition('.')
+            if middleware_type not in PERFORMANCE_MIDDLEWARE_OPTIONS:
+                continue
+            allowed_options = PERFORMANCE_MIDDLEWARE_OPTIONS[middleware_type]
+            if allowed_options is None or option in allowed_options:
+                kept_properties[property_name] = value
+        if kept_properties:
+            kept_middlewares[middleware_name] = kept_properties
+            if len(kept_properties) == len(properties):
+                fully_kept_middleware_names.add(middleware_name)
+
+    middlewares = {}
+    routers = {}
+    for router_name, router in parsed['routers'].items():
+        if 'middlewares' not in router:
+            continue
+
+        gateway_middleware_names = []
+        all_translated = True
+        for reference in router['middlewares'].split(','):
+            reference = reference.strip()
+            if not reference:
+                continue
+
+            # Middlewares from container labels are referenced with or without their provider
+            middleware_name = reference[:-len('@docker')] if reference.endswith('@docker') else reference
+            if middleware_name in kept_middlewares:
+                gateway_middleware_names.append(middleware_name)
+                middlewares[middleware_name] = kept_middlewares[middleware_name]
+                if middleware_name not in fully_kept_middleware_names:
+                    all_translated = False
+            elif reference in MIDDLEWARE_REFERENCE_TRANSLATIONS:
+                gateway_middleware_name, properties = MIDDLEWARE_REFERENCE_TRANSLATIONS[reference]
+                gateway_middleware_names.append(gateway_middleware_name)
+                middlewares[gateway_middleware_name] = properties
+            else:
+                all_translated = False
+
+        routers[router_name] = (gateway_middleware_names, all_translated)
+
+    return middlewares, routers
+
+
+def generate_middleware_labels(middlewares):
+    """
+    Generate the labels defining Gateway middlewares.
+
+    Args:
+        middlewares (dict): Middleware name => properties (as returned by translate_middlewares)
+
+    Returns:
+        list: Middleware labels, sorted
+    """
+    return sorted(
+        f"traefik.http.middlewares.{middleware_name}.{property_name}={value}"
+        for middleware_name, properties in middlewares.items()
+        for property_name, value in properties.items()
+    )
+
+
+def generate_gateway_labels_filter(labels):
+    """
+    Generate Gateway Traefik labels in filter mode.
+
+    Keeps the labels relevant to the Gateway (see filter_labels_for_gateway), along with the translated
+    performance middlewares of each router (see translate_middlewares).
+
+    Args:
+        labels (list): List of label strings in format "key=value"
+
+    Returns:
+        list: Filtered labels, followed by middleware definitions and router middleware references
+    """
+    middlewares, routers = translate_middlewares(labels)
+
+    gateway_labels = filter_labels_for_gateway(labels)
+    gateway_labels.extend(generate_middleware_labels(middlewares))
+    for router_name, (gateway_middleware_names, _) in sorted(routers.items()):
+        if gateway_middleware_names:
+            gateway_labels.append(f"traefik.http.routers.{router_name}.middlewares={','.join(gateway_middleware_names)}")
+    return gateway_labels
+
+
 def filter_labels_for_gateway(labels):
     """
     Filter Docker Traefik labels to keep only those needed for Gateway Traefik with Proxmox Provider.
@@ -99,7 +426,8 @@ def filter_labels_for_gateway(labels):
     This keeps:
     - traefik.enable
     - Router configuration: rule, entrypoints, tls, priority, service
-    - Service configuration: loadbalancer.server.port, loadbalancer.server.scheme
+    - Service configuration: loadbalancer.server.port, and transport properties with valid values
+      (see TRANSPORT_PROPERTY_PATTERNS)
 
     Args:
         labels (list): List of label strings in format "key=value"
@@ -117,8 +445,13 @@ def filter_labels_for_gateway(labels):
         r'^traefik\.http\.routers\.[^.]+\.priority$',
         r'^traefik\.http\.routers\.[^.]+\.service$',
         r'^traefik\.http\.services\.[^.]+\.loadbalancer\.server\.port$',
-        r'^traefik\.http\.services\.[^.]+\.loadbalancer\.server\.scheme$',
     ]
+    # Transport properties are usually written in camel case (e.g. passHostHeader)
+    allowed_patterns.extend(
+        r'(?i)^traefik\.http\.services\.[^.]+\.' + re.escape(property_name) + '$'
+        for property_name in TRANSPORT_PROPERTY_PATTERNS
+    )
+    invalid_labels = set(find_invalid_transport_labels(labels))
 
     # Patterns for labels to EXCLUDE (takes priority over allowed)
     excluded_patterns = [
@@ -143,15 +476,16 @@ def filter_labels_for_gateway(labels):
         if is_excluded:
             continue
 
-        # Check if allowed
+        # Check if allowed (transport labels need valid values as well)
         is_allowed = any(re.match(pattern, key) for pattern in allowed_patterns)
-        if is_allowed:
+        if is_allowed and label not in invalid_labels:
             filtered_labels.append(label)
 
     return filtered_labels
 
 
-def generate_gateway_labels_passthrough(labels, traefik_local_port=8080, service_name="homelab-traefik"):
+def generate_gateway_labels_passthrough(labels, traefik_local_port=8080, service_name="homelab-traefik",
+                                        transport_options=None):
     """
     Generate Gateway Traefik labels in pass-through mode.
 
@@ -167,6 +501,7 @@ def generate_gateway_labels_passthrough(labels, traefik_local_port=8080, service
         labels (list): List of label strings from all containers
         traefik_local_port (int): Port of local Traefik (default: 8080)
         service_name (str): Name of the service pointing to local Traefik
+        transport_options (dict): Validated transport options of that service (scheme defaults to http)
 
     Returns:
         list: Gateway labels with copied rules and single service
@@ -210,14 +545,350 @@ def generate_gateway_labels_passthrough(labels, traefik_local_port=8080, service
         ])
 
     # Single service pointing to local Traefik
-    gateway_labels.extend([
-        f"traefik.http.services.{service_name}.loadbalancer.server.port={traefik_local_port}",
-        f"traefik.http.services.{service_name}.loadbalancer.server.scheme=http"
-    ])
+    gateway_labels.append(f"traefik.http.services.{service_name}.loadbalancer.server.port={traefik_local_port}")
+    gateway_labels.extend(generate_transport_labels(service_name, transport_options or {}))
 
     return gateway_labels
 
 
+def parse_published_ports(published_ports):
+    """
+    Parse the published ports of a container, as listed by `docker ps --format '{{.Ports}}'`.
+
+    Ports only published on a loopback address are left out, as the Gateway can't reach them.
+
+    Args:
+        published_ports (str): Port mappings, e.g. "0.0.0.0:32768->8080/tcp, :::32768->8080/tcp, 9000/tcp"
+
+    Returns:
+        dict: Container TCP port (int) => host port (int)
+    """
+    host_ports = {}
+    mapping_pattern = re.compile(r'^(.*):(\d+)(?:-(\d+))?->(\d+)(?:-(\d+))?/tcp$')
+
+    for mapping in (published_ports or '').split(','):
+        match = mapping_pattern.match(mapping.strip())
+        if not match:
+            # Exposed but unpublished ports (e.g. "9000/tcp") and UDP ports
+            continue
+
+        host_address = match.group(1).strip('[]')
+        if host_address in ('127.0.0.1', '::1', 'localhost'):
+            continue
+
+        host_port_start = int(match.group(2))
+        container_port_start = int(match.group(4))
+        container_port_end = int(match.group(5) or match.group(4))
+        for offset in range(container_port_end - container_port_start + 1):
+            host_ports.setdefault(container_port_start + offset, host_port_start + offset)
+
+    return host_ports
+
+
+def get_router_service_name(router, services):
+    """
+    Get the name of the service a router sends its requests to.
+
+    Args:
+        router (dict): Router properties (as parsed by parse_traefik_labels)
+        services (dict): Services defined along with the router (as parsed by parse_traefik_labels)
+
+    Returns:
+        str: The router's explicit service, or (like Traefik does) the only service defined along with it, or None
+    """
+    service_name = router.get('service')
+    if service_name is None and len(services) == 1:
+        service_name = next(iter(services))
+    return service_name
+
+
+def resolve_direct_backend(router, services, host_ports):
+    """
+    Find the host port at which the Gateway can reach a router's backend container directly.
+
+    Args:
+        router (dict): Router properties (as parsed by parse_traefik_labels)
+        services (dict): Services defined by the same container (as parsed by parse_traefik_labels)
+        host_ports (dict): Published ports of the container (as parsed by parse_published_ports)
+
+    Returns:
+        tuple: (host port, transport options), or None if the backend can't be reached directly
+    """
+    service_name = get_router_service_name(router, services)
+
+    if service_name is not None and service_name not in services:
+        # Services of other containers or providers (e.g. api@internal) are only known to the local Traefik
+        return None
+
+    service = services.get(service_name, {})
+    transport_options = get_transport_options(service)
+    container_port = service.get('loadbalancer.server.port')
+
+    if container_port is None:
+        # Like Traefik, use the container's only port when the service doesn't name one
+        if len(host_ports) != 1:
+            return None
+        return next(iter(host_ports.values())), transport_options
+
+    try:
+        host_port = host_ports.get(int(container_port))
+    except ValueError:
+        return None
+    if host_port is None:
+        return None
+    return host_port, transport_options
+
+
+def generate_gateway_labels_direct(containers, traefik_local_port=8080, service_name="homelab-traefik",
+                                   transport_options=None):
+    """
+    Generate Gateway Traefik labels in direct mode.
+
+    Like pass-through mode, each Gateway router uses the SAME rule as the local container.
+    But routers whose backend container publishes its port on the host get their own Gateway service,
+    pointing straight at that port, which saves the hop through the local Traefik.
+    Other routers, and routers using middlewares (which only the local Traefik applies),
+    fall back to the local Traefik service, like in pass-through mode.
+    Routers whose middlewares are all performance middlewares (see translate_middlewares) can still go direct,
+    with the Gateway applying the translated middlewares instead.
+    Direct services keep the transport properties (scheme, passHostHeader, ...) of the container's service.
+
+    Architecture:
+        Gateway Traefik → container (published port)
+        Gateway Traefik → Local Traefik → container (fallback)
+
+    Args:
+        containers (list): Containers (dicts with "labels" and "published_ports")
+        traefik_local_port (int): Port of local Traefik (default: 8080)
+        service_name (str): Name of the service pointing to local Traefik
+        transport_options (dict): Validated transport options of that service (scheme defaults to http)
+
+    Returns:
+        list: Gateway labels with copied rules, direct services and (if needed) the local Traefik service
+    """
+    routers = {}
+    middlewares = {}
+
+    for container in containers:
+        parsed = parse_traefik_labels(container.get('labels', []))
+        host_ports = parse_published_ports(container.get('published_ports', ''))
+        container_middlewares, router_middlewares = translate_middlewares(container.get('labels', []))
+
+        for original_router_name, router in parsed['routers'].items():
+            if 'rule' not in router:
+                continue
+
+            gateway_middleware_names, all_translated = router_middlewares.get(original_router_name, ([], True))
+            backend = None
+            if all_translated:
+                backend = resolve_direct_backend(router, parsed['services'], host_ports)
+            if backend is None:
+                # The local Traefik applies the middlewares
+                gateway_middleware_names = []
+            for middleware_name in gateway_middleware_names:
+                middlewares[middleware_name] = container_middlewares[middleware_name]
+
+            # Simplify router name (remove 'mash-' prefix if present)
+            gateway_router_name = original_router_name.replace('mash-', '')
+
+            routers[gateway_router_name] = {
+                'rule': router['rule'],
+                'backend': backend,
+                'middlewares': gateway_middleware_names
+            }
+
+    # Generate Gateway labels
+    gateway_labels = ["traefik.enable=true"]
+    uses_local_traefik = False
+
+    for router_name, router_data in sorted(routers.items()):
+        router_service_name = service_name
+        if router_data['backend'] is None:
+            uses_local_traefik = True
+        else:
+            router_service_name = router_name
+
+        gateway_labels.extend([
+            f"traefik.http.routers.{router_name}.entrypoints=websecure",
+            f"traefik.http.routers.{router_name}.rule={router_data['rule']}",
+            f"traefik.http.routers.{router_name}.service={router_service_name}",
+            f"traefik.http.routers.{router_name}.tls=true",
+            f"traefik.http.routers.{router_name}.tls.certresolver=letsencrypt"
+        ])
+
+        if router_data['middlewares']:
+            gateway_labels.append(f"traefik.http.routers.{router_name}.middlewares={','.join(router_data['middlewares'])}")
+
+        if router_data['backend'] is not None:
+            host_port, backend_transport_options = router_data['backend']
+            gateway_labels.append(f"traefik.http.services.{router_name}.loadbalancer.server.port={host_port}")
+            gateway_labels.extend(generate_transport_labels(router_name, backend_transport_options))
+
+    if uses_local_traefik:
+        gateway_labels.append(f"traefik.http.services.{service_name}.loadbalancer.server.port={traefik_local_port}")
+        gateway_labels.extend(generate_transport_labels(service_name, transport_options or {}))
+
+    gateway_labels.extend(generate_middleware_labels(middlewares))
+
+    return gateway_labels
+
+
+def find_health_check(rule, hosts_local_labels):
+    """
+    Find the health check of the local service behind a router rule, on any of the hosts.
+
+    Args:
+        rule (str): Router rule
+        hosts_local_labels (list): Local Traefik labels of each host
+
+    Returns:
+        dict: Health check properties (e.g. {"path": "/healthz"}), empty if none is defined
+    """
+    for local_labels in hosts_local_labels:
+        parsed = parse_traefik_labels(local_labels)
+        for router in parsed['routers'].values():
+            if router.get('rule') != rule:
+                continue
+            service = parsed['services'].get(get_router_service_name(router, parsed['services']), {})
+            health_check = {
+                key[len('loadbalancer.healthcheck.'):]: value
+                for key, value in service.items()
+                if key.startswith('loadbalancer.healthcheck.')
+            }
+            if health_check:
+                return health_check
+    return {}
+
+
+def merge_replicated_routers(hosts_gateway_labels, hosts_local_labels, weights=None, service_name="homelab-traefik"):
+    """
+    Merge routers replicated on several hosts into one load-balanced Gateway service.
+
+    When the same rule is routed by several hosts (the same service running on several VMs for capacity),
+    each host gets the same router, pointing to a service named after it and prefixed with service_name
+    (e.g. "homelab-traefik-miniflux"), in which it declares its own server (with its weight, if any).
+    The Gateway then merges these into a single service with one server per host. The prefix keeps this service
+    apart from the services of non-replicated routers: the local Traefik service every host declares in
+    pass-through mode (service_name itself, which the Gateway would otherwise merge across hosts too), and the
+    services named after their router in direct mode.
+    Health checks come from the local service's `loadbalancer.healthcheck.*` labels and must be identical on all
+    hosts, so they are taken from the first host defining one.
+
+    Args:
+        hosts_gateway_labels (list): Gateway labels of each host (as generated by process_labels)
+        hosts_local_labels (list): Local Traefik labels of each host (for health checks)
+        weights (list): Load-balancing weight of each host (None for Traefik's default)
+        service_name (str): Name of the service pointing to local Traefik (dropped if no longer used),
+            also prefixing the names of the merged services
+
+    Returns:
+        list: Gateway labels of each host, in the same order
+    """
+    if weights is None:
+        weights = [None] * len(hosts_gateway_labels)
+
+    hosts_parsed = [parse_traefik_labels(labels) for labels in hosts_gateway_labels]
+    hosts_labels = [dict(label.split('=', 1) for label in labels if '=' in label) for labels in hosts_gateway_labels]
+
+    # Rule => (host index, router name) of each host routing it
+    replicas_by_rule = {}
+    for host_idx, parsed in enumerate(hosts_parsed):
+        for router_name, router in sorted(parsed['routers'].items()):
+            if 'rule' not in router:
+                continue
+            replicas = replicas_by_rule.setdefault(router['rule'], [])
+            if host_idx not in [replica_host_idx for replica_host_idx, _ in replicas]:
+                replicas.append((host_idx, router_name))
+
+    # Host index => services which merged routers used to point to
+    released_service_names = {}
+
+    for rule, replicas in replicas_by_rule.items():
+        if len(replicas) < 2:
+            continue
+
+        shared_name = min(router_name for _, router_name in replicas)
+        shared_service_name = f"{service_name}-{shared_name}"
+        health_check = find_health_check(rule, hosts_local_labels)
+        if 'hostname' not in health_check and health_check:
+            # Health checks are sent to the servers, which may only route requests for the right host
+            host_match = re.search(r'Host\(`([^`]+)`\)', rule)
+            if host_match:
+                health_check['hostname'] = host_match.group(1)
+
+        for host_idx, router_name in replicas:
+            parsed = hosts_parsed[host_idx]
+            labels = hosts_labels[host_idx]
+            router = parsed['routers'][router_name]
+            old_service_name = get_router_service_name(router, parsed['services'])
+            server = parsed['services'].get(old_service_name, {})
+            if 'loadbalancer.server.port' not in server:
+                # Without a known server, this host can't take part in load balancing
+                continue
+
+            for property_name in router:
+                del labels[f"traefik.http.routers.{router_name}.{property_name}"]
+            for property_name, value in router.items():
+                labels[f"traefik.http.routers.{shared_name}.{property_name}"] = value
+            labels[f"traefik.http.routers.{shared_name}.service"] = shared_service_name
+            released_service_names.setdefault(host_idx, set()).add(old_service_name)
+
+            shared_service_prefix = f"traefik.http.services.{shared_service_name}.loadbalancer"
+            for key in [key for key in labels if key.startswith(shared_service_prefix + '.')]:
+                del labels[key]
+            labels[f"{shared_service_prefix}.server.port"] = server['loadbalancer.server.port']
+            for label in generate_transport_labels(shared_service_name, get_transport_options(server)):
+                key, value = label.split('=', 1)
+                labels[key] = value
+            if weights[host_idx] is not None:
+                labels[f"{shared_service_prefix}.server.weight"] = str(weights[host_idx])
+            for property_name, value in sorted(health_check.items()):
+                labels[f"{shared_service_prefix}.healthcheck.{property_name}"] = value
+
+    # Drop the services which no router uses anymore (e.g. the local Traefik, once all its routers are merged)
+    for host_idx, service_names in released_service_names.items():
+        labels = hosts_labels[host_idx]
+        routers = parse_traefik_labels([f"{key}={value}" for key, value in labels.items()])['routers']
+        if any('service' not in router for router in routers.values()):
+            # Routers using a service implicitly may need any of them
+            continue
+        used_service_names = set(router['service'] for router in routers.values())
+        for released_service_name in service_names - used_service_names:
+            prefix = f"traefik.http.services.{released_service_name}."
+            for key in [key for key in labels if key.startswith(prefix)]:
+                del labels[key]
+
+    return [[f"{key}={value}" for key, value in labels.items()] for labels in hosts_labels]
+
+
+def merge_replicated_results(results, hosts_local_labels, weights=None, service_name="homelab-traefik"):
+    """
+    Merge routers replicated on several hosts (see merge_replicated_routers) into their process_labels() results.
+
+    This is done by every writer of Proxmox notes which sees several hosts at once (the module's `replicas` option,
+    the `batch` entry point and bin/discover_traefik_labels.py), so that they all write the same notes.
+
+    Args:
+        results (list): process_labels() results of each host with labels, updated in place
+        hosts_local_labels (list): Local Traefik labels of each host (for health checks)
+        weights (list): Load-balancing weight of each host (None for Traefik's default)
+        service_name (str): Name of the service pointing to local Traefik
+    """
+    if len(results) < 2:
+        return
+
+    hosts_gateway_labels = merge_replicated_routers(
+        [result['proxmox_notes'].split('\n') for result in results],
+        hosts_local_labels,
+        weights=weights,
+        service_name=service_name
+    )
+    for result, gateway_labels in zip(results, hosts_gateway_labels):
+        result['proxmox_notes'] = format_labels_for_proxmox(gateway_labels)
+        result['parsed_labels'] = parse_traefik_labels(gateway_labels)
+        result['labels_count'] = len(gateway_labels)
+
+
 def parse_traefik_labels(labels):
     """
     Parse Traefik labels and organize them by type.
@@ -326,16 +997,369 @@ def format_labels_for_proxmox(labels):
     return '\n'.join(final_labels)
 
 
+def decode_discovery_output(output):
+    """
+    Decode the output of inspect-docker.sh.
+
+    The output is compact JSON, where each distinct label is listed once in a top-level "labels" list
+    and containers refer to their labels by position, optionally gzipped and base64-encoded (--gzip).
+    Plain JSON with the labels of each container (and error outputs) is accepted too.
+
+    Args:
+        output (str): Output of inspect-docker.sh
+
+    Returns:
+        dict: containers (each with its list of label strings) and error, if Docker could not be inspected
+
+    Raises:
+        ValueError: If the output can't be decoded
+    """
+    output = output.strip()
+    if not output.startswith('{'):
+        try:
+            output = gzip.decompress(base64.b64decode(output, validate=True)).decode('utf-8')
+        except (binascii.Error, OSError, EOFError, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid discovery output: {str(e)}")
+
+    inspection = json.loads(output)
+    if not isinstance(inspection, dict):
+        raise ValueError('Invalid discovery output: not a JSON object')
+
+    label_table = inspection.pop('labels', None)
+    if label_table is not None:
+        try:
+            inspection['containers'] = [
+                dict(container, labels=[label_table[idx] for idx in container.get('labels', [])])
+                for container in inspection.get('containers', [])
+            ]
+        except (IndexError, TypeError) as e:
+            raise ValueError(f"Invalid discovery output: bad label reference ({str(e)})")
+    inspection.setdefault('containers', [])
+    return inspection
+
+
+def collect_container_labels(containers):
+    """
+    Collect the labels of all containers of a host.
+
+    Args:
+        containers (list): Containers as output by inspect-docker.sh (with their list of labels)
+
+    Returns:
+        list: Labels of all containers
+    """
+    labels = []
+    for container in containers:
+        labels.extend(container.get('labels', []))
+    return labels
+
+
+def process_labels(labels, gateway_mode='filter', filter_for_gateway=True,
+                   traefik_local_port=8080, gateway_service_name='homelab-traefik', containers=None,
+                   transport_options=None):
+    """
+    Turn the raw labels of a host's containers into the Gateway labels and Proxmox notes.
+
+    This is what the module does for a single host. It is also used directly by
+    bin/discover_traefik_labels.py, which processes all hosts centrally on the controller,
+    and by the `batch` command-line entry point (see run_batch).
+
+    Args:
+        labels (list): List of label strings from all containers of a host
+        gateway_mode (str): 'filter', 'passthrough' or 'direct'
+        filter_for_gateway (bool): Whether to filter labels in filter mode
+        traefik_local_port (int): Port of local Traefik (pass-through and direct modes)
+        gateway_service_name (str): Name of the service pointing to local Traefik (pass-through and direct modes)
+        containers (list): The host's containers with their labels and published ports (direct mode).
+            Without them, all routes fall back to the local Traefik.
+        transport_options (dict): Transport options of the service pointing to local Traefik
+            (pass-through and direct modes), see TRANSPORT_PROPERTY_PATTERNS
+
+    Returns:
+        dict: proxmox_notes, parsed_labels, labels_count, labels_count_before_filter, gateway_mode, changed, msg
+        and warnings (about labels which were left out)
+
+    Raises:
+        ValueError: If transport_options are invalid
+    """
+    transport_options = validate_transport_options(transport_options)
+
+    result = dict(
+        changed=True,
+        proxmox_notes='',
+        parsed_labels={},
+        labels_count=0,
+        labels_count_before_filter=0,
+        gateway_mode=gateway_mode,
+        warnings=[]
+    )
+
+    # Filter only traefik labels
+    traefik_labels = [label for label in labels if label.startswith('traefik.')]
+    result['labels_count_before_filter'] = len(traefik_labels)
+
+    for label in find_invalid_transport_labels(traefik_labels):
+        result['warnings'].append(f"Ignoring transport label with an invalid value: {label}")
+
+    # Choose processing mode
+    if gateway_mode == 'passthrough':
+        # Pass-through mode: Generate Gateway labels from local rules
+        traefik_labels = generate_gateway_labels_passthrough(
+            traefik_labels,
+            traefik_local_port=traefik_local_port,
+            service_name=gateway_service_name,
+            transport_options=transport_options
+        )
+        result['msg'] = f"Generated {len(traefik_labels)} Gateway labels in pass-through mode from {result['labels_count_before_filter']} local labels"
+
+    elif gateway_mode == 'direct':
+        # Direct mode: Send Gateway routes straight to the containers where possible
+        if containers is None:
+            containers = [{'labels': traefik_labels}]
+        traefik_labels = generate_gateway_labels_direct(
+            containers,
+            traefik_local_port=traefik_local_port,
+            service_name=gateway_service_name,
+            transport_options=transport_options
+        )
+        result['msg'] = f"Generated {len(traefik_labels)} Gateway labels in direct mode from {result['labels_count_before_filter']} local labels"
+
+    elif gateway_mode == 'filter':
+        # Filter mode: Keep only relevant labels (and performance middlewares) for Gateway
+        if filter_for_gateway:
+            traefik_labels = generate_gateway_labels_filter(traefik_labels)
+        result['msg'] = f"Filtered {result['labels_count_before_filter']} labels to {len(traefik_labels)} for gateway" if filter_for_gateway else f"Processed {len(traefik_labels)} labels"
+
+    if not traefik_labels:
+        result['proxmox_notes'] = ''
+        result['parsed_labels'] = {
+            'general': {},
+            'routers': {},
+            'services': {},
+            'middlewares': {}
+        }
+        result['labels_count'] = 0
+        result['changed'] = False
+        result['msg'] = f"No labels generated in {gateway_mode} mode"
+        return result
+
+    # Parse labels
+    result['parsed_labels'] = parse_traefik_labels(traefik_labels)
+
+    # Format for Proxmox
+    result['proxmox_notes'] = format_labels_for_proxmox(traefik_labels)
+    result['labels_count'] = len(traefik_labels)
+
+    return result
+
+
+def merge_host_notes(replicas, service_name='homelab-traefik'):
+    """
+    Merge routers replicated on several hosts, from the results of the module on each host (its replicas option).
+
+    Args:
+        replicas (list): Dicts with the host name, its proxmox_notes and local_labels, and its weight
+            (optional, an empty string standing for none as well)
+        service_name (str): Name of the service pointing to local Traefik
+
+    Returns:
+        dict: Host name => merged Proxmox notes, for the hosts with notes
+    """
+    replicas = [replica for replica in replicas if replica.get('proxmox_notes')]
+    results = [{'proxmox_notes': replica['proxmox_notes']} for replica in replicas]
+    merge_replicated_results(
+        results,
+        [replica.get('local_labels') or [] for replica in replicas],
+        weights=[replica.get('weight') if replica.get('weight') != '' else None for replica in replicas],
+        service_name=service_name
+    )
+    return {replica['host']: result['proxmox_notes'] for replica, result in zip(replicas, results)}
+
+
+def process_host_record(line, merging=False, **options):
+    """
+    Process one line of a batch: a JSON record of a host's discovered containers.
+
+    Args:
+        line (str): JSON object with host, vmid and containers (as output by inspect-docker.sh),
+            or the raw output of inspect-docker.sh as discovery_output, and optionally the host's weight
+        merging (bool): Whether to also return the host's local labels and weight, to merge replicated routers
+        **options: process_labels() options (gateway_mode, traefik_local_port, ...)
+
+    Returns:
+        dict: host, vmid and the process_labels() result, or host, vmid and error if the record can't be processed
+    """
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return {'host': None, 'vmid': None, 'error': f"Invalid JSON record: {str(e)}"}
+
+    if not isinstance(record, dict):
+        return {'host': None, 'vmid': None, 'error': 'Invalid record: not a JSON object'}
+
+    output = {'host': record.get('host'), 'vmid': record.get('vmid')}
+    try:
+        if record.get('discovery_output') is not None:
+            containers = decode_discovery_output(record['discovery_output'])['containers']
+        else:
+            containers = record.get('containers') or []
+        labels = collect_container_labels(containers)
+        output.update(process_labels(labels, containers=containers, **options))
+        if merging:
+            output['local_labels'] = labels
+            output['weight'] = record.get('weight')
+    except Exception as e:
+        output['error'] = f"Error parsing labels: {str(e)}"
+    return output
+
+
+def process_batch(input_file, output_file, workers=None, batch_size=256, merge_replicas=True, **options):
+    """
+    Process a JSONL stream of host records (see process_host_record) into a JSONL stream of results.
+
+    Records are processed in parallel by `workers` processes (one per core by default, none if 1),
+    batch_size records at a time. Results are in the order of the records.
+    With merge_replicas, routers replicated on several hosts are merged into load-balanced services
+    (like bin/discover_traefik_labels.py does), so results are only written once all records are processed.
+    Without it, input of any size is streamed.
+
+    Args:
+        input_file: File of JSON records, one per line (empty lines are skipped)
+        output_file: File to write results to, one JSON object per line
+        workers (int): Number of worker processes
+        batch_size (int): Number of records read before they are dispatched to workers
+        merge_replicas (bool): Whether to merge routers replicated on several hosts
+        **options: process_labels() options
+
+    Returns:
+        tuple: (number of records, number of records which couldn't be processed)
+
+    Raises:
+        ValueError: If options are invalid
+    """
+    if options.get('transport_options'):
+        options['transport_options'] = validate_transport_options(options['transport_options'])
+    process_line = functools.partial(process_host_record, merging=merge_replicas, **options)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    executor = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else None
+
+    record_count = 0
+    error_count = 0
+    merged_outputs = []
+    try:
+        for batch in read_batches(input_file, batch_size):
+            if executor is not None:
+                outputs = executor.map(process_line, batch, chunksize=max(1, len(batch) // (workers * 4)))
+            else:
+                outputs = map(process_line, batch)
+            for output in outputs:
+                record_count += 1
+                if 'error' in output:
+                    error_count += 1
+                if merge_replicas:
+                    merged_outputs.append(output)
+                else:
+                    output_file.write(json.dumps(output) + '\n')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if merge_replicas:
+        updates = [output for output in merged_outputs if output.get('labels_count', 0) > 0]
+        merge_replicated_results(
+            updates,
+            [output['local_labels'] for output in updates],
+            weights=[output['weight'] for output in updates],
+            service_name=options.get('gateway_service_name', 'homelab-traefik')
+        )
+        for output in merged_outputs:
+            output.pop('local_labels', None)
+            output.pop('weight', None)
+            output_file.write(json.dumps(output) + '\n')
+    return record_count, error_count
+
+
+def read_batches(input_file, batch_size):
+    """Yield lists of at most batch_size non-empty lines of a file."""
+    batch = []
+    for line in input_file:
+        if not line.strip():
+            continue
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_batch(args=None):
+    """Command-line entry point for processing JSONL host dumps outside of Ansible."""
+    parser = argparse.ArgumentParser(
+        prog='parse_docker_labels.py batch',
+        description='Processes a JSONL file of {host, vmid, containers} records into a JSONL file of notes'
+    )
+    parser.add_argument('input', help='JSONL file of host records (- for stdin)')
+    parser.add_argument('-o', '--output', default='-', help='JSONL file of results (default: stdout)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: one per core)')
+    parser.add_argument('--gateway-mode', default='filter', choices=['filter', 'passthrough', 'direct'])
+    parser.add_argument('--traefik-local-port', type=int, default=8080)
+    parser.add_argument('--gateway-service-name', default='homelab-traefik')
+    parser.add_argument('--transport-option', action='append', default=[], metavar='PROPERTY=VALUE',
+                        help='Transport option of the service pointing to the local Traefik. Can be given multiple times.')
+    parser.add_argument('--no-merge-replicas', action='store_true',
+                        help="Don't merge routers replicated on several hosts, and stream results as records are processed")
+    args = parser.parse_args(args)
+
+    transport_options = {}
+    for transport_option in args.transport_option:
+        if '=' not in transport_option:
+            parser.error(f"invalid --transport-option: {transport_option}")
+        property_name, value = transport_option.split('=', 1)
+        transport_options[property_name] = value
+
+    input_file = sys.stdin if args.input == '-' else open(args.input)
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        record_count, error_count = process_batch(
+            input_file,
+            output_file,
+            workers=args.workers,
+            merge_replicas=not args.no_merge_replicas,
+            gateway_mode=args.gateway_mode,
+            traefik_local_port=args.traefik_local_port,
+            gateway_service_name=args.gateway_service_name,
+            transport_options=transport_options
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    print(f"Processed {record_count} host records, {error_count} failed", file=sys.stderr)
+    return 1 if error_count > 0 else 0
+
+
 def run_module():
     """Main module execution."""
 
     module_args = dict(
-        labels=dict(type='list', required=True, elements='str'),
+        labels=dict(type='list', required=False, elements='str'),
         vmid=dict(type='int', required=True),
         filter_for_gateway=dict(type='bool', required=False, default=True),
-        gateway_mode=dict(type='str', required=False, default='filter', choices=['filter', 'passthrough']),
+        gateway_mode=dict(type='str', required=False, default='filter', choices=['filter', 'passthrough', 'direct']),
         traefik_local_port=dict(type='int', required=False, default=8080),
-        gateway_service_name=dict(type='str', required=False, default='homelab-traefik')
+        gateway_service_name=dict(type='str', required=False, default='homelab-traefik'),
+        containers=dict(type='list', required=False, elements='dict'),
+        transport_options=dict(type='dict', required=False, default={}),
+        discovery_output=dict(type='str', required=False),
+        discovery_script=dict(type='path', required=False),
+        replicas=dict(type='list', required=False, elements='dict')
     )
 
     result = dict(
@@ -349,63 +1373,47 @@ def run_module():
 
     module = AnsibleModule(
         argument_spec=module_args,
+        required_one_of=[['labels', 'discovery_output', 'discovery_script', 'replicas']],
+        mutually_exclusive=[['discovery_output', 'discovery_script']],
         supports_check_mode=True
     )
 
     try:
-        labels = module.params['labels']
-        vmid = module.params['vmid']
-        filter_for_gateway = module.params['filter_for_gateway']
-        gateway_mode = module.params['gateway_mode']
-        traefik_local_port = module.params['traefik_local_port']
-        gateway_service_name = module.params['gateway_service_name']
-
-        # Filter only traefik labels
-        traefik_labels = [label for label in labels if label.startswith('traefik.')]
-        result['labels_count_before_filter'] = len(traefik_labels)
-        result['gateway_mode'] = gateway_mode
-
-        # Choose processing mode
-        if gateway_mode == 'passthrough':
-            # Pass-through mode: Generate Gateway labels from local rules
-            traefik_labels = generate_gateway_labels_passthrough(
-                traefik_labels,
-                traefik_local_port=traefik_local_port,
-                service_name=gateway_service_name
+        if module.params['replicas'] is not None:
+            notes_by_host = merge_host_notes(module.params['replicas'], service_name=module.params['gateway_service_name'])
+            module.exit_json(
+                changed=False,
+                notes_by_host=notes_by_host,
+                msg=f"Merged replicated routers of {len(notes_by_host)} hosts"
             )
-            result['msg'] = f"Generated {len(traefik_labels)} Gateway labels in pass-through mode from {result['labels_count_before_filter']} local labels"
-
-        elif gateway_mode == 'filter':
-            # Filter mode: Keep only relevant labels for Gateway
-            if filter_for_gateway:
-                traefik_labels = filter_labels_for_gateway(traefik_labels)
-            result['msg'] = f"Filtered {result['labels_count_before_filter']} labels to {len(traefik_labels)} for gateway" if filter_for_gateway else f"Processed {len(traefik_labels)} labels"
-
-        if not traefik_labels:
-            result['proxmox_notes'] = ''
-            result['parsed_labels'] = {
-                'general': {},
-                'routers': {},
-                'services': {},
-                'middlewares': {}
-            }
-            result['labels_count'] = 0
-            result['changed'] = False
-            result['msg'] = f"No labels generated in {gateway_mode} mode"
-            module.exit_json(**result)
-
-        # Parse labels
-        parsed_labels = parse_traefik_labels(traefik_labels)
-
-        # Format for Proxmox
-        proxmox_notes = format_labels_for_proxmox(traefik_labels)
-
-        # Update result
-        result['proxmox_notes'] = proxmox_notes
-        result['parsed_labels'] = parsed_labels
-        result['labels_count'] = len(traefik_labels)
-        result['changed'] = True
 
+        labels = module.params['labels']
+        containers = module.params['containers']
+        discovery_output = module.params['discovery_output']
+        if module.params['discovery_script'] is not None:
+            # Run here rather than by a command task, so that the output isn't registered (and kept) as a fact
+            rc, discovery_output, stderr = module.run_command(['bash', module.params['discovery_script']])
+            if rc != 0:
+                module.fail_json(msg=f"Docker inspection script failed: {stderr.strip()}", **result)
+        if discovery_output is not None:
+            # Decoded here rather than with from_json in the playbook, so that the data isn't stored as a fact
+            inspection = decode_discovery_output(discovery_output)
+            containers = inspection['containers']
+            labels = collect_container_labels(containers)
+
+        result = process_labels(
+            labels,
+            gateway_mode=module.params['gateway_mode'],
+            filter_for_gateway=module.params['filter_for_gateway'],
+            traefik_local_port=module.params['traefik_local_port'],
+            gateway_service_name=module.params['gateway_service_name'],
+            containers=containers,
+            transport_options=module.params['transport_options']
+        )
+        result['containers_count'] = len(containers or [])
+        result['local_labels'] = [label for label in labels if label.startswith('traefik.')]
+        if discovery_output is not None and inspection.get('error'):
+            result['warnings'].append(f"Docker inspection failed: {inspection['error']}")
         module.exit_json(**result)
 
     except Exception as e:
@@ -413,6 +1421,9 @@ def run_module():
 
 
 def main():
+    # `parse_docker_labels.py batch ...` runs outside of Ansible (which never passes such an argument)
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(run_batch(sys.argv[2:]))
     run_module()
 
 
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the atomic writing of generated files (bin/atomic_writes.py).
+"""
+
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+import atomic_writes
+from atomic_writes import PendingWrites
+
+
+class TestPendingWrites(unittest.TestCase):
+    """Test suite for collecting writes and committing them at once."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory_path = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_path(self, file_name):
+        return os.path.join(self.directory_path, file_name)
+
+    def read(self, file_name):
+        with open(self.get_path(file_name)) as file:
+            return file.read()
+
+    def write(self, file_name, contents):
+        with open(self.get_path(file_name), 'w') as file:
+            file.write(contents)
+
+    def test_nothing_is_visible_before_commit(self):
+        """Test that destinations only change once the block ends, and no temporary files are left behind."""
+        self.write('setup.yml', "old\n")
+
+        with PendingWrites() as pending_writes:
+            pending_writes.write(self.get_path('setup.yml'), "new\n")
+            pending_writes.write(self.get_path('run/setup.yml.srchash'), b"0123\n")
+            self.assertEqual(self.read('setup.yml'), "old\n")
+            self.assertFalse(os.path.exists(self.get_path('run/setup.yml.srchash')))
+
+        self.assertEqual(self.read('setup.yml'), "new\n")
+        self.assertEqual(self.read('run/setup.yml.srchash'), "0123\n")
+        self.assertEqual(sorted(os.listdir(self.directory_path)), ['run', 'setup.yml'])
+
+    def test_renames_follow_write_order(self):
+        """Test that files are moved into place in write order, a rewritten file moving to the end."""
+        with mock.patch.object(atomic_writes.os, 'replace', wraps=os.replace) as replace:
+            with PendingWrites() as pending_writes:
+                pending_writes.write(self.get_path('setup.yml'), "first\n")
+                pending_writes.write(self.get_path('setup.yml.srchash'), "hash\n")
+                pending_writes.write(self.get_path('group_vars'), "vars\n")
+                pending_writes.write(self.get_path('setup.yml'), "second\n")
+
+        self.assertEqual(
+            [call[0][1] for call in replace.call_args_list],
+            [self.get_path('setup.yml.srchash'), self.get_path('group_vars'), self.get_path('setup.yml')]
+        )
+        self.assertEqual(self.read('setup.yml'), "second\n")
+
+    def test_unchanged_files_are_not_rewritten(self):
+        """Test that writing a file's current contents leaves the file (and its modification time) alone."""
+        self.write('setup.yml', "same\n")
+        os.utime(self.get_path('setup.yml'), ns=(0, 1000000000))
+
+        with mock.patch.object(atomic_writes.os, 'replace', wraps=os.replace) as replace:
+            with PendingWrites() as pending_writes:
+                pending_writes.write(self.get_path('setup.yml'), "same\n")
+                self.assertEqual(pending_writes.temporary_paths, {})
+
+        replace.assert_not_called()
+        self.assertEqual(os.stat(self.get_path('setup.yml')).st_mtime_ns, 1000000000)
+
+    def test_rewriting_back_to_current_contents(self):
+        """Test that a pending change is dropped when the same file is then written with its current contents."""
+        self.write('setup.yml', "same\n")
+
+        with PendingWrites() as pending_writes:
+            pending_writes.write(self.get_path('setup.yml'), "changed\n")
+            pending_writes.write(self.get_path('setup.yml'), "same\n")
+
+        self.assertEqual(self.read('setup.yml'), "same\n")
+        self.assertEqual(os.listdir(self.directory_path), ['setup.yml'])
+
+    def test_failure_discards_everything(self):
+        """Test that an exception inside the block leaves all destinations untouched."""
+        self.write('setup.yml', "old\n")
+
+        with self.assertRaises(RuntimeError):
+            with PendingWrites() as pending_writes:
+                pending_writes.write(self.get_path('setup.yml'), "new\n")
+                pending_writes.write(self.get_path('new.yml'), "new\n")
+                raise RuntimeError()
+
+        self.assertEqual(self.read('setup.yml'), "old\n")
+        self.assertEqual(os.listdir(self.directory_path), ['setup.yml'])
+
+    def test_file_modes(self):
+        """Test that rewritten files keep their mode, and new files get the umask's default mode."""
+        self.write('secret.yml', "old\n")
+        os.chmod(self.get_path('secret.yml'), 0o600)
+
+        umask = os.umask(0o022)
+        try:
+            with PendingWrites() as pending_writes:
+                pending_writes.write(self.get_path('secret.yml'), "new\n")
+                pending_writes.write(self.get_path('new.yml'), "new\n")
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.get_path('secret.yml')).st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(self.get_path('new.yml')).st_mode), 0o644)
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
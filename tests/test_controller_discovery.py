@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the controller-side discovery (bin/discover_traefik_labels.py).
+Hosts are faked by an `ssh` replacement which answers with canned inspection output.
+"""
+
+import base64
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+from discover_traefik_labels import build_route_index, build_ssh_args, discover, get_discovery_hosts, get_proxmox_api_host
+
+# Stands in for `ssh`: looks up the destination (the argument before the remote command)
+# in the JSON file named by FAKE_HOSTS_PATH and behaves accordingly.
+FAKE_SSH_SCRIPT = '''
+import json, os, sys, time
+destination = sys.argv[-2]
+with open(os.environ["FAKE_HOSTS_PATH"]) as file:
+    fake_host = json.load(file).get(destination)
+script = sys.stdin.read()
+if fake_host is None:
+    sys.stderr.write("ssh: Could not resolve hostname " + destination)
+    sys.exit(255)
+if "inspect" not in script and "docker" not in script:
+    sys.exit(1)
+time.sleep(fake_host.get("sleep", 0))
+inspection = fake_host["inspection"]
+sys.stdout.write(inspection if isinstance(inspection, str) else json.dumps(inspection))
+'''
+
+MINIFLUX_LABELS = [
+    "traefik.enable=true",
+    "traefik.docker.network=traefik",
+    "traefik.http.routers.mash-miniflux.entrypoints=web",
+    "traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)",
+    "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+]
+
+
+def make_host(name, vmid):
+    return {
+        "name": name,
+        "address": name,
+        "user": None,
+        "port": None,
+        "proxmox_node": "pve",
+        "proxmox_vmid": vmid,
+        "weight": None
+    }
+
+
+class TestControllerDiscovery(unittest.TestCase):
+    """Test suite for discovering labels on fake hosts."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.fake_ssh_path = os.path.join(self.temp_dir.name, 'fake_ssh.py')
+        with open(self.fake_ssh_path, 'w') as file:
+            file.write(FAKE_SSH_SCRIPT)
+        self.fake_hosts_path = os.path.join(self.temp_dir.name, 'hosts.json')
+        os.environ['FAKE_HOSTS_PATH'] = self.fake_hosts_path
+
+    def tearDown(self):
+        del os.environ['FAKE_HOSTS_PATH']
+        self.temp_dir.cleanup()
+
+    def write_fake_hosts(self, fake_hosts):
+        with open(self.fake_hosts_path, 'w') as file:
+            json.dump(fake_hosts, file)
+
+    def discover(self, hosts, **kwargs):
+        return discover(hosts, ssh_command=[sys.executable, self.fake_ssh_path], ssh_options=[], **kwargs)
+
+    def test_discover_processes_labels_centrally(self):
+        """Test that labels from all containers of a host are merged and processed."""
+        self.write_fake_hosts({
+            "vm106": {"inspection": {"containers": [
+                {"id": "a", "name": "mash-miniflux", "labels": MINIFLUX_LABELS[:3]},
+                {"id": "b", "name": "mash-other", "labels": MINIFLUX_LABELS[3:]}
+            ]}}
+        })
+
+        updates, errors = self.discover([make_host("vm106", 106)], gateway_mode="passthrough")
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(updates), 1)
+        host, result = updates[0]
+        self.assertEqual(host["proxmox_vmid"], 106)
+        self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik", result["proxmox_notes"])
+        self.assertTrue(result["proxmox_notes"].startswith("traefik.enable=true"))
+
+    def test_discover_decodes_compressed_output(self):
+        """Test that the compact, compressed output of the script is decoded."""
+        compact_output = json.dumps({
+            "labels": MINIFLUX_LABELS,
+            "containers": [{"id": "a", "name": "mash-miniflux", "labels": list(range(len(MINIFLUX_LABELS)))}]
+        })
+        self.write_fake_hosts({
+            "vm106": {"inspection": base64.b64encode(gzip.compress(compact_output.encode("utf-8"))).decode("ascii")},
+            "vm107": {"inspection": "garbage"}
+        })
+
+        updates, errors = self.discover([make_host("vm106", 106), make_host("vm107", 107)], gateway_mode="passthrough")
+
+        self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik", updates[0][1]["proxmox_notes"])
+        self.assertEqual(errors[0][0]["name"], "vm107")
+        self.assertIn("invalid inspection output", errors[0][1])
+
+    def test_discover_reports_failures_per_host(self):
+        """Test that unreachable hosts and Docker errors are reported without affecting other hosts."""
+        self.write_fake_hosts({
+            "ok": {"inspection": {"containers": [{"id": "a", "name": "c", "labels": MINIFLUX_LABELS}]}},
+            "no-docker": {"inspection": {"error": "Docker not accessible", "containers": []}}
+        })
+
+        updates, errors = self.discover([
+            make_host("ok", 1),
+            make_host("no-docker", 2),
+            make_host("unreachable", 3)
+        ])
+
+        errors_by_host_name = {host["name"]: error for host, error in errors}
+        self.assertEqual([host["name"] for host, _ in updates], ["ok"])
+        self.assertEqual(errors_by_host_name["no-docker"], "Docker not accessible")
+        self.assertIn("Could not resolve hostname", errors_by_host_name["unreachable"])
+
+    def test_discover_skips_hosts_without_labels(self):
+        """Test that hosts without Traefik labels get no update."""
+        self.write_fake_hosts({"empty": {"inspection": {"containers": []}}})
+
+        updates, errors = self.discover([make_host("empty", 1)])
+
+        self.assertEqual(updates, [])
+        self.assertEqual(errors, [])
+
+    def test_discover_times_out_slow_hosts(self):
+        """Test that a hanging host is given up on after the timeout."""
+        self.write_fake_hosts({"slow": {"sleep": 10, "inspection": {"containers": []}}})
+
+        updates, errors = self.discover([make_host("slow", 1)], timeout=1)
+
+        self.assertEqual(updates, [])
+        self.assertIn("timed out", errors[0][1])
+
+    def test_discover_merges_replicated_routers(self):
+        """Test that a router running on several hosts becomes one load-balanced service."""
+        inspection = {"containers": [{"id": "a", "name": "c", "labels": MINIFLUX_LABELS}]}
+        self.write_fake_hosts({"vm106": {"inspection": inspection}, "vm107": {"inspection": inspection}})
+        hosts = [make_host("vm106", 106), make_host("vm107", 107)]
+        hosts[0]["weight"] = 2
+
+        updates, errors = self.discover(hosts, gateway_mode="passthrough")
+
+        self.assertEqual(errors, [])
+        notes = [result["proxmox_notes"].split("\n") for _, result in updates]
+        for host_notes in notes:
+            self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik-miniflux", host_notes)
+            self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.server.port=8080", host_notes)
+        self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.server.weight=2", notes[0])
+        self.assertFalse(any("weight" in label for label in notes[1]))
+
+        updates, errors = self.discover(hosts, gateway_mode="passthrough", merge_replicas=False)
+
+        for _, result in updates:
+            self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik", result["proxmox_notes"])
+
+    def test_discover_inspects_hosts_concurrently(self):
+        """Test that hosts are inspected in parallel rather than one after another."""
+        fake_hosts = {}
+        hosts = []
+        for idx in range(8):
+            fake_hosts["vm{0}".format(idx)] = {
+                "sleep": 1,
+                "inspection": {"containers": [{"id": "a", "name": "c", "labels": MINIFLUX_LABELS}]}
+            }
+            hosts.append(make_host("vm{0}".format(idx), idx))
+        self.write_fake_hosts(fake_hosts)
+
+        start_time = time.monotonic()
+        updates, errors = self.discover(hosts, forks=8)
+        elapsed = time.monotonic() - start_time
+
+        self.assertEqual(len(updates), 8)
+        # Results keep the order of the hosts
+        self.assertEqual([host["proxmox_vmid"] for host, _ in updates], list(range(8)))
+        self.assertLess(elapsed, 6)
+
+    def test_route_index_across_hosts(self):
+        """Test that the routers of all hosts are indexed, replicas once, and unparsable rules reported."""
+        other_labels = [
+            "traefik.enable=true",
+            "traefik.http.routers.mash-miniflux.rule=Host(`other.cy-bert.fr`)",
+            "traefik.http.routers.mash-broken.rule=Host(`homelab.cy-bert.fr`",
+            "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+        ]
+        inspection = {"containers": [{"id": "a", "name": "c", "labels": MINIFLUX_LABELS}]}
+        self.write_fake_hosts({
+            "vm106": {"inspection": inspection},
+            "vm107": {"inspection": inspection},
+            "vm108": {"inspection": {"containers": [{"id": "a", "name": "c", "labels": other_labels}]}}
+        })
+
+        updates, _ = self.discover([make_host("vm106", 106), make_host("vm107", 107), make_host("vm108", 108)], gateway_mode="passthrough")
+        index, backends, errors = build_route_index(updates)
+
+        self.assertEqual(sorted(index.routers.keys()), ["miniflux", "miniflux@vm108"])
+        self.assertEqual(backends["miniflux"], {"service": "homelab-traefik-miniflux", "hosts": ["vm106", "vm107"]})
+        self.assertEqual(index.match("homelab.cy-bert.fr", "/miniflux/").router, "miniflux")
+        self.assertEqual(index.match("other.cy-bert.fr", "/miniflux/").router, "miniflux@vm108")
+        self.assertEqual([(host["name"], error.split(":")[0]) for host, error in errors], [("vm108", "router broken")])
+
+
+class TestInventoryHosts(unittest.TestCase):
+    """Test suite for reading discovery hosts from `ansible-inventory --list` output."""
+
+    def test_hosts_from_group_and_children(self):
+        """Test that hosts of child groups are included once, with their connection variables."""
+        inventory = {
+            "_meta": {"hostvars": {
+                "vm106": {"ansible_host": "192.168.1.106", "ansible_user": "ansible", "proxmox_node": "pve", "proxmox_vmid": 106},
+                "vm107": {"ansible_host": "192.168.1.107", "proxmox_node": "pve", "proxmox_vmid": 107}
+            }},
+            "exposed": {"hosts": ["vm106"], "children": ["web"]},
+            "web": {"hosts": ["vm106", "vm107"]}
+        }
+
+        hosts, errors = get_discovery_hosts(inventory, "exposed")
+
+        self.assertEqual([host["name"] for host in hosts], ["vm106", "vm107"])
+        self.assertEqual(hosts[0]["address"], "192.168.1.106")
+        self.assertEqual(hosts[1]["proxmox_vmid"], 107)
+        self.assertEqual(errors, [])
+
+    def test_hosts_without_proxmox_vm_are_skipped(self):
+        """Test that hosts without proxmox_node or proxmox_vmid variables are reported instead of discovered."""
+        inventory = {
+            "_meta": {"hostvars": {
+                "vm106": {"proxmox_node": "pve", "proxmox_vmid": 106},
+                "vm107": {"proxmox_node": "pve"},
+                "docker1": {}
+            }},
+            "exposed": {"hosts": ["vm106", "vm107", "docker1"]}
+        }
+
+        hosts, errors = get_discovery_hosts(inventory, "exposed")
+
+        self.assertEqual([host["name"] for host in hosts], ["vm106"])
+        self.assertEqual([(host["name"], error) for host, error in errors], [
+            ("vm107", "skipped, missing inventory variable(s): proxmox_vmid"),
+            ("docker1", "skipped, missing inventory variable(s): proxmox_node, proxmox_vmid")
+        ])
+
+    def test_proxmox_api_host(self):
+        """Test that the Proxmox API host comes from the inventory, and must be the same for all hosts."""
+        inventory = {
+            "_meta": {"hostvars": {
+                "vm106": {"proxmox_api_host": "pve.example.com"},
+                "vm107": {"proxmox_api_host": "pve.example.com"},
+                "vm108": {"proxmox_api_host": "pve2.example.com"},
+                "vm109": {}
+            }}
+        }
+        hosts = [make_host(name, vmid) for name, vmid in [("vm106", 106), ("vm107", 107), ("vm108", 108), ("vm109", 109)]]
+
+        self.assertEqual(get_proxmox_api_host(inventory, hosts[:2]), "pve.example.com")
+        for invalid_hosts in [hosts[:3], hosts[2:]]:
+            with self.subTest(hosts=[host["name"] for host in invalid_hosts]):
+                with self.assertRaises(ValueError):
+                    get_proxmox_api_host(inventory, invalid_hosts)
+
+    def test_ssh_args(self):
+        """Test that the SSH command line targets the right user, host and port."""
+        host = make_host("vm106", 106)
+        host.update({"address": "192.168.1.106", "user": "ansible", "port": 2222})
+
+        args = build_ssh_args(["ssh"], ["-o", "BatchMode=yes"], host)
+
+        self.assertEqual(args, ["ssh", "-o", "BatchMode=yes", "-p", "2222", "ansible@192.168.1.106", "bash -s -- --gzip"])
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
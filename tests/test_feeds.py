@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the `check` action of bin/feeds.py.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), '../bin/feeds.py')
+
+RADICLE_URLS = [
+    "https://seed.radicle.garden/z2chD7Kt74JwEMafxTooxN7MaeYtK.git",
+    "https://seed.radicle.xyz/z3gqcJUoA1n9HaHKufZs5FCSGazv5.git",
+    "https://iris.radicle.xyz/z4V1sjrXqjvFdnCUbxPFqd5p4DtH5.git",
+]
+
+
+class TestCheckAction(unittest.TestCase):
+    """Test suite for reporting repositories without release feeds."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.write_defaults('miniflux', "https://github.com/miniflux/v2")
+        for idx, url in enumerate(RADICLE_URLS):
+            self.write_defaults('radicle{0}'.format(idx), url)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_defaults(self, role_name, source_url):
+        path = os.path.join(self.temp_dir.name, 'roles', 'galaxy', role_name, 'defaults', 'main.yml')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as file:
+            file.write("---\n# Project source code URL: {0}\n{1}_version: 1.0.0\n".format(source_url, role_name))
+
+    def check(self, *extra_args):
+        result = subprocess.run(
+            [sys.executable, SCRIPT_PATH, self.temp_dir.name, 'check',
+             '--cache-path', os.path.join(self.temp_dir.name, 'var', 'roles-scanner-cache.json')] + list(extra_args),
+            capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.splitlines()
+
+    def test_feedless_repositories_are_summarized(self):
+        """Test that repositories without feeds are only counted, per forge type, in a single line."""
+        self.assertEqual(self.check(), [
+            "No release feed available for 3 repositories (radicle: 3), pass --verbose to list them"
+        ])
+
+    def test_verbose_lists_feedless_repositories(self):
+        """Test that --verbose lists each repository without a feed."""
+        self.assertEqual(sorted(self.check('--verbose')), sorted(
+            "No release feed available for radicle repository: {0}".format(url) for url in RADICLE_URLS
+        ))
+
+    def test_cache_stays_in_given_path(self):
+        """Test that the scanner cache is written where --cache-path says, and can be disabled."""
+        self.check()
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir.name, 'var', 'roles-scanner-cache.json')))
+
+        result = subprocess.run(
+            [sys.executable, SCRIPT_PATH, self.temp_dir.name, 'check', '--cache-path', ''],
+            capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the label cache of roles/docker_traefik_discovery/files/inspect-docker.sh.
+Docker is faked by a `docker` command which serves containers from a JSON file and logs its invocations.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), '../roles/docker_traefik_discovery/files/inspect-docker.sh')
+
+# Add the module path to decode the script's output
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../roles/docker_traefik_discovery/library'))
+
+from parse_docker_labels import decode_discovery_output
+
+# Stands in for `docker`: answers `ps`, `images` and `inspect` (with the formats used by the script)
+# from FAKE_CONTAINERS_PATH, images being tagged as the first container using them says (unless without image_id)
+FAKE_DOCKER_SCRIPT = '''#!{python}
+import json, os, sys
+with open(os.environ["FAKE_CONTAINERS_PATH"]) as file:
+    containers = json.load(file)
+with open(os.environ["FAKE_DOCKER_LOG_PATH"], "a") as file:
+    file.write(json.dumps(sys.argv[1:]) + "\\n")
+if sys.argv[1] == "images":
+    image_ids = {{}}
+    for container in containers:
+        if container["image_id"] is not None:
+            image_ids.setdefault(container["image"], container["image_id"])
+    for reference, image_id in image_ids.items():
+        print(reference + "|" + image_id)
+        print(reference.split(":")[0] + "@<none>|" + image_id)
+    sys.exit(0)
+if sys.argv[1] == "ps":
+    if "--format" in sys.argv:
+        for container in containers:
+            print("|".join([container["id"], container["name"], container["created"], container["image"], container["ports"]]))
+    sys.exit(0)
+if sys.argv[1] == "inspect":
+    ids = sys.argv[4:]
+    found = False
+    for container in containers:
+        if container["id"] in ids:
+            found = True
+            sys.stdout.write(container["id"] + "\\t\\n")
+            for key in sorted(container["labels"]):
+                sys.stdout.write(container["id"] + "\\t" + key + "=" + container["labels"][key] + "\\n")
+    sys.exit(0 if found else 1)
+sys.exit(1)
+'''
+
+
+def make_container(idx, labels=None, created="2026-01-01 10:00:00 +0000 UTC"):
+    if labels is None:
+        labels = {
+            "traefik.enable": "true",
+            "traefik.http.routers.app{0}.rule".format(idx): "Host(`app{0}.example.com`)".format(idx)
+        }
+    return {
+        "id": "{0:064x}".format(idx),
+        "name": "app{0}".format(idx),
+        "created": created,
+        "image": "example/app:latest",
+        "image_id": "sha256:{0:064x}".format(1000),
+        "ports": "0.0.0.0:{0}->8080/tcp, :::{0}->8080/tcp".format(32768 + idx),
+        "labels": labels
+    }
+
+
+class InspectDockerTestCase(unittest.TestCase):
+    """Runs the script against a fake `docker` command."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        bin_path = os.path.join(self.temp_dir.name, 'bin')
+        os.mkdir(bin_path)
+        fake_docker_path = os.path.join(bin_path, 'docker')
+        with open(fake_docker_path, 'w') as file:
+            file.write(FAKE_DOCKER_SCRIPT.format(python=sys.executable))
+        os.chmod(fake_docker_path, 0o755)
+
+        self.containers_path = os.path.join(self.temp_dir.name, 'containers.json')
+        self.log_path = os.path.join(self.temp_dir.name, 'docker.log')
+        self.cache_path = os.path.join(self.temp_dir.name, 'cache', 'labels.cache')
+        self.env = dict(
+            os.environ,
+            PATH=bin_path + os.pathsep + os.environ['PATH'],
+            FAKE_CONTAINERS_PATH=self.containers_path,
+            FAKE_DOCKER_LOG_PATH=self.log_path,
+            TRAEFIK_DISCOVERY_CACHE_FILE=self.cache_path
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_script(self, containers, args=()):
+        with open(self.containers_path, 'w') as file:
+            json.dump(containers, file)
+        if os.path.exists(self.log_path):
+            os.unlink(self.log_path)
+
+        result = subprocess.run(['bash', SCRIPT_PATH] + list(args), env=self.env, capture_output=True, text=True, check=True)
+        self.raw_output = result.stdout
+        return decode_discovery_output(result.stdout)
+
+    def get_inspected_ids(self):
+        inspected_ids = []
+        with open(self.log_path) as file:
+            for line in file:
+                args = json.loads(line)
+                if args[0] == 'inspect':
+                    inspected_ids.extend(args[3:])
+        return inspected_ids
+
+
+class TestInspectDockerCache(InspectDockerTestCase):
+    """Test suite for skipping the inspection of unchanged containers."""
+
+    def test_only_new_containers_are_inspected(self):
+        """Test that cached containers are not re-inspected, and that results are the same."""
+        containers = [make_container(1), make_container(2), make_container(3, labels={"other": "label"})]
+
+        first_output = self.run_script(containers)
+        self.assertEqual(len(self.get_inspected_ids()), 3)
+
+        containers.append(make_container(4))
+        second_output = self.run_script(containers)
+
+        self.assertEqual(self.get_inspected_ids(), [containers[3]["id"]])
+        self.assertEqual(second_output["containers"][:2], first_output["containers"])
+        self.assertEqual(len(second_output["containers"]), 3)
+        self.assertEqual(second_output["containers"][0], {
+            "id": containers[0]["id"][:12],
+            "name": "app1",
+            "published_ports": "0.0.0.0:32769->8080/tcp, :::32769->8080/tcp",
+            "labels": ["traefik.enable=true", "traefik.http.routers.app1.rule=Host(`app1.example.com`)"]
+        })
+
+    def test_recreated_containers_are_inspected(self):
+        """Test that a container with a new creation date is inspected again."""
+        containers = [make_container(1)]
+        self.run_script(containers)
+
+        containers = [make_container(1, labels={"traefik.enable": "false"}, created="2026-02-01 10:00:00 +0000 UTC")]
+        output = self.run_script(containers)
+
+        self.assertEqual(self.get_inspected_ids(), [containers[0]["id"]])
+        self.assertEqual(output["containers"][0]["labels"], ["traefik.enable=false"])
+
+    def test_gone_containers_are_evicted(self):
+        """Test that the cache only keeps entries for running containers."""
+        self.run_script([make_container(1), make_container(2)])
+        self.run_script([make_container(2)])
+
+        with open(self.cache_path) as file:
+            cache_keys = set(line.split('\t')[0] for line in file)
+        self.assertEqual(cache_keys, {make_container(2)["id"] + "|2026-01-01 10:00:00 +0000 UTC|" + make_container(2)["image_id"]})
+
+    def test_cache_is_keyed_on_image_id(self):
+        """Test that a container whose image reference now designates another image is inspected again."""
+        containers = [make_container(1), make_container(2)]
+        self.run_script(containers)
+
+        containers[1]["image_id"] = "sha256:{0:064x}".format(2000)
+        containers[1]["image"] = "example/other"
+        containers.append(dict(make_container(3), image="example/other:latest", image_id=containers[1]["image_id"]))
+        self.run_script(containers)
+
+        # An untagged reference designates the latest tag
+        self.assertEqual(self.get_inspected_ids(), [containers[1]["id"], containers[2]["id"]])
+        self.run_script(containers)
+        self.assertEqual(self.get_inspected_ids(), [])
+
+    def test_unknown_image_references_are_kept(self):
+        """Test that a reference which isn't listed among the images (e.g. an image ID) is used as it is."""
+        containers = [dict(make_container(1), image="0123456789ab", image_id=None)]
+        self.run_script(containers)
+
+        with open(self.cache_path) as file:
+            cache_keys = set(line.split('\t')[0] for line in file)
+        self.assertEqual(cache_keys, {containers[0]["id"] + "|2026-01-01 10:00:00 +0000 UTC|0123456789ab"})
+
+    def test_no_inspection_when_nothing_changed(self):
+        """Test that an unchanged host is discovered without any inspection."""
+        containers = [make_container(idx) for idx in range(20)]
+        self.run_script(containers)
+        output = self.run_script(containers)
+
+        self.assertEqual(self.get_inspected_ids(), [])
+        self.assertEqual(len(output["containers"]), 20)
+
+    def test_unwritable_cache_is_skipped(self):
+        """Test that containers are still discovered when the cache can't be read nor written."""
+        cache_parent_path = os.path.dirname(self.cache_path)
+        with open(cache_parent_path, 'w') as file:
+            file.write('not a directory')
+
+        for _ in range(2):
+            output = self.run_script([make_container(1), make_container(2)])
+
+            self.assertEqual(len(self.get_inspected_ids()), 2)
+            self.assertEqual([container["name"] for container in output["containers"]], ["app1", "app2"])
+
+    def test_unwritable_cache_file_is_skipped(self):
+        """Test that a cache file which can't be replaced doesn't prevent the discovery, nor leaves temporary files."""
+        os.makedirs(self.cache_path)
+
+        output = self.run_script([make_container(1)])
+
+        self.assertEqual(output["containers"][0]["name"], "app1")
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)), ['labels.cache'])
+        self.assertEqual(os.listdir(self.cache_path), [])
+
+
+class TestInspectDockerOutput(InspectDockerTestCase):
+    """Test suite for the compact (and compressed) output of the script."""
+
+    def test_labels_are_deduplicated(self):
+        """Test that labels shared by containers are only output once, and referred to by position."""
+        self.run_script([make_container(1), make_container(2)])
+
+        output = json.loads(self.raw_output)
+        self.assertNotIn("\n", self.raw_output.strip())
+        self.assertEqual(output["labels"].count("traefik.enable=true"), 1)
+        self.assertEqual(output["containers"][1]["labels"], [0, 2])
+
+    def test_compressed_output(self):
+        """Test that --gzip output decodes to the same containers, in fewer bytes."""
+        containers = [make_container(idx) for idx in range(50)]
+        plain_output = self.run_script(containers)
+        plain_size = len(self.raw_output)
+
+        compressed_output = self.run_script(containers, ['--gzip'])
+
+        self.assertTrue(self.raw_output.startswith("H4sI"))
+        self.assertLess(len(self.raw_output), plain_size / 2)
+        self.assertEqual(compressed_output, plain_output)
+
+    def test_special_characters_are_escaped(self):
+        """Test that quotes and backslashes in labels survive the round trip."""
+        labels = {"traefik.http.routers.app.rule": "Host(`a.com`) && PathRegexp(`^/\\d+\"x`)"}
+        output = self.run_script([make_container(1, labels=labels)])
+
+        self.assertEqual(output["containers"][0]["labels"], ["traefik.http.routers.app.rule=Host(`a.com`) && PathRegexp(`^/\\d+\"x`)"])
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
@@ -6,6 +6,11 @@ Unit tests for parse_docker_labels module.
 Tests the parsing and formatting of Traefik labels.
 """
 
+import base64
+import gzip
+import io
+import json
+import subprocess
 import sys
 import os
 import unittest
@@ -13,7 +18,7 @@ import unittest
 # Add the module path to import the functions
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../roles/docker_traefik_discovery/library'))
 
-from parse_docker_labels import parse_traefik_labels, format_labels_for_proxmox, filter_labels_for_gateway, generate_gateway_labels_passthrough
+from parse_docker_labels import parse_traefik_labels, format_labels_for_proxmox, filter_labels_for_gateway, generate_gateway_labels_passthrough, generate_gateway_labels_direct, parse_published_ports, merge_replicated_routers, merge_host_notes, process_labels, validate_transport_options, translate_middlewares, process_batch, decode_discovery_output
 
 
 class TestTraefikLabelParsing(unittest.TestCase):
@@ -563,6 +568,584 @@ class TestGatewayPassthrough(unittest.TestCase):
         self.assertEqual(len(router_labels), 0)
 
 
+class TestGatewayDirect(unittest.TestCase):
+    """Test suite for Gateway direct mode."""
+
+    def test_direct_published_port(self):
+        """Test that a router whose service port is published goes straight to the container."""
+        containers = [{
+            "published_ports": "0.0.0.0:32768->8080/tcp, :::32768->8080/tcp",
+            "labels": [
+                "traefik.enable=true",
+                "traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)",
+                "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+            ]
+        }]
+
+        gateway_labels = generate_gateway_labels_direct(containers)
+
+        # Same rule, own service
+        self.assertIn("traefik.http.routers.miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)", gateway_labels)
+        self.assertIn("traefik.http.routers.miniflux.service=miniflux", gateway_labels)
+        self.assertIn("traefik.http.services.miniflux.loadbalancer.server.port=32768", gateway_labels)
+        self.assertIn("traefik.http.services.miniflux.loadbalancer.server.scheme=http", gateway_labels)
+
+        # No local Traefik service is needed
+        self.assertFalse(any("homelab-traefik" in label for label in gateway_labels))
+
+    def test_direct_falls_back_to_passthrough(self):
+        """Test that unpublished, loopback-only and middleware-using routers go through the local Traefik."""
+        containers = [
+            {
+                "published_ports": "",
+                "labels": [
+                    "traefik.http.routers.mash-homarr.rule=Host(`homarr.example.com`)",
+                    "traefik.http.services.mash-homarr.loadbalancer.server.port=7575"
+                ]
+            },
+            {
+                "published_ports": "127.0.0.1:8081->8080/tcp",
+                "labels": [
+                    "traefik.http.routers.mash-linkding.rule=Host(`linkding.example.com`)",
+                    "traefik.http.services.mash-linkding.loadbalancer.server.port=8080"
+                ]
+            },
+            {
+                "published_ports": "0.0.0.0:8082->8080/tcp",
+                "labels": [
+                    "traefik.http.routers.mash-gitea.rule=Host(`gitea.example.com`)",
+                    "traefik.http.routers.mash-gitea.middlewares=mash-gitea-auth",
+                    "traefik.http.services.mash-gitea.loadbalancer.server.port=8080"
+                ]
+            }
+        ]
+
+        gateway_labels = generate_gateway_labels_direct(containers, traefik_local_port=9090)
+
+        for router_name in ["homarr", "linkding", "gitea"]:
+            self.assertIn("traefik.http.routers.{0}.service=homelab-traefik".format(router_name), gateway_labels)
+        self.assertIn("traefik.http.services.homelab-traefik.loadbalancer.server.port=9090", gateway_labels)
+
+    def test_direct_mixed_routers(self):
+        """Test that direct and fallback routers are combined in the same notes."""
+        containers = [
+            {
+                "published_ports": "0.0.0.0:8443->443/tcp",
+                "labels": [
+                    "traefik.http.routers.mash-vaultwarden.rule=Host(`vault.example.com`)",
+                    "traefik.http.services.mash-vaultwarden.loadbalancer.server.port=443",
+                    "traefik.http.services.mash-vaultwarden.loadbalancer.server.scheme=https"
+                ]
+            },
+            {
+                "published_ports": "",
+                "labels": ["traefik.http.routers.mash-homarr.rule=Host(`homarr.example.com`)"]
+            }
+        ]
+
+        gateway_labels = generate_gateway_labels_direct(containers)
+
+        self.assertEqual(gateway_labels[0], "traefik.enable=true")
+        self.assertIn("traefik.http.services.vaultwarden.loadbalancer.server.port=8443", gateway_labels)
+        self.assertIn("traefik.http.services.vaultwarden.loadbalancer.server.scheme=https", gateway_labels)
+        self.assertIn("traefik.http.routers.homarr.service=homelab-traefik", gateway_labels)
+        self.assertIn("traefik.http.services.homelab-traefik.loadbalancer.server.port=8080", gateway_labels)
+
+    def test_direct_single_published_port_without_service(self):
+        """Test that a container's only published port is used when no service names one."""
+        containers = [{
+            "published_ports": "0.0.0.0:3000->3000/tcp",
+            "labels": ["traefik.http.routers.grafana.rule=Host(`grafana.example.com`)"]
+        }]
+
+        gateway_labels = generate_gateway_labels_direct(containers)
+
+        self.assertIn("traefik.http.services.grafana.loadbalancer.server.port=3000", gateway_labels)
+
+    def test_direct_service_of_another_provider(self):
+        """Test that routers pointing to services unknown to the container fall back."""
+        containers = [{
+            "published_ports": "0.0.0.0:8080->8080/tcp",
+            "labels": [
+                "traefik.http.routers.dashboard.rule=Host(`traefik.example.com`)",
+                "traefik.http.routers.dashboard.service=api@internal"
+            ]
+        }]
+
+        gateway_labels = generate_gateway_labels_direct(containers)
+
+        self.assertIn("traefik.http.routers.dashboard.service=homelab-traefik", gateway_labels)
+
+    def test_parse_published_ports(self):
+        """Test parsing of `docker ps` port mappings."""
+        host_ports = parse_published_ports("0.0.0.0:32768->8080/tcp, :::32768->8080/tcp, 9000/tcp, 0.0.0.0:53->53/udp, 0.0.0.0:7000-7001->5000-5001/tcp, [::1]:9999->9999/tcp")
+
+        self.assertEqual(host_ports, {8080: 32768, 5000: 7000, 5001: 7001})
+
+    def test_process_direct_mode_without_containers(self):
+        """Test that without container details, direct mode behaves like pass-through."""
+        labels = ["traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`)"]
+
+        result = process_labels(labels, gateway_mode='direct')
+
+        self.assertEqual(result['gateway_mode'], 'direct')
+        self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik", result['proxmox_notes'])
+
+
+class TestReplicatedRouters(unittest.TestCase):
+    """Test suite for merging routers replicated on several hosts."""
+
+    def test_merge_passthrough_replicas(self):
+        """Test that identical rules on several hosts share one service with a server per host."""
+        local_labels = [
+            "traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)",
+            "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+        ]
+        gateway_labels = generate_gateway_labels_passthrough(local_labels)
+
+        merged = merge_replicated_routers([gateway_labels, gateway_labels], [local_labels, local_labels], weights=[3, 1])
+
+        for host_labels, weight in zip(merged, [3, 1]):
+            self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik-miniflux", host_labels)
+            self.assertIn("traefik.http.routers.miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)", host_labels)
+            self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.server.port=8080", host_labels)
+            self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.server.weight={0}".format(weight), host_labels)
+            # The local Traefik service isn't used anymore
+            self.assertFalse(any("services.homelab-traefik." in label for label in host_labels))
+
+    def test_merge_keeps_other_routers(self):
+        """Test that routers only present on one host are left untouched."""
+        shared_labels = ["traefik.http.routers.mash-miniflux.rule=Host(`miniflux.example.com`)"]
+        host1_labels = shared_labels + ["traefik.http.routers.mash-homarr.rule=Host(`homarr.example.com`)"]
+        host2_labels = list(shared_labels)
+
+        merged = merge_replicated_routers(
+            [generate_gateway_labels_passthrough(host1_labels), generate_gateway_labels_passthrough(host2_labels)],
+            [host1_labels, host2_labels]
+        )
+
+        self.assertIn("traefik.http.routers.homarr.service=homelab-traefik", merged[0])
+        self.assertIn("traefik.http.services.homelab-traefik.loadbalancer.server.port=8080", merged[0])
+        self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik-miniflux", merged[0])
+        self.assertFalse(any("weight" in label for label in merged[0]))
+        self.assertFalse(any("services.homelab-traefik." in label for label in merged[1]))
+
+    def test_merged_service_is_apart_from_local_traefik_services(self):
+        """Test that merged replicas don't share a service name with hosts passing their routers through."""
+        shared_labels = ["traefik.http.routers.mash-miniflux.rule=Host(`miniflux.example.com`)"]
+        host3_labels = ["traefik.http.routers.mash-homarr.rule=Host(`homarr.example.com`)"]
+
+        merged = merge_replicated_routers(
+            [generate_gateway_labels_passthrough(labels) for labels in [shared_labels, shared_labels, host3_labels]],
+            [shared_labels, shared_labels, host3_labels]
+        )
+
+        services_by_host = [parse_traefik_labels(host_labels)['services'] for host_labels in merged]
+        self.assertEqual([sorted(services) for services in services_by_host], [
+            ["homelab-traefik-miniflux"], ["homelab-traefik-miniflux"], ["homelab-traefik"]
+        ])
+        self.assertEqual(merged[2], generate_gateway_labels_passthrough(host3_labels))
+
+    def test_merge_direct_replicas_with_health_check(self):
+        """Test that direct servers keep their own ports and get the local service's health check."""
+        local_labels = [
+            "traefik.http.routers.mash-miniflux.rule=Host(`miniflux.example.com`)",
+            "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080",
+            "traefik.http.services.mash-miniflux.loadbalancer.healthcheck.path=/healthcheck",
+            "traefik.http.services.mash-miniflux.loadbalancer.healthcheck.interval=10s"
+        ]
+        hosts_gateway_labels = [
+            generate_gateway_labels_direct([{"labels": local_labels, "published_ports": "0.0.0.0:32768->8080/tcp"}]),
+            generate_gateway_labels_direct([{"labels": local_labels, "published_ports": "0.0.0.0:32770->8080/tcp"}])
+        ]
+
+        merged = merge_replicated_routers(hosts_gateway_labels, [local_labels, local_labels])
+
+        self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.server.port=32768", merged[0])
+        self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.server.port=32770", merged[1])
+        for host_labels in merged:
+            self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.healthcheck.path=/healthcheck", host_labels)
+            self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.healthcheck.interval=10s", host_labels)
+            self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.healthcheck.hostname=miniflux.example.com", host_labels)
+
+    def test_merge_single_host(self):
+        """Test that nothing changes without replicas."""
+        local_labels = ["traefik.http.routers.mash-miniflux.rule=Host(`miniflux.example.com`)"]
+        gateway_labels = generate_gateway_labels_passthrough(local_labels)
+
+        merged = merge_replicated_routers([gateway_labels], [local_labels])
+
+        self.assertEqual(merged, [gateway_labels])
+
+    def test_merge_module_results(self):
+        """Test that the module's replicas option merges the hosts' results like the controller does."""
+        local_labels = [
+            "traefik.http.routers.mash-miniflux.rule=Host(`miniflux.example.com`)",
+            "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+        ]
+        result = process_labels(local_labels, gateway_mode='passthrough')
+        replicas = [
+            {"host": "vm1", "proxmox_notes": result['proxmox_notes'], "local_labels": local_labels, "weight": "2"},
+            {"host": "vm2", "proxmox_notes": result['proxmox_notes'], "local_labels": local_labels, "weight": ""},
+            {"host": "vm3", "proxmox_notes": "", "local_labels": []}
+        ]
+
+        notes_by_host = merge_host_notes(replicas)
+
+        self.assertEqual(set(notes_by_host.keys()), {"vm1", "vm2"})
+        merged = merge_replicated_routers(
+            [result['proxmox_notes'].split("\n")] * 2, [local_labels, local_labels], weights=["2", None]
+        )
+        self.assertEqual(notes_by_host["vm1"], format_labels_for_proxmox(merged[0]))
+        self.assertEqual(notes_by_host["vm2"], format_labels_for_proxmox(merged[1]))
+        self.assertIn("traefik.http.services.homelab-traefik-miniflux.loadbalancer.server.weight=2", notes_by_host["vm1"])
+        self.assertNotIn("weight", notes_by_host["vm2"])
+
+
+class TestTransportOptions(unittest.TestCase):
+    """Test suite for backend transport tuning labels."""
+
+    def test_filter_keeps_valid_transport_labels(self):
+        """Test that transport labels with valid values are kept, whatever their case."""
+        labels = [
+            "traefik.http.services.jellyfin.loadbalancer.server.port=8096",
+            "traefik.http.services.jellyfin.loadbalancer.server.scheme=h2c",
+            "traefik.http.services.jellyfin.loadbalancer.passHostHeader=true",
+            "traefik.http.services.jellyfin.loadbalancer.responseForwarding.flushInterval=-1",
+            "traefik.http.services.jellyfin.loadbalancer.serversTransport=streaming@file"
+        ]
+
+        filtered = filter_labels_for_gateway(labels)
+
+        self.assertEqual(filtered, labels)
+
+    def test_filter_drops_invalid_transport_labels(self):
+        """Test that transport labels with invalid values are dropped and reported."""
+        labels = [
+            "traefik.http.services.app.loadbalancer.server.scheme=ftp",
+            "traefik.http.services.app.loadbalancer.responseforwarding.flushinterval=soon"
+        ]
+
+        self.assertEqual(filter_labels_for_gateway(labels), [])
+
+        result = process_labels(labels + ["traefik.enable=true"], gateway_mode='filter')
+        self.assertEqual(len(result['warnings']), 2)
+
+    def test_passthrough_transport_options(self):
+        """Test that role-provided transport options apply to the local Traefik service."""
+        labels = ["traefik.http.routers.mash-jellyfin.rule=Host(`jellyfin.example.com`)"]
+
+        gateway_labels = generate_gateway_labels_passthrough(labels, transport_options={
+            "loadbalancer.server.scheme": "h2c",
+            "loadbalancer.responseforwarding.flushinterval": "10ms"
+        })
+
+        self.assertIn("traefik.http.services.homelab-traefik.loadbalancer.server.scheme=h2c", gateway_labels)
+        self.assertIn("traefik.http.services.homelab-traefik.loadbalancer.responseforwarding.flushinterval=10ms", gateway_labels)
+        self.assertNotIn("traefik.http.services.homelab-traefik.loadbalancer.server.scheme=http", gateway_labels)
+
+    def test_direct_keeps_container_transport_labels(self):
+        """Test that direct services are tuned like the container's service."""
+        containers = [{
+            "published_ports": "0.0.0.0:8096->8096/tcp",
+            "labels": [
+                "traefik.http.routers.mash-jellyfin.rule=Host(`jellyfin.example.com`)",
+                "traefik.http.services.mash-jellyfin.loadbalancer.server.port=8096",
+                "traefik.http.services.mash-jellyfin.loadbalancer.responseForwarding.flushInterval=-1",
+                "traefik.http.services.mash-jellyfin.loadbalancer.passhostheader=false"
+            ]
+        }]
+
+        gateway_labels = generate_gateway_labels_direct(containers)
+
+        self.assertIn("traefik.http.services.jellyfin.loadbalancer.responseforwarding.flushinterval=-1", gateway_labels)
+        self.assertIn("traefik.http.services.jellyfin.loadbalancer.passhostheader=false", gateway_labels)
+        self.assertIn("traefik.http.services.jellyfin.loadbalancer.server.scheme=http", gateway_labels)
+
+    def test_validate_transport_options(self):
+        """Test that invalid role-provided transport options are rejected."""
+        self.assertEqual(validate_transport_options({"loadbalancer.passHostHeader": True}), {"loadbalancer.passhostheader": "true"})
+
+        with self.assertRaises(ValueError):
+            validate_transport_options({"loadbalancer.server.scheme": "h3"})
+        with self.assertRaises(ValueError):
+            validate_transport_options({"loadbalancer.sticky.cookie": "true"})
+
+
+class TestMiddlewareTranslation(unittest.TestCase):
+    """Test suite for translating performance middlewares for the Gateway."""
+
+    def test_filter_mode_keeps_compression(self):
+        """Test that the file-provider compression middleware is replaced by a Gateway-side one."""
+        labels = [
+            "traefik.enable=true",
+            "traefik.http.middlewares.mash-miniflux-slashless-redirect.redirectregex.regex=^(/miniflux)$",
+            "traefik.http.routers.mash-miniflux.middlewares=compression@file,mash-miniflux-slashless-redirect",
+            "traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)"
+        ]
+
+        result = process_labels(labels, gateway_mode='filter')
+        notes = result['proxmox_notes'].split('\n')
+
+        self.assertIn("traefik.http.middlewares.gateway-compression.compress=true", notes)
+        self.assertIn("traefik.http.routers.mash-miniflux.middlewares=gateway-compression", notes)
+        self.assertFalse(any("redirectregex" in label for label in notes))
+
+    def test_performance_middleware_definitions_are_kept(self):
+        """Test that compress, buffering and rate limit definitions are kept, and only caching headers."""
+        labels = [
+            "traefik.http.middlewares.app-compress.compress.minresponsebodybytes=1024",
+            "traefik.http.middlewares.app-buffering.buffering.maxRequestBodyBytes=10485760",
+            "traefik.http.middlewares.app-ratelimit.ratelimit.average=100",
+            "traefik.http.middlewares.app-headers.headers.customresponseheaders.Cache-Control=public, max-age=3600",
+            "traefik.http.middlewares.app-headers.headers.customresponseheaders.X-Frame-Options=DENY",
+            "traefik.http.middlewares.app-auth.basicauth.users=user:hash",
+            "traefik.http.routers.app.middlewares=app-compress@docker,app-buffering,app-ratelimit,app-headers,app-auth"
+        ]
+
+        middlewares, routers = translate_middlewares(labels)
+
+        self.assertEqual(middlewares, {
+            "app-compress": {"compress.minresponsebodybytes": "1024"},
+            "app-buffering": {"buffering.maxRequestBodyBytes": "10485760"},
+            "app-ratelimit": {"ratelimit.average": "100"},
+            "app-headers": {"headers.customresponseheaders.Cache-Control": "public, max-age=3600"}
+        })
+        self.assertEqual(routers["app"], (["app-compress", "app-buffering", "app-ratelimit", "app-headers"], False))
+
+    def test_unused_middlewares_are_dropped(self):
+        """Test that middleware definitions no router uses are not passed on."""
+        labels = [
+            "traefik.http.middlewares.unused.compress=true",
+            "traefik.http.routers.app.rule=Host(`test.com`)"
+        ]
+
+        middlewares, routers = translate_middlewares(labels)
+
+        self.assertEqual(middlewares, {})
+        self.assertEqual(routers, {})
+
+    def test_direct_mode_with_performance_middlewares(self):
+        """Test that routers with only performance middlewares go direct, with the Gateway applying them."""
+        containers = [{
+            "published_ports": "0.0.0.0:32768->8080/tcp",
+            "labels": [
+                "traefik.http.routers.mash-miniflux.rule=Host(`miniflux.example.com`)",
+                "traefik.http.routers.mash-miniflux.middlewares=compression@file",
+                "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+            ]
+        }]
+
+        gateway_labels = generate_gateway_labels_direct(containers)
+
+        self.assertIn("traefik.http.routers.miniflux.service=miniflux", gateway_labels)
+        self.assertIn("traefik.http.routers.miniflux.middlewares=gateway-compression", gateway_labels)
+        self.assertIn("traefik.http.middlewares.gateway-compression.compress=true", gateway_labels)
+
+    def test_direct_mode_fallback_leaves_middlewares_to_local_traefik(self):
+        """Test that routers falling back to the local Traefik get no Gateway middlewares."""
+        containers = [{
+            "published_ports": "0.0.0.0:32768->8080/tcp",
+            "labels": [
+                "traefik.http.routers.mash-miniflux.rule=Host(`miniflux.example.com`)",
+                "traefik.http.routers.mash-miniflux.middlewares=compression@file,mash-miniflux-auth",
+                "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+            ]
+        }]
+
+        gateway_labels = generate_gateway_labels_direct(containers)
+
+        self.assertIn("traefik.http.routers.miniflux.service=homelab-traefik", gateway_labels)
+        self.assertFalse(any("middlewares" in label for label in gateway_labels))
+
+
+class TestDiscoveryOutput(unittest.TestCase):
+    """Test suite for decoding the output of inspect-docker.sh."""
+
+    COMPACT_OUTPUT = json.dumps({
+        "labels": ["traefik.enable=true", "traefik.http.routers.a.rule=Host(`a.com`)", "traefik.http.routers.b.rule=Host(`b.com`)"],
+        "containers": [
+            {"id": "1", "name": "a", "published_ports": "", "labels": [0, 1]},
+            {"id": "2", "name": "b", "published_ports": "", "labels": [0, 2]}
+        ]
+    })
+
+    def test_compact_output(self):
+        """Test that label references are expanded."""
+        inspection = decode_discovery_output(self.COMPACT_OUTPUT + "\n")
+
+        self.assertEqual(inspection["containers"][1], {
+            "id": "2", "name": "b", "published_ports": "",
+            "labels": ["traefik.enable=true", "traefik.http.routers.b.rule=Host(`b.com`)"]
+        })
+
+    def test_compressed_output(self):
+        """Test that gzip+base64 output is decoded."""
+        compressed_output = base64.b64encode(gzip.compress(self.COMPACT_OUTPUT.encode('utf-8'))).decode('ascii')
+
+        self.assertEqual(decode_discovery_output(compressed_output), decode_discovery_output(self.COMPACT_OUTPUT))
+
+    def test_plain_and_error_outputs(self):
+        """Test that outputs without a label table (including errors) are accepted as they are."""
+        self.assertEqual(
+            decode_discovery_output('{"error": "Docker not accessible", "containers": []}'),
+            {"error": "Docker not accessible", "containers": []}
+        )
+        self.assertEqual(
+            decode_discovery_output('{"containers": [{"id": "1", "labels": ["traefik.enable=true"]}]}'),
+            {"containers": [{"id": "1", "labels": ["traefik.enable=true"]}]}
+        )
+
+    def test_invalid_outputs(self):
+        """Test that undecodable outputs raise ValueError."""
+        for output in ["not base64!", base64.b64encode(b"not gzip").decode('ascii'), "[]",
+                       '{"labels": ["traefik.enable=true"], "containers": [{"labels": [3]}]}']:
+            with self.subTest(output=output):
+                with self.assertRaises(ValueError):
+                    decode_discovery_output(output)
+
+    def test_batch_record_with_discovery_output(self):
+        """Test that batch records can carry the raw output of the script."""
+        output_file = io.StringIO()
+        record = json.dumps({"host": "vm1", "vmid": 101, "discovery_output": self.COMPACT_OUTPUT})
+
+        process_batch(io.StringIO(record + "\n"), output_file, workers=1)
+
+        self.assertEqual(json.loads(output_file.getvalue())['labels_count_before_filter'], 4)
+
+
+def make_host_record(idx):
+    return json.dumps({
+        "host": "vm{0}".format(idx),
+        "vmid": 100 + idx,
+        "containers": [{
+            "id": "a",
+            "name": "mash-app{0}".format(idx),
+            "labels": [
+                "traefik.enable=true",
+                "traefik.http.routers.mash-app{0}.rule=Host(`app{0}.example.com`)".format(idx),
+                "traefik.http.services.mash-app{0}.loadbalancer.server.port=8080".format(idx)
+            ]
+        }]
+    })
+
+
+class TestBatchProcessing(unittest.TestCase):
+    """Test suite for processing JSONL host dumps outside of Ansible."""
+
+    def run_batch(self, lines, **kwargs):
+        output_file = io.StringIO()
+        counts = process_batch(io.StringIO("\n".join(lines) + "\n"), output_file, **kwargs)
+        return counts, [json.loads(line) for line in output_file.getvalue().splitlines()]
+
+    def test_results_are_in_record_order(self):
+        """Test that parallel processing keeps the order of the records, across batches."""
+        lines = [make_host_record(idx) for idx in range(50)]
+
+        counts, outputs = self.run_batch(lines, workers=2, batch_size=8, gateway_mode='passthrough')
+
+        self.assertEqual(counts, (50, 0))
+        self.assertEqual([output['vmid'] for output in outputs], list(range(100, 150)))
+        self.assertIn("traefik.http.routers.app7.service=homelab-traefik", outputs[7]['proxmox_notes'])
+        self.assertEqual(outputs[7]['labels_count'], 8)
+
+    def test_same_results_as_module(self):
+        """Test that a record gets exactly what the module would return for the host."""
+        counts, outputs = self.run_batch([make_host_record(1)], workers=1)
+
+        labels = json.loads(make_host_record(1))['containers'][0]['labels']
+        expected = dict(host='vm1', vmid=101, **process_labels(labels))
+        self.assertEqual(outputs, [json.loads(json.dumps(expected))])
+
+    def test_invalid_records_are_reported(self):
+        """Test that invalid records produce error results without stopping the batch."""
+        lines = [make_host_record(1), "{not json", "", "[]", make_host_record(2)]
+
+        counts, outputs = self.run_batch(lines, workers=1)
+
+        self.assertEqual(counts, (4, 2))
+        self.assertEqual([output['vmid'] for output in outputs], [101, None, None, 102])
+        self.assertIn("Invalid JSON record", outputs[1]['error'])
+        self.assertIn("not a JSON object", outputs[2]['error'])
+
+    def test_replicated_routers_are_merged(self):
+        """Test that routers replicated on several records are merged, with each record's weight."""
+        records = [json.loads(make_host_record(1)) for _ in range(2)]
+        records[1].update(host="vm2", vmid=102, weight=3)
+
+        counts, outputs = self.run_batch([json.dumps(record) for record in records], workers=1, gateway_mode='passthrough')
+
+        self.assertEqual(counts, (2, 0))
+        for output in outputs:
+            self.assertIn("traefik.http.routers.app1.service=homelab-traefik-app1", output['proxmox_notes'])
+            self.assertNotIn("services.homelab-traefik.", output['proxmox_notes'])
+            self.assertNotIn('local_labels', output)
+        self.assertIn("traefik.http.services.homelab-traefik-app1.loadbalancer.server.weight=3", outputs[1]['proxmox_notes'])
+
+        counts, outputs = self.run_batch(
+            [json.dumps(record) for record in records], workers=1, gateway_mode='passthrough', merge_replicas=False
+        )
+
+        self.assertIn("traefik.http.routers.app1.service=homelab-traefik", outputs[1]['proxmox_notes'])
+
+    def test_invalid_transport_options(self):
+        """Test that invalid options are rejected before any record is processed."""
+        with self.assertRaises(ValueError):
+            self.run_batch([make_host_record(1)], transport_options={'loadbalancer.server.scheme': 'ftp'})
+
+    def test_command_line(self):
+        """Test the `batch` command-line entry point."""
+        module_path = os.path.join(os.path.dirname(__file__), '../roles/docker_traefik_discovery/library/parse_docker_labels.py')
+        result = subprocess.run(
+            [sys.executable, module_path, 'batch', '-', '--gateway-mode', 'passthrough', '--workers', '1'],
+            input=make_host_record(1) + "\n", capture_output=True, text=True
+        )
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(json.loads(result.stdout)['host'], 'vm1')
+        self.assertIn("Processed 1 host records, 0 failed", result.stderr)
+
+
+class TestProcessLabels(unittest.TestCase):
+    """Test suite for the complete processing of a host's labels."""
+
+    def test_process_filter_mode(self):
+        """Test filter mode result."""
+        labels = [
+            "traefik.enable=true",
+            "traefik.docker.network=traefik",
+            "traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`)",
+            "com.docker.compose.project=mash"
+        ]
+
+        result = process_labels(labels, gateway_mode='filter')
+
+        self.assertEqual(result['labels_count_before_filter'], 3)
+        self.assertEqual(result['labels_count'], 2)
+        self.assertEqual(result['proxmox_notes'], "traefik.enable=true\ntraefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`)")
+        self.assertIn('mash-miniflux', result['parsed_labels']['routers'])
+        self.assertTrue(result['changed'])
+
+    def test_process_passthrough_mode(self):
+        """Test pass-through mode result."""
+        labels = [
+            "traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`)"
+        ]
+
+        result = process_labels(labels, gateway_mode='passthrough', traefik_local_port=9090)
+
+        self.assertEqual(result['gateway_mode'], 'passthrough')
+        self.assertIn("traefik.http.services.homelab-traefik.loadbalancer.server.port=9090", result['proxmox_notes'])
+
+    def test_process_no_labels(self):
+        """Test that nothing is generated (and nothing changed) without labels."""
+        result = process_labels(["traefik.docker.network=traefik"], gateway_mode='filter')
+
+        self.assertEqual(result['labels_count'], 0)
+        self.assertEqual(result['proxmox_notes'], '')
+        self.assertFalse(result['changed'])
+
+
 if __name__ == '__main__':
     # Run tests with verbose output
     unittest.main(verbosity=2)
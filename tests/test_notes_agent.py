@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the event-driven notes agent (roles/docker_traefik_discovery/files/traefik_notes_agent.py).
+Docker is faked by an HTTP server on a Unix socket, whose events stream is fed by the tests.
+"""
+
+import http.server
+import json
+import os
+import queue
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+from unittest import mock
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../roles/docker_traefik_discovery/files'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../roles/docker_traefik_discovery/library'))
+
+from traefik_notes_agent import (
+    DockerClient, NotesAgent, extract_traefik_labels, format_published_ports, parse_arguments
+)
+from parse_docker_labels import parse_published_ports
+
+
+def make_container_labels(name):
+    return {
+        "com.docker.compose.project": name,
+        "traefik.enable": "true",
+        "traefik.http.routers.mash-{0}.rule".format(name): "Host(`homelab.cy-bert.fr`) && PathPrefix(`/{0}`)".format(name),
+        "traefik.http.services.mash-{0}.loadbalancer.server.port".format(name): "8080"
+    }
+
+
+def make_ports(host_port):
+    return [
+        {"IP": "0.0.0.0", "PrivatePort": 8080, "PublicPort": host_port, "Type": "tcp"},
+        {"IP": "::", "PrivatePort": 8080, "PublicPort": host_port, "Type": "tcp"}
+    ]
+
+
+def make_event(action, container_id, labels):
+    attributes = {"name": container_id, "image": "example"}
+    attributes.update(labels)
+    return {"Type": "container", "Action": action, "Actor": {"ID": container_id, "Attributes": attributes}}
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.request_paths.append(self.path)
+
+        path, _, query = self.path.partition('?')
+        if path == '/containers/json':
+            containers = self.server.containers
+            filters = urllib.parse.parse_qs(query).get('filters')
+            if filters:
+                container_ids = json.loads(filters[0])['id']
+                containers = [container for container in containers if container['Id'] in container_ids]
+            body = json.dumps(containers).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path.startswith('/events?'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.flush()
+            self.server.subscribed.set()
+            while True:
+                event = self.server.events.get()
+                if event is None:
+                    self.wfile.write(b'0\r\n\r\n')
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                data = (json.dumps(event) + '\n').encode('utf-8')
+                self.wfile.write('{0:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+        self.send_error(404)
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, FakeDockerHandler)
+        self.containers = []
+        self.events = queue.Queue()
+        self.request_paths = []
+        self.subscribed = threading.Event()
+
+
+class NotesAgentTestCase(unittest.TestCase):
+    """Runs an agent against a fake Docker events socket, collecting the notes it pushes."""
+
+    gateway_mode = 'passthrough'
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.server = FakeDockerServer(os.path.join(self.temp_dir.name, 'docker.sock'))
+        self.server.containers = [
+            {"Id": "miniflux", "Labels": make_container_labels("miniflux")},
+            {"Id": "postgres", "Labels": {"com.docker.compose.project": "postgres"}}
+        ]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.pushed_notes = []
+        self.pushed = threading.Condition()
+        self.agent = NotesAgent(
+            DockerClient(self.server.server_address),
+            self.push_notes,
+            debounce=0.3,
+            max_delay=5,
+            retry_interval=0.1,
+            process_options=dict(gateway_mode=self.gateway_mode)
+        )
+        self.agent_thread = threading.Thread(target=self.agent.run, daemon=True)
+
+    def tearDown(self):
+        self.agent.stop()
+        self.server.events.put(None)
+        self.agent_thread.join(5)
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def push_notes(self, notes):
+        with self.pushed:
+            self.pushed_notes.append(notes)
+            self.pushed.notify_all()
+
+    def wait_for_pushes(self, count, timeout=5):
+        with self.pushed:
+            self.pushed.wait_for(lambda: len(self.pushed_notes) >= count, timeout)
+        self.assertGreaterEqual(len(self.pushed_notes), count)
+
+    def start_agent(self):
+        self.agent_thread.start()
+        self.assertTrue(self.server.subscribed.wait(5))
+        self.wait_for_pushes(1)
+
+
+class TestNotesAgent(NotesAgentTestCase):
+    """Test suite for the agent against a fake Docker events socket."""
+
+    def test_initial_sync_pushes_notes(self):
+        """Test that the running containers' labels are pushed at startup."""
+        self.start_agent()
+
+        self.assertIn("traefik.http.routers.miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)", self.pushed_notes[0])
+        self.assertEqual(self.agent.labels_by_container_id.keys(), {"miniflux"})
+
+    def test_burst_of_events_is_coalesced(self):
+        """Test that a burst of events results in a single notes update with all changes."""
+        self.start_agent()
+
+        for name in ["homarr", "linkding", "vaultwarden", "gitea"]:
+            self.server.events.put(make_event("start", name, make_container_labels(name)))
+            time.sleep(0.05)
+        self.server.events.put(make_event("die", "miniflux", make_container_labels("miniflux")))
+
+        self.wait_for_pushes(2)
+        time.sleep(0.5)
+
+        self.assertEqual(len(self.pushed_notes), 2)
+        for name in ["homarr", "linkding", "vaultwarden", "gitea"]:
+            self.assertIn("traefik.http.routers.{0}.service=homelab-traefik".format(name), self.pushed_notes[1])
+        self.assertNotIn("miniflux", self.pushed_notes[1])
+        # Only the events stream and the initial listing were requested, no per-container inspection
+        self.assertEqual(len(self.server.request_paths), 2)
+
+    def test_unchanged_notes_are_not_pushed(self):
+        """Test that events which don't change any Traefik label don't cause updates."""
+        self.start_agent()
+
+        self.server.events.put(make_event("start", "postgres", {}))
+        self.server.events.put(make_event("update", "miniflux", make_container_labels("miniflux")))
+        self.server.events.put(make_event("die", "postgres", {}))
+        time.sleep(0.6)
+
+        self.assertEqual(len(self.pushed_notes), 1)
+
+    def test_last_container_stopping_clears_notes(self):
+        """Test that the notes are emptied once no container exposes anything anymore."""
+        self.start_agent()
+
+        self.server.events.put(make_event("die", "miniflux", make_container_labels("miniflux")))
+
+        self.wait_for_pushes(2)
+        self.assertEqual(self.pushed_notes[1], "")
+
+    def test_resyncs_after_events_stream_ends(self):
+        """Test that the agent reconnects and catches up on changes made while disconnected."""
+        self.start_agent()
+
+        self.server.subscribed.clear()
+        self.server.containers = [{"Id": "homarr", "Labels": make_container_labels("homarr")}]
+        self.server.events.put(None)
+
+        self.assertTrue(self.server.subscribed.wait(5))
+        self.wait_for_pushes(2)
+        self.assertIn("routers.homarr.rule", self.pushed_notes[1])
+        self.assertNotIn("miniflux", self.pushed_notes[1])
+
+    def test_transport_options_are_applied(self):
+        """Test that the transport options of the service pointing to the local Traefik end up in the notes."""
+        self.agent.process_options['transport_options'] = {'loadbalancer.server.scheme': 'h2c'}
+        self.start_agent()
+
+        self.assertIn("traefik.http.services.homelab-traefik.loadbalancer.server.scheme=h2c", self.pushed_notes[0])
+
+    def test_failed_push_is_retried(self):
+        """Test that a failed notes update is retried."""
+        failures = ["Proxmox unreachable"]
+        push_notes = self.agent.push_notes
+
+        def flaky_push_notes(notes):
+            if failures:
+                raise Exception(failures.pop())
+            push_notes(notes)
+
+        self.agent.push_notes = flaky_push_notes
+        self.start_agent()
+
+        self.assertEqual(failures, [])
+        self.assertIn("routers.miniflux.rule", self.pushed_notes[0])
+
+
+class TestDirectMode(NotesAgentTestCase):
+    """Test suite for the agent in direct mode, which needs the containers' published ports."""
+
+    gateway_mode = 'direct'
+
+    def setUp(self):
+        super().setUp()
+        self.server.containers[0]["Ports"] = make_ports(32768)
+
+    def test_initial_sync_routes_to_published_ports(self):
+        """Test that routes go straight to the ports published by the running containers."""
+        self.start_agent()
+
+        self.assertIn("traefik.http.routers.miniflux.service=miniflux", self.pushed_notes[0])
+        self.assertIn("traefik.http.services.miniflux.loadbalancer.server.port=32768", self.pushed_notes[0])
+        self.assertNotIn("homelab-traefik", self.pushed_notes[0])
+
+    def test_started_container_ports_are_listed(self):
+        """Test that a started container's ports, which events don't include, are listed from Docker."""
+        self.start_agent()
+
+        self.server.containers.append({"Id": "homarr", "Labels": make_container_labels("homarr"), "Ports": make_ports(32769)})
+        self.server.events.put(make_event("start", "homarr", make_container_labels("homarr")))
+
+        self.wait_for_pushes(2)
+        self.assertIn("traefik.http.services.homarr.loadbalancer.server.port=32769", self.pushed_notes[1])
+        self.assertIn("traefik.http.services.miniflux.loadbalancer.server.port=32768", self.pushed_notes[1])
+        self.assertEqual(len(self.server.request_paths), 3)
+
+    def test_restarted_container_gets_new_ports(self):
+        """Test that a container started again with other published ports gets its routes updated."""
+        self.start_agent()
+
+        self.server.containers[0]["Ports"] = make_ports(32770)
+        self.server.events.put(make_event("die", "miniflux", make_container_labels("miniflux")))
+        self.server.events.put(make_event("start", "miniflux", make_container_labels("miniflux")))
+
+        self.wait_for_pushes(2)
+        self.assertIn("traefik.http.services.miniflux.loadbalancer.server.port=32770", self.pushed_notes[1])
+
+
+class TestFormatPublishedPorts(unittest.TestCase):
+    """Test suite for formatting the Docker API's ports like `docker ps` does."""
+
+    def test_published_and_exposed_ports(self):
+        """Test that published ports (IPv4 and IPv6) and unpublished ones are formatted like inspect-docker.sh outputs them."""
+        ports = make_ports(32768) + [{"PrivatePort": 9000, "Type": "tcp"}]
+
+        self.assertEqual(format_published_ports(ports), "0.0.0.0:32768->8080/tcp, 9000/tcp, [::]:32768->8080/tcp")
+        self.assertEqual(parse_published_ports(format_published_ports(ports)), {8080: 32768})
+
+    def test_no_ports(self):
+        """Test that containers without ports have none."""
+        self.assertEqual(format_published_ports(None), "")
+
+
+class TestExtractTraefikLabels(unittest.TestCase):
+    """Test suite for extracting Traefik labels from container labels and event attributes."""
+
+    def test_only_traefik_labels_are_kept(self):
+        """Test that other labels and event attributes are ignored."""
+        labels = extract_traefik_labels({
+            "name": "mash-miniflux",
+            "image": "miniflux",
+            "traefik.enable": "true",
+            "traefik.docker.network": "traefik"
+        })
+
+        self.assertEqual(labels, ["traefik.docker.network=traefik", "traefik.enable=true"])
+
+    def test_no_labels(self):
+        """Test that containers without labels have no Traefik labels."""
+        self.assertEqual(extract_traefik_labels(None), [])
+
+
+class TestParseArguments(unittest.TestCase):
+    """Test suite for the agent's command line, as written by traefik-notes-agent.service.j2."""
+
+    def test_defaults_match_role(self):
+        """Test that the agent defaults to the same gateway mode as the parse_docker_labels module."""
+        args = parse_arguments(['--dry-run'])
+
+        self.assertEqual(args.gateway_mode, 'filter')
+        self.assertEqual(args.traefik_local_port, 8080)
+        self.assertEqual(args.gateway_service_name, 'homelab-traefik')
+
+    def test_all_gateway_modes_are_accepted(self):
+        """Test that every gateway mode of the playbook can be passed to the agent."""
+        for gateway_mode in ['filter', 'passthrough', 'direct']:
+            with self.subTest(gateway_mode=gateway_mode):
+                self.assertEqual(parse_arguments(['--dry-run', '--gateway-mode', gateway_mode]).gateway_mode, gateway_mode)
+
+    def test_transport_options(self):
+        """Test that transport options are collected and validated like the module's transport_options."""
+        args = parse_arguments([
+            '--dry-run',
+            '--transport-option', 'loadbalancer.server.scheme=h2c',
+            '--transport-option', 'loadBalancer.responseForwarding.flushInterval=10ms'
+        ])
+
+        self.assertEqual(args.transport_options, {
+            'loadbalancer.server.scheme': 'h2c',
+            'loadbalancer.responseforwarding.flushinterval': '10ms'
+        })
+
+    def test_invalid_transport_options_are_rejected(self):
+        """Test that the agent refuses to start with unknown or invalid transport options."""
+        for transport_option in ['loadbalancer.server.scheme=ftp', 'loadbalancer.sticky=true', 'h2c']:
+            with self.subTest(transport_option=transport_option):
+                with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+                    parse_arguments(['--dry-run', '--transport-option', transport_option])
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
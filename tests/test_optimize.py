@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the playbook optimizer (bin/optimize.py).
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+from optimize import (
+    build_activation_index, build_activation_report, build_tag_role_index, find_overlapping_activation_prefixes,
+    format_activation_report, filter_requirements_yml_contents, find_role_directory_paths, find_roles_providing_variables,
+    generate_minimal_playbook, get_host_name_from_vars_path, process_file_contents, prune_unused_variables, select_roles_for_tags,
+    specialize_setup_yml_per_host, split_top_level_definitions, validate_template_contents, validate_templates
+)
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), '../bin/optimize.py')
+TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), '../templates')
+
+GROUP_VARS = """---
+# Miniflux
+miniflux_enabled: "{{ mash_playbook_miniflux_enabled }}"
+
+miniflux_hostname: "{{ mash_playbook_hostname }}"
+
+miniflux_database_hostname: "{{ postgres_connection_hostname }}"
+miniflux_database_password: "{{ '%s' | format(mash_playbook_generic_secret_key) | password_hash('sha512', 'db.miniflux') }}"
+
+postgres_connection_hostname: "{{ postgres_identifier }}"
+
+postgres_managed_databases_auto: |
+  {{
+    ([{
+      'name': miniflux_database_name,
+    }] if miniflux_enabled else [])
+  }}
+
+# Unused
+gitea_hostname: "{{ gitea_domain }}"
+gitea_domain: example.com
+loop_a: "{{ loop_b }}"
+loop_b: "{{ loop_a }}"
+"""
+
+
+class TestSplitTopLevelDefinitions(unittest.TestCase):
+    """Test suite for splitting group vars into definitions."""
+
+    def test_multi_line_definitions(self):
+        """Test that indented lines belong to the definition above them, and comments to no definition."""
+        chunks = split_top_level_definitions(GROUP_VARS)
+
+        self.assertEqual(chunks[0], (None, ["---", "# Miniflux"]))
+        self.assertEqual(
+            [name for name, _ in chunks if name is not None][:6],
+            ["miniflux_enabled", "miniflux_hostname", "miniflux_database_hostname", "miniflux_database_password",
+             "postgres_connection_hostname", "postgres_managed_databases_auto"]
+        )
+        self.assertIn(("postgres_managed_databases_auto", [
+            "postgres_managed_databases_auto: |", "  {{", "    ([{", "      'name': miniflux_database_name,",
+            "    }] if miniflux_enabled else [])", "  }}"
+        ]), chunks)
+        self.assertEqual("\n".join(line for _, lines in chunks for line in lines), GROUP_VARS)
+
+
+class TestPruneUnusedVariables(unittest.TestCase):
+    """Test suite for dropping group vars nothing reachable refers to."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.role_path = os.path.join(self.temp_dir.name, 'galaxy', 'postgres')
+        os.makedirs(os.path.join(self.role_path, 'tasks'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_role_file(self, contents):
+        with open(os.path.join(self.role_path, 'tasks', 'main.yml'), 'w') as file:
+            file.write(contents)
+
+    def test_transitive_references(self):
+        """Test that variables referenced by kept variables are kept, and unreferenced chains and cycles are dropped."""
+        contents, pruned_names = prune_unused_variables(GROUP_VARS, ["{{ miniflux_database_hostname }}"], [])
+
+        self.assertEqual(pruned_names, sorted([
+            "miniflux_enabled", "miniflux_hostname", "miniflux_database_password",
+            "postgres_managed_databases_auto", "gitea_hostname", "gitea_domain", "loop_a", "loop_b"
+        ]))
+        self.assertIn('postgres_connection_hostname: "{{ postgres_identifier }}"', contents)
+        self.assertNotIn("gitea_domain", contents)
+
+    def test_references_from_roles(self):
+        """Test that variables used by role files are kept, along with what they reference."""
+        self.write_role_file("- ansible.builtin.debug:\n    msg: \"{{ postgres_managed_databases_auto }}\"\n")
+
+        _, pruned_names = prune_unused_variables(GROUP_VARS, [], [self.role_path])
+
+        self.assertNotIn("postgres_managed_databases_auto", pruned_names)
+        self.assertNotIn("miniflux_enabled", pruned_names)
+        self.assertIn("miniflux_hostname", pruned_names)
+
+    def test_dynamic_prefix_references(self):
+        """Test that a `prefix_` identifier (used to build names dynamically) keeps every variable it's a prefix of."""
+        _, pruned_names = prune_unused_variables(GROUP_VARS, ["{{ lookup('vars', 'miniflux_' + item) }}"], [])
+
+        self.assertFalse(any(name.startswith("miniflux_") for name in pruned_names))
+        self.assertNotIn("postgres_connection_hostname", pruned_names)
+        self.assertIn("postgres_managed_databases_auto", pruned_names)
+
+    def test_own_name_is_not_a_reference(self):
+        """Test that a definition does not keep itself reachable."""
+        _, pruned_names = prune_unused_variables("miniflux_hostname: miniflux_hostname\n", [], [])
+
+        self.assertEqual(pruned_names, ["miniflux_hostname"])
+
+    def test_comments_are_kept_and_blank_lines_collapsed(self):
+        """Test that comments survive pruning, without leaving runs of blank lines behind."""
+        contents, _ = prune_unused_variables("---\n# a\na: 1\n\n\nb: 2\n\n\n# c\nc: 3\n", ["a c"], [])
+
+        self.assertEqual(contents, "---\n# a\na: 1\n\n\n# c\nc: 3\n")
+
+
+class TestFindRoleDirectoryPaths(unittest.TestCase):
+    """Test suite for finding the roles whose files may use group vars."""
+
+    def test_setup_yml_and_enabled_roles(self):
+        """Test that roles referenced by setup.yml and enabled roles from requirements.yml are included."""
+        setup_yml = "- hosts: mash_servers\n  roles:\n    - role: galaxy/miniflux\n    - role: mash/playbook_base\n"
+
+        self.assertEqual(find_role_directory_paths("/roles", setup_yml, {"postgres", "miniflux"}), [
+            "/roles/galaxy/miniflux", "/roles/galaxy/postgres", "/roles/mash/playbook_base"
+        ])
+
+
+SETUP_YML = """---
+- name: "Set up a self-hosted server"
+  hosts: "{{ target if target is defined else 'mash_servers' }}"
+  become: true
+
+  roles:
+    # role-specific:playbook_help
+    - role: galaxy/playbook_help
+      tags:
+        - setup-all
+        - install-all
+    # /role-specific:playbook_help
+
+    # No role-specific checks here. Local roles are always installed.
+    - role: mash/playbook_base
+
+    # role-specific:postgres
+    - role: galaxy/postgres
+    # /role-specific:postgres
+
+    # role-specific:miniflux
+    - role: galaxy/miniflux
+    # /role-specific:miniflux
+
+    # role-specific:gitea
+    - role: galaxy/gitea
+    # /role-specific:gitea
+
+    # role-specific:systemd_service_manager
+    - role: galaxy/systemd_service_manager
+    # /role-specific:systemd_service_manager
+"""
+
+# Role => {file path relative to the role directory => contents}
+ROLE_FILES = {
+    "galaxy/playbook_help": {
+        "tasks/main.yml": "- ansible.builtin.debug:\n    msg: help\n",
+    },
+    "mash/playbook_base": {
+        "tasks/main.yml": "- ansible.builtin.debug:\n    msg: \"{{ mash_playbook_uid }}\"\n  tags: [always]\n",
+    },
+    "galaxy/postgres": {
+        "defaults/main.yml": "postgres_connection_hostname: mash-postgres\npostgres_identifier: mash-postgres\n",
+        "tasks/main.yml": "- ansible.builtin.import_tasks: install.yml\n  tags:\n    - setup-all\n    - install-postgres\n",
+        "tasks/install.yml": "- ansible.builtin.debug:\n    msg: \"{{ postgres_identifier }}\"\n",
+    },
+    "galaxy/miniflux": {
+        "defaults/main.yml": "miniflux_database_hostname: ''\nminiflux_identifier: mash-miniflux\n",
+        "tasks/main.yml": "- ansible.builtin.debug:\n    msg: \"{{ miniflux_database_hostname }}\"\n  tags:\n    - 'setup-all'\n    - 'install-miniflux'\n",
+    },
+    "galaxy/gitea": {
+        "defaults/main.yml": "gitea_identifier: mash-gitea\n",
+        "tasks/main.yml": "- ansible.builtin.debug:\n    msg: gitea\n  tags: [setup-all, install-gitea]\n",
+    },
+    "galaxy/systemd_service_manager": {
+        "defaults/main.yml": "devture_systemd_service_manager_services_list: []\n",
+        "tasks/main.yml": "- ansible.builtin.debug:\n    msg: \"{{ devture_systemd_service_manager_services_list }}\"\n  tags:\n    - start-group\n",
+    },
+}
+
+MINIMAL_GROUP_VARS = """---
+mash_playbook_uid: 990
+miniflux_database_hostname: "{{ postgres_connection_hostname }}"
+"""
+
+
+class RolesDirectoryTestCase(unittest.TestCase):
+    """Creates the roles of SETUP_YML in a temporary roles directory."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.roles_path = self.temp_dir.name
+        for role_reference, files in ROLE_FILES.items():
+            for file_name, contents in files.items():
+                path = os.path.join(self.roles_path, role_reference, file_name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as file:
+                    file.write(contents)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+
+class TestTagRoleIndex(RolesDirectoryTestCase):
+    """Test suite for finding which roles have tasks for which tags."""
+
+    def test_tags_from_setup_yml_and_task_files(self):
+        """Test that tags come from role entries and from all task files, in inline and list form."""
+        tag_role_index, missing_role_directory_paths = build_tag_role_index(SETUP_YML, self.roles_path)
+
+        self.assertEqual(missing_role_directory_paths, [])
+        self.assertEqual(tag_role_index["setup-all"], {
+            "galaxy/playbook_help", "galaxy/postgres", "galaxy/miniflux", "galaxy/gitea"
+        })
+        self.assertEqual(tag_role_index["install-miniflux"], {"galaxy/miniflux"})
+        self.assertEqual(tag_role_index["install-gitea"], {"galaxy/gitea"})
+        self.assertEqual(tag_role_index["always"], {"mash/playbook_base"})
+        self.assertEqual(tag_role_index["start-group"], {"galaxy/systemd_service_manager"})
+
+    def test_missing_roles(self):
+        """Test that roles which are not installed are reported, as their tags are unknown."""
+        _, missing_role_directory_paths = build_tag_role_index(
+            SETUP_YML + "    - role: galaxy/forgejo\n", self.roles_path
+        )
+
+        self.assertEqual(missing_role_directory_paths, [os.path.join(self.roles_path, "galaxy/forgejo")])
+
+    def test_selected_roles(self):
+        """Test that roles with `always` tasks are selected whatever the tags."""
+        tag_role_index, _ = build_tag_role_index(SETUP_YML, self.roles_path)
+
+        self.assertEqual(
+            select_roles_for_tags(["install-miniflux", "start-group"], tag_role_index),
+            {"galaxy/miniflux", "galaxy/systemd_service_manager", "mash/playbook_base"}
+        )
+
+
+class TestMinimalPlaybook(RolesDirectoryTestCase):
+    """Test suite for generating a playbook with only some of the roles."""
+
+    def test_roles_providing_variables_are_kept(self):
+        """Test that roles whose defaults group vars used by the selected roles refer to are kept."""
+        role_references = find_roles_providing_variables(
+            {"galaxy/miniflux"}, SETUP_YML, [MINIMAL_GROUP_VARS], self.roles_path
+        )
+
+        self.assertEqual(role_references, {"galaxy/miniflux", "galaxy/postgres", "mash/playbook_base"})
+
+    def test_roles_providing_variables_transitively(self):
+        """Test that variables are followed through group vars, host vars and the defaults of kept roles."""
+        group_vars = MINIMAL_GROUP_VARS + "devture_systemd_service_manager_services_list: \"{{ services_list }}\"\n"
+        host_vars = "services_list:\n  - \"{{ gitea_identifier }}\"\n"
+
+        role_references = find_roles_providing_variables(
+            {"galaxy/systemd_service_manager"}, SETUP_YML, [group_vars, host_vars], self.roles_path
+        )
+
+        self.assertEqual(role_references, {"galaxy/systemd_service_manager", "galaxy/gitea", "mash/playbook_base"})
+
+    def test_generated_playbook(self):
+        """Test that only the given roles and local roles are kept, without their template markers and comments."""
+        contents = generate_minimal_playbook(SETUP_YML, {"galaxy/miniflux", "galaxy/postgres"})
+
+        self.assertEqual(contents, """---
+- name: "Set up a self-hosted server"
+  hosts: "{{ target if target is defined else 'mash_servers' }}"
+  become: true
+
+  roles:
+
+    # No role-specific checks here. Local roles are always installed.
+    - role: mash/playbook_base
+
+    - role: galaxy/postgres
+
+    - role: galaxy/miniflux
+
+""")
+
+
+GUARDED_SETUP_YML = """---
+- name: "Set up a self-hosted server"
+  hosts: "{{ target if target is defined else 'mash_servers' }}"
+  become: true
+
+  roles:
+    - role: mash/playbook_base
+
+    - when: postgres_enabled | bool
+      role: galaxy/postgres
+
+    - role: galaxy/miniflux
+      when: miniflux_enabled | bool
+
+    # Gitea comes last
+    - when: gitea_enabled
+      role: galaxy/gitea
+"""
+
+
+class TestPlaysPerHost(RolesDirectoryTestCase):
+    """Test suite for specializing setup.yml plays per host."""
+
+    def specialize(self, host_vars_by_host_name):
+        return specialize_setup_yml_per_host(
+            GUARDED_SETUP_YML, host_vars_by_host_name, [MINIMAL_GROUP_VARS], self.roles_path
+        )
+
+    def test_statically_disabled_roles_are_dropped(self):
+        """Test that hosts disabling the same roles share a play, which the other hosts are excluded from."""
+        contents = self.specialize({
+            "b.example.com": {"gitea_enabled": 0},
+            "a.example.com": {"gitea_enabled": False, "miniflux_enabled": True},
+            "c.example.com": {"postgres_enabled": "no", "miniflux_enabled": "false", "gitea_enabled": True},
+            "d.example.com": {"gitea_enabled": "{{ gitea_wanted }}"}
+        })
+
+        self.assertEqual(contents, """---
+- name: "Set up a self-hosted server"
+  hosts: "{{ target if target is defined else 'mash_servers' }}:!~^(a\\\\.example\\\\.com|c\\\\.example\\\\.com)$"
+  become: true
+
+  roles:
+    - role: mash/playbook_base
+
+    - when: postgres_enabled | bool
+      role: galaxy/postgres
+
+    - role: galaxy/miniflux
+      when: miniflux_enabled | bool
+
+    # Gitea comes last
+    - when: gitea_enabled
+      role: galaxy/gitea
+
+- name: "Set up a self-hosted server"
+  hosts: "{{ target if target is defined else 'mash_servers' }}:&~^(a\\\\.example\\\\.com)$"
+  become: true
+
+  roles:
+    - role: mash/playbook_base
+
+    - when: postgres_enabled | bool
+      role: galaxy/postgres
+
+    - role: galaxy/miniflux
+      when: miniflux_enabled | bool
+
+- name: "Set up a self-hosted server"
+  hosts: "{{ target if target is defined else 'mash_servers' }}:&~^(c\\\\.example\\\\.com)$"
+  become: true
+
+  roles:
+    - role: mash/playbook_base
+
+    # Gitea comes last
+    - when: gitea_enabled
+      role: galaxy/gitea
+""")
+
+    def test_roles_providing_variables_are_kept(self):
+        """Test that a disabled role stays (with its defaults) when the host's other roles need its variables."""
+        host_vars_by_host_name = {"a.example.com": {"postgres_enabled": False, "miniflux_enabled": True}}
+
+        self.assertEqual(self.specialize(host_vars_by_host_name), GUARDED_SETUP_YML)
+
+    def test_host_names_from_vars_paths(self):
+        """Test that host names come from host_vars files and directories, and that group_vars are ignored."""
+        self.assertEqual(get_host_name_from_vars_path("/inventory/host_vars/mash.example.com/vars.yml"), "mash.example.com")
+        self.assertEqual(get_host_name_from_vars_path("/inventory/host_vars/mash.example.com/sub/vault.yml"), "mash.example.com")
+        self.assertEqual(get_host_name_from_vars_path("/inventory/host_vars/mash.example.com.yml"), "mash.example.com")
+        self.assertEqual(get_host_name_from_vars_path("/inventory/host_vars/mash.example.com"), "mash.example.com")
+        self.assertIsNone(get_host_name_from_vars_path("/inventory/group_vars/mash_servers.yml"))
+
+
+REQUIREMENTS_YML = """---
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-miniflux.git
+  version: v2.2.1-0
+  name: miniflux
+
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-gitea.git
+  version: v1.22.0-0
+  name: gitea
+
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-postgres.git
+  version: v16.0-0
+
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-gitea.git
+  version: v1.22.0-0
+  name: gitea
+"""
+
+VALIDATED_SETUP_YML = """---
+- hosts: mash_servers
+  roles:
+    # role-specific:miniflux
+    - role: galaxy/miniflux
+    # /role-specific:miniflux
+
+    # role-specific:forgejo
+    - role: galaxy/forgejo
+    # /role-specific:forgejo
+
+    # role-specific:miniflux
+    # role-specific:gitea
+    - role: galaxy/gitea
+    # /role-specific:miniflux
+
+    # /role-specific:gitea
+"""
+
+
+class TestValidateTemplates(unittest.TestCase):
+    """Test suite for reporting all template problems, with their line numbers."""
+
+    def validate(self, contents):
+        problems, _ = validate_template_contents("setup.yml", contents, {"miniflux", "gitea"})
+        return problems
+
+    def test_problems_have_line_numbers(self):
+        """Test that every kind of block problem is reported on the line it is about."""
+        self.assertEqual(self.validate(VALIDATED_SETUP_YML), [
+            (8, "start block for unknown role forgejo"),
+            (10, "end block for unknown role forgejo"),
+            (13, "start block for role gitea is not closed before the end block for role miniflux (line 15)"),
+            (17, "end block for role gitea without a start block"),
+        ])
+
+    def test_mismatched_and_unclosed_blocks(self):
+        """Test typos in end blocks, and start blocks left open at the end of the file."""
+        contents = "# role-specific:miniflux\n# /role-specific:gitea\n# role-specific:gitea\n"
+
+        self.assertEqual(self.validate(contents), [
+            (2, "end block for role gitea, but the last start block was for role miniflux (line 1)"),
+            (3, "start block for role gitea is never closed"),
+        ])
+
+    def test_agrees_with_processing(self):
+        """Test that contents which processing rejects are reported by validation, and valid contents are not."""
+        for contents in [
+            "# role-specific:miniflux\n# /role-specific:gitea\n",
+            "# role-specific:miniflux\n",
+            "# /role-specific:miniflux\n",
+            "# role-specific:forgejo\n# /role-specific:forgejo\n",
+            "# role-specific:miniflux\n# role-specific:gitea\n# /role-specific:gitea\n# /role-specific:miniflux\n",
+        ]:
+            with self.subTest(contents=contents):
+                try:
+                    process_file_contents("setup.yml", set(), {"miniflux", "gitea"}, contents=contents)
+                    processing_failed = False
+                except Exception:
+                    processing_failed = True
+                self.assertEqual(len(self.validate(contents)) > 0, processing_failed)
+
+    def test_requirements_problems(self):
+        """Test that nameless, duplicate and unused role definitions are reported with requirements.yml line numbers."""
+        source_contents = {
+            "requirements.yml": REQUIREMENTS_YML,
+            "setup.yml": "- hosts: all\n  roles:\n    - role: galaxy/miniflux\n",
+            "group_vars": "",
+        }
+
+        self.assertEqual(validate_templates("requirements.yml", "setup.yml", "group_vars", source_contents), [
+            "requirements.yml:10: role definition without a name",
+            "requirements.yml:13: role gitea is already defined on line 6",
+            "requirements.yml:6: role gitea is not used in setup.yml",
+        ])
+
+    def test_repository_templates_are_valid(self):
+        """Test that `optimize.py --validate` accepts the templates of the repository."""
+        result = subprocess.run([
+            sys.executable, SCRIPT_PATH, '--validate',
+            '--src-requirements-yml-path', os.path.join(TEMPLATES_PATH, 'requirements.yml'),
+            '--src-setup-yml-path', os.path.join(TEMPLATES_PATH, 'setup.yml'),
+            '--src-group-vars-yml-path', os.path.join(TEMPLATES_PATH, 'group_vars_mash_servers'),
+        ], capture_output=True, text=True)
+
+        self.assertEqual((result.returncode, result.stderr), (0, ""))
+
+
+SLICED_REQUIREMENTS_YML = """---
+# Comments at the top stay
+
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-miniflux.git
+  version: v2.2.1-0
+  name: miniflux
+
+# Gitea is pinned until the next migration
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-gitea.git
+  version: v1.22.0-0
+  name: gitea
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-postgres.git
+  version: "v16.0-0"
+  name: 'postgres'
+
+"""
+
+
+class TestFilterRequirementsYml(unittest.TestCase):
+    """Test suite for slicing the enabled role definitions out of requirements.yml."""
+
+    def filter(self, contents, enabled_role_names):
+        return filter_requirements_yml_contents(contents, yaml.safe_load(contents), enabled_role_names)
+
+    def test_definitions_are_sliced_verbatim(self):
+        """Test that enabled definitions keep their formatting and the comments above them, in source order."""
+        self.assertEqual(self.filter(SLICED_REQUIREMENTS_YML, {"postgres", "gitea"}), """---
+# Comments at the top stay
+
+# Gitea is pinned until the next migration
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-gitea.git
+  version: v1.22.0-0
+  name: gitea
+- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-postgres.git
+  version: "v16.0-0"
+  name: 'postgres'
+""")
+
+    def test_same_data_as_yaml_dump(self):
+        """Test that slicing the repository's template gives the same data as serializing the definitions."""
+        with open(os.path.join(TEMPLATES_PATH, 'requirements.yml')) as file:
+            contents = file.read()
+        all_role_definitions = yaml.safe_load(contents)
+        role_names = [definition["name"] for definition in all_role_definitions]
+
+        for enabled_role_names in [set(role_names), set(role_names[::7]), {role_names[-1]}]:
+            with self.subTest(count=len(enabled_role_names)):
+                expected = [definition for definition in all_role_definitions if definition["name"] in enabled_role_names]
+                self.assertEqual(
+                    yaml.safe_load(filter_requirements_yml_contents(contents, all_role_definitions, enabled_role_names)),
+                    expected
+                )
+
+    def test_fallbacks_to_yaml_dump(self):
+        """Test that layouts which can't be matched to the definitions, and empty selections, are serialized instead."""
+        flow_style_contents = "[{src: a.git, name: a}, {src: b.git, name: b}]\n"
+
+        self.assertEqual(self.filter(flow_style_contents, {"b"}), "- name: b\n  src: b.git\n")
+        self.assertEqual(self.filter(SLICED_REQUIREMENTS_YML, set()), "[]\n")
+
+
+ACTIVATION_ROLE_DEFINITIONS = [
+    {"name": "playbook_help", "activation_prefix": ""},
+    {"name": "miniflux", "activation_prefix": "miniflux_"},
+    {"name": "matrix", "activation_prefix": "matrix_"},
+    {"name": "matrix_bridge", "activation_prefix": "matrix_bridge_"},
+    {"name": "matrix_bot", "activation_prefix": "matrix_bot_"},
+    {"name": "gitea", "activation_prefix": "gitea_"},
+    {"name": "manual"},
+]
+
+ACTIVATION_VARIABLE_FILES_BY_NAME = {
+    "miniflux_enabled": ["host_vars/a/vars.yml", "host_vars/b/vars.yml"],
+    "miniflux_hostname": ["host_vars/a/vars.yml"],
+    "matrix_bridge_enabled": ["group_vars/all.yml"],
+    "mash_playbook_generic_secret_key": ["host_vars/a/vars.yml"],
+}
+
+
+def is_role_definition_in_use(role_definition, used_variable_names):
+    """The per-role scan the activation index replaced."""
+    for variable_name in used_variable_names:
+        if "activation_prefix" in role_definition:
+            if role_definition["activation_prefix"] == "":
+                return True
+            if variable_name.startswith(role_definition["activation_prefix"]):
+                return True
+    return False
+
+
+class TestActivation(unittest.TestCase):
+    """Test suite for finding which roles are enabled, and why."""
+
+    def test_same_roles_as_scanning(self):
+        """Test that the index enables exactly the roles which scanning all variables for each role did."""
+        activation_index = build_activation_index(ACTIVATION_ROLE_DEFINITIONS, ACTIVATION_VARIABLE_FILES_BY_NAME.keys())
+
+        self.assertEqual(
+            set(activation_index.keys()),
+            set(
+                definition["name"] for definition in ACTIVATION_ROLE_DEFINITIONS
+                if is_role_definition_in_use(definition, ACTIVATION_VARIABLE_FILES_BY_NAME.keys())
+            )
+        )
+        self.assertEqual(activation_index, {
+            "playbook_help": [],
+            "miniflux": ["miniflux_enabled", "miniflux_hostname"],
+            "matrix": ["matrix_bridge_enabled"],
+            "matrix_bridge": ["matrix_bridge_enabled"],
+        })
+
+    def test_overlapping_prefixes(self):
+        """Test that every prefix which is a prefix of another role's one is found, including non-adjacent ones."""
+        overlaps = find_overlapping_activation_prefixes(ACTIVATION_ROLE_DEFINITIONS)
+
+        self.assertEqual(
+            [(definition["name"], other_definition["name"]) for definition, other_definition in overlaps],
+            [("matrix", "matrix_bot"), ("matrix", "matrix_bridge")]
+        )
+
+    def test_report(self):
+        """Test the variables and files each enabled role is reported with, and the formatted table."""
+        activation_index = build_activation_index(ACTIVATION_ROLE_DEFINITIONS, ACTIVATION_VARIABLE_FILES_BY_NAME.keys())
+        report = build_activation_report(ACTIVATION_ROLE_DEFINITIONS, activation_index, ACTIVATION_VARIABLE_FILES_BY_NAME)
+
+        self.assertEqual(report["enabled_roles"][1], {
+            "name": "miniflux",
+            "activation_prefix": "miniflux_",
+            "variables": [
+                {"name": "miniflux_enabled", "files": ["host_vars/a/vars.yml", "host_vars/b/vars.yml"]},
+                {"name": "miniflux_hostname", "files": ["host_vars/a/vars.yml"]},
+            ],
+        })
+        self.assertEqual(format_activation_report(report).split("\n"), [
+            "ROLE           PREFIX          VARIABLE               FILES",
+            "playbook_help  \"\"              (always enabled)",
+            "miniflux       miniflux_       miniflux_enabled       host_vars/a/vars.yml, host_vars/b/vars.yml",
+            "                               miniflux_hostname      host_vars/a/vars.yml",
+            "matrix         matrix_         matrix_bridge_enabled  group_vars/all.yml",
+            "matrix_bridge  matrix_bridge_  matrix_bridge_enabled  group_vars/all.yml",
+            "",
+            "Overlapping activation prefixes (variables of the second role also enable the first one):",
+            "- matrix (matrix_) overlaps matrix_bot (matrix_bot_)",
+            "- matrix (matrix_) overlaps matrix_bridge (matrix_bridge_)",
+        ])
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
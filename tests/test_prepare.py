@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the preparation of template-derived files (bin/prepare.py),
+checked against the shell recipe (`_ensure_file_prepared`) it replaced.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+import optimize
+import prepare
+
+# The former `_ensure_file_prepared` justfile recipe, with re-optimizing replaced by a marker file
+ENSURE_FILE_PREPARED_SCRIPT = """
+src_path="$1"
+dst_path="$2"
+run_directory_path="$3"
+optimization_vars_files_file_path="$4"
+optimized_marker_path="$5"
+
+dst_file_name=$(basename "$dst_path")
+hash_path=$run_directory_path"/"$dst_file_name".srchash"
+src_hash=$(md5sum $src_path | cut -d ' ' -f 1)
+
+if [ ! -f "$dst_path" ] || [ ! -f "$hash_path" ]; then
+    cp $src_path $dst_path
+    echo $src_hash > $hash_path
+else
+    current_hash=$(cat $hash_path)
+
+    if [ "$current_hash" != "$src_hash" ]; then
+        cp $src_path $dst_path
+        echo $src_hash > $hash_path
+
+        if [ -f "$optimization_vars_files_file_path" ]; then
+            touch $optimized_marker_path
+        fi
+    fi
+fi
+"""
+
+TEMPLATE_CONTENTS = {
+    "requirements.yml": "- src: git+https://github.com/mother-of-all-self-hosting/ansible-role-miniflux.git\n",
+    "setup.yml": "- name: Set up a server\n  hosts: mash_servers\n",
+    "group_vars/mash_servers": "mash_playbook_generic_secret_key: ''\n",
+}
+
+OLD_HASH = "0123456789abcdef0123456789abcdef"
+
+
+class PreparedTreeTestCase(unittest.TestCase):
+    """Points prepare.py at templates, derived files and a run directory in a temporary directory."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root_path = self.temp_dir.name
+        self.run_path = os.path.join(self.root_path, 'run')
+        os.makedirs(os.path.join(self.root_path, 'templates'))
+        os.makedirs(os.path.join(self.root_path, 'group_vars'))
+        os.makedirs(self.run_path)
+
+        self.derived_files = {}
+        for name, contents in TEMPLATE_CONTENTS.items():
+            src_path = os.path.join(self.root_path, 'templates', name.replace('/', '_'))
+            with open(src_path, 'w') as file:
+                file.write(contents)
+            self.derived_files[name] = (src_path, os.path.join(self.root_path, name))
+
+        self.vars_state_path = os.path.join(self.run_path, 'optimization-vars-files.state')
+        for patcher in [
+            mock.patch.object(prepare, 'template_derived_files', self.derived_files),
+            mock.patch.object(prepare, 'run_directory_path', self.run_path),
+            mock.patch.object(prepare, 'optimization_vars_files_file_path', self.vars_state_path),
+            mock.patch.object(prepare, 'activation_report_file_path', os.path.join(self.run_path, 'report.json')),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self, path):
+        if not os.path.isfile(path):
+            return None
+        with open(path) as file:
+            return file.read()
+
+    def write(self, path, contents):
+        with open(path, 'w') as file:
+            file.write(contents)
+
+    def get_hash_path(self, name):
+        return prepare.get_hash_path(self.derived_files[name][1])
+
+    def md5sum(self, path):
+        """Returns the hash the way the shell recipes computed it."""
+        result = subprocess.run(['md5sum', path], capture_output=True, text=True, check=True)
+        return result.stdout.split(' ')[0]
+
+
+class TestPrepareFiles(PreparedTreeTestCase):
+    """Test suite for refreshing derived files when their templates change."""
+
+    # Initial state of each derived file => how it is set up
+    STATES = ["missing", "missing_hash", "up_to_date", "up_to_date_locally_modified", "stale", "stale_locally_modified"]
+
+    def set_up_state(self, name, state, optimized):
+        src_path, dst_path = self.derived_files[name]
+        hash_path = self.get_hash_path(name)
+        for path in [dst_path, hash_path]:
+            if os.path.exists(path):
+                os.unlink(path)
+        if optimized:
+            self.write(self.vars_state_path, "/inventory/host_vars/mash.example.com/vars.yml\n")
+        elif os.path.exists(self.vars_state_path):
+            os.unlink(self.vars_state_path)
+
+        if state == "missing":
+            return
+        self.write(dst_path, "local changes\n" if state.endswith("locally_modified") else TEMPLATE_CONTENTS[name])
+        if state == "missing_hash":
+            return
+        self.write(hash_path, (OLD_HASH if state.startswith("stale") else self.md5sum(src_path)) + "\n")
+
+    def get_state(self, name):
+        _, dst_path = self.derived_files[name]
+        return self.read(dst_path), self.read(self.get_hash_path(name))
+
+    def run_old_recipe(self, name):
+        """Returns (derived file contents, hash file contents, whether the playbook got re-optimized)."""
+        src_path, dst_path = self.derived_files[name]
+        optimized_marker_path = os.path.join(self.root_path, 'optimized')
+        subprocess.run(
+            ['sh', '-c', ENSURE_FILE_PREPARED_SCRIPT, 'sh', src_path, dst_path, self.run_path,
+             self.vars_state_path, optimized_marker_path],
+            check=True
+        )
+        optimized = os.path.exists(optimized_marker_path)
+        if optimized:
+            os.unlink(optimized_marker_path)
+        return self.get_state(name) + (optimized,)
+
+    def run_prepare_files(self, name):
+        with mock.patch.object(prepare, 'optimize_for_vars_paths') as optimize_for_vars_paths:
+            prepare.prepare_files([name])
+        return self.get_state(name) + (optimize_for_vars_paths.called,)
+
+    def test_same_behavior_as_shell_recipe(self):
+        """Test that derived files, hash files and re-optimizing match the former shell recipe in every state."""
+        for name in TEMPLATE_CONTENTS:
+            for state in self.STATES:
+                for optimized in [False, True]:
+                    with self.subTest(name=name, state=state, optimized=optimized):
+                        self.set_up_state(name, state, optimized)
+                        expected = self.run_old_recipe(name)
+                        self.set_up_state(name, state, optimized)
+                        self.assertEqual(self.run_prepare_files(name), expected)
+
+    def test_hashes_match_md5sum(self):
+        """Test that hash files hold what `md5sum | cut` wrote, so that existing run/ directories stay valid."""
+        prepare.prepare_files(list(TEMPLATE_CONTENTS.keys()))
+
+        for name, (src_path, _) in self.derived_files.items():
+            self.assertEqual(self.read(self.get_hash_path(name)), self.md5sum(src_path) + "\n")
+
+    def test_optimizes_once_for_all_changed_files(self):
+        """Test that re-optimizing happens once, with the remembered vars.yml paths, however many templates changed."""
+        for name in TEMPLATE_CONTENTS:
+            self.set_up_state(name, "stale", optimized=True)
+
+        with mock.patch.object(prepare, 'optimize_for_vars_paths') as optimize_for_vars_paths:
+            prepare.prepare_files(list(TEMPLATE_CONTENTS.keys()))
+
+        optimize_for_vars_paths.assert_called_once()
+        self.assertEqual(optimize_for_vars_paths.call_args[0][0], ["/inventory/host_vars/mash.example.com/vars.yml"])
+
+
+class TestOptimizeForVarsPaths(PreparedTreeTestCase):
+    """Test suite for remembering optimization state."""
+
+    def test_saves_vars_paths_and_hashes(self):
+        """Test that vars.yml paths and the hashes of all templates are saved, like `_optimize-for-var-paths` did."""
+        vars_paths = ["/inventory/host_vars/a/vars.yml", "/inventory/host_vars/b/vars.yml"]
+
+        with mock.patch.object(optimize, 'optimize_playbook') as optimize_playbook:
+            prepare.optimize_for_vars_paths(vars_paths)
+
+        optimize_playbook.assert_called_once()
+        self.assertEqual(self.read(self.vars_state_path), " ".join(vars_paths) + "\n")
+        for name, (src_path, _) in self.derived_files.items():
+            self.assertEqual(self.read(self.get_hash_path(name)), self.md5sum(src_path) + "\n")
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the role defaults scanner (bin/roles_scanner.py) shared by feeds.py and versions.py.
+"""
+
+import json
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+import roles_scanner
+from roles_scanner import (
+    extract_role_defaults_metadata_many, extract_versions, extract_versions_fast, iter_defaults_files,
+    scan_role_defaults, to_cacheable_value
+)
+
+MINIFLUX_DEFAULTS = """---
+# Project source code URL: https://github.com/miniflux/v2
+miniflux_enabled: true
+miniflux_version: 2.2.1
+"""
+
+GITEA_DEFAULTS = """---
+# Project source code URL: https://github.com/go-gitea/gitea
+gitea_version: "1.22.0"
+"""
+
+
+class RolesTreeTestCase(unittest.TestCase):
+    """Creates a roles tree in a temporary directory."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root_path = self.temp_dir.name
+        self.cache_path = os.path.join(self.root_path, 'var', 'roles-scanner-cache.json')
+        self.write_defaults('miniflux', MINIFLUX_DEFAULTS)
+        self.write_defaults('gitea', GITEA_DEFAULTS)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_defaults_path(self, role_name):
+        return os.path.join(self.root_path, 'roles', 'galaxy', role_name, 'defaults', 'main.yml')
+
+    def write_defaults(self, role_name, contents):
+        path = self.get_defaults_path(role_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(contents)
+        return path
+
+    def scan(self, **kwargs):
+        """Scans the tree (without worker processes) and returns (results, contents which had to be parsed)."""
+        parsed_contents = []
+        extract = roles_scanner.extract_role_defaults_metadata_many
+
+        def counting_extract(contents_list, jobs=None, **extract_kwargs):
+            parsed_contents.extend(contents_list)
+            return extract(contents_list, jobs=1, **extract_kwargs)
+
+        with mock.patch.object(roles_scanner, 'extract_role_defaults_metadata_many', counting_extract):
+            results = scan_role_defaults(self.root_path, cache_path=self.cache_path, jobs=1, **kwargs)
+        return results, parsed_contents
+
+
+class TestScanner(RolesTreeTestCase):
+    """Test suite for walking the roles tree."""
+
+    def test_defaults_files_in_stable_order(self):
+        """Test that defaults files are found in alphabetical order, skipping pruned directories."""
+        os.makedirs(os.path.join(self.root_path, 'roles', 'galaxy', 'gitea', 'tasks', 'defaults'))
+        with open(os.path.join(self.root_path, 'roles', 'galaxy', 'gitea', 'tasks', 'defaults', 'main.yml'), 'w') as file:
+            file.write("ignored_version: 1\n")
+
+        self.assertEqual(list(iter_defaults_files(self.root_path)), [
+            self.get_defaults_path('gitea'),
+            self.get_defaults_path('miniflux')
+        ])
+
+    def test_metadata(self):
+        """Test that source URLs and versions are extracted."""
+        results, _ = self.scan()
+
+        self.assertEqual(results[1], {
+            "path": self.get_defaults_path('miniflux'),
+            "source_urls": ["https://github.com/miniflux/v2"],
+            "versions": {"miniflux_version": "2.2.1"}
+        })
+
+
+    def test_only_requested_metadata_is_extracted(self):
+        """Test that source URLs are found without extracting versions (which may need a full YAML parse)."""
+        with mock.patch.object(roles_scanner, 'extract_versions') as extract_versions:
+            results, _ = self.scan(extract=("source_urls",))
+
+        extract_versions.assert_not_called()
+        self.assertEqual(results[1], {
+            "path": self.get_defaults_path('miniflux'),
+            "source_urls": ["https://github.com/miniflux/v2"]
+        })
+
+
+class TestScannerCache(RolesTreeTestCase):
+    """Test suite for the on-disk metadata cache."""
+
+    def test_unchanged_files_are_not_parsed(self):
+        """Test that a second scan reuses all cached entries, with identical results."""
+        first_results, first_parsed = self.scan()
+        second_results, second_parsed = self.scan()
+
+        self.assertEqual(len(first_parsed), 2)
+        self.assertEqual(second_parsed, [])
+        self.assertEqual(second_results, first_results)
+
+    def test_touched_files_are_not_parsed(self):
+        """Test that a new mtime with the same contents (e.g. after a fresh clone) only refreshes the entry."""
+        self.scan()
+        path = self.get_defaults_path('miniflux')
+        os.utime(path, ns=(0, 1000000000))
+
+        _, parsed = self.scan()
+
+        self.assertEqual(parsed, [])
+        with open(self.cache_path) as file:
+            entries = json.load(file)["entries"]
+        self.assertEqual(entries[os.path.abspath(path)]["mtime_ns"], 1000000000)
+
+    def test_changed_files_are_parsed(self):
+        """Test that files whose size or contents changed are parsed again."""
+        self.scan()
+        self.write_defaults('miniflux', MINIFLUX_DEFAULTS.replace("2.2.1", "2.2.10"))
+        path = self.write_defaults('gitea', GITEA_DEFAULTS.replace("1.22.0", "1.23.0"))
+        # Same size, so only the content hash tells the change apart
+        os.utime(path, ns=(0, 1000000000))
+
+        results, parsed = self.scan()
+
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(results[0]["versions"], {"gitea_version": "1.23.0"})
+        self.assertEqual(results[1]["versions"], {"miniflux_version": "2.2.10"})
+
+    def test_missing_metadata_is_extracted_later(self):
+        """Test that metadata another consumer didn't need is extracted on demand, and both kinds are then cached."""
+        self.scan(extract=("source_urls",))
+
+        with mock.patch.object(roles_scanner, 'extract_source_urls') as extract_source_urls:
+            results, parsed = self.scan(extract=("versions",))
+        extract_source_urls.assert_not_called()
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(results[1], {
+            "path": self.get_defaults_path('miniflux'),
+            "versions": {"miniflux_version": "2.2.1"}
+        })
+
+        results, parsed = self.scan()
+        self.assertEqual(parsed, [])
+        self.assertEqual(results[1]["source_urls"], ["https://github.com/miniflux/v2"])
+
+    def test_removed_files_are_evicted(self):
+        """Test that the cache only keeps entries for existing files."""
+        self.scan()
+        os.unlink(self.get_defaults_path('gitea'))
+        self.scan()
+
+        with open(self.cache_path) as file:
+            entries = json.load(file)["entries"]
+        self.assertEqual(list(entries.keys()), [os.path.abspath(self.get_defaults_path('miniflux'))])
+
+    def test_roots_share_the_cache(self):
+        """Test that scanning another root keeps the entries of the first one, and vice versa."""
+        other_root_path = os.path.join(self.root_path, 'other')
+        other_path = os.path.join(other_root_path, 'roles', 'galaxy', 'homarr', 'defaults', 'main.yml')
+        os.makedirs(os.path.dirname(other_path))
+        with open(other_path, 'w') as file:
+            file.write("homarr_version: 1.0.0\n")
+
+        scan_role_defaults(other_root_path, cache_path=self.cache_path, jobs=1)
+        self.scan(excluded_paths=[os.path.dirname(other_path)])
+        _, parsed = self.scan(excluded_paths=[os.path.dirname(other_path)])
+        os.unlink(self.get_defaults_path('gitea'))
+        scan_role_defaults(other_root_path, cache_path=self.cache_path, jobs=1)
+
+        self.assertEqual(parsed, [])
+        with open(self.cache_path) as file:
+            entries = json.load(file)["entries"]
+        # Entries of files which are gone are dropped whichever root is scanned
+        self.assertEqual(set(entries.keys()), set(os.path.abspath(path) for path in [
+            other_path, self.get_defaults_path('miniflux')
+        ]))
+
+    def test_cache_of_another_format_is_ignored(self):
+        """Test that a cache written by another version of the scanner is not used."""
+        self.scan()
+        with open(self.cache_path) as file:
+            cache = json.load(file)
+        cache["version"] = roles_scanner.cache_format_version + 1
+        with open(self.cache_path, 'w') as file:
+            json.dump(cache, file)
+
+        _, parsed = self.scan()
+
+        self.assertEqual(len(parsed), 2)
+
+    def test_cache_file_mode_follows_umask(self):
+        """Test that the cache file is created like any other file, not only readable by its owner."""
+        umask = os.umask(0o022)
+        try:
+            self.scan()
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_path).st_mode), 0o644)
+
+
+def extract_versions_slow(contents):
+    """Extracts top-level `*_version` variables the reference way: with a full YAML parse."""
+    data = yaml.safe_load(contents)
+    if not isinstance(data, dict):
+        return {}
+    return {
+        key: to_cacheable_value(value)
+        for key, value in data.items()
+        if isinstance(key, str) and key.endswith("_version")
+    }
+
+
+class TestVersionsFastPath(unittest.TestCase):
+    """Test suite for the line-based fast path, which must agree with yaml.safe_load."""
+
+    # Handled by the fast path
+    SIMPLE_DOCUMENTS = [
+        "miniflux_version: 2.2.1\n",
+        "---\n# comment\nx_version: v1.0 # trailing comment\nother: value\n",
+        "a_version: \"1.0\"\nb_version: '2.0'\n",
+        "int_version: 3\nfloat_version: 1.10\nbool_version: yes\n",
+        "date_version: 2024-01-01\n",
+        "image_version: \"{{ x_container_image_tag }}\"\n",
+        "nested:\n  inner_version: 1\nx_version: 1\n",
+        "x_version: 1\nx_version: 2\n",
+        "list:\n  - a\n  - b\ny_version: 1.0.0-rc.1\n",
+        "x_var: \"a: b\"\nx_version: latest\n",
+    ]
+
+    # Must fall back to a full parse
+    COMPLEX_DOCUMENTS = [
+        "x_version: >\n  1.0\n",
+        "null_version: ~\n",
+        "empty_version:\nnested: 1\n",
+        "x_version: &anchor 1.0\ny_version: *anchor\n",
+        "x_version:\n  - 1\n",
+        "\"quoted_version\": 1\n",
+        "x_version: [1, 2]\n",
+        "x_version : 1\n",
+        "x_var: \"multi\n  line\"\ny_version: 1\n",
+        "x_version: !!str 1.0\n",
+    ]
+
+    def test_fast_path_matches_yaml(self):
+        """Test that documents handled by the fast path give the same versions as yaml.safe_load."""
+        for contents in self.SIMPLE_DOCUMENTS:
+            with self.subTest(contents=contents):
+                versions = extract_versions_fast(contents)
+                self.assertIsNotNone(versions)
+                self.assertEqual(versions, extract_versions_slow(contents))
+
+    def test_complex_documents_fall_back(self):
+        """Test that constructs the fast path can't handle exactly are left to yaml.safe_load."""
+        for contents in self.COMPLEX_DOCUMENTS:
+            with self.subTest(contents=contents):
+                self.assertIsNone(extract_versions_fast(contents))
+                self.assertEqual(extract_versions(contents), extract_versions_slow(contents))
+
+    def test_repository_defaults_parity(self):
+        """Test that all defaults files of the repository give the same versions as yaml.safe_load."""
+        root_path = os.path.join(os.path.dirname(__file__), '..')
+        for path in iter_defaults_files(root_path):
+            with open(path) as file:
+                contents = file.read()
+            with self.subTest(path=path):
+                self.assertEqual(extract_versions(contents), extract_versions_slow(contents))
+
+    def test_parallel_results_are_in_order(self):
+        """Test that parsing on a process pool returns results in submission order."""
+        contents_list = ["x{0}_version: {0}.0.1\n".format(idx) for idx in range(40)]
+
+        results = extract_role_defaults_metadata_many(contents_list, jobs=2)
+
+        self.assertEqual(
+            [result["versions"] for result in results],
+            [{"x{0}_version".format(idx): "{0}.0.1".format(idx)} for idx in range(40)]
+        )
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the offline route-matching simulator (bin/simulate_traefik_routes.py).
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+from discover_traefik_labels import build_route_index, process_inspections
+from simulate_traefik_routes import (
+    benchmark, format_simulation, generate_rules, load_snapshot, parse_request, simulate_requests
+)
+
+MINIFLUX_LABELS = [
+    "traefik.enable=true",
+    "traefik.http.routers.mash-miniflux.rule=Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)",
+    "traefik.http.services.mash-miniflux.loadbalancer.server.port=8080"
+]
+
+HOMEPAGE_LABELS = [
+    "traefik.enable=true",
+    "traefik.http.routers.mash-homepage.rule=Host(`homelab.cy-bert.fr`) && !PathPrefix(`/admin`)",
+    "traefik.http.services.mash-homepage.loadbalancer.server.port=3000"
+]
+
+
+class TestRouteSimulator(unittest.TestCase):
+    """Test suite for simulating requests against a discovery snapshot."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.temp_dir.name, 'snapshot.json')
+        with open(self.snapshot_path, 'w') as file:
+            json.dump({
+                "vm107": {"containers": [
+                    {"id": "a", "name": "miniflux", "labels": MINIFLUX_LABELS},
+                    {"id": "b", "name": "homepage", "labels": HOMEPAGE_LABELS}
+                ]},
+                "vm106": {"containers": [{"id": "a", "name": "miniflux", "labels": MINIFLUX_LABELS}]}
+            }, file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def simulate(self, requests):
+        updates = process_inspections(load_snapshot(self.snapshot_path), gateway_mode="passthrough")
+        index, backends, errors = build_route_index(updates)
+        self.assertEqual(errors, [])
+        return [format_simulation(*simulation) for simulation in simulate_requests(index, backends, requests)]
+
+    def test_requests_are_routed_like_on_the_gateway(self):
+        """Test that requests get the router, service and hosts the Gateway would use."""
+        self.assertEqual(self.simulate([("homelab.cy-bert.fr", "/miniflux/feeds"), ("other.fr", "/")]), [
+            "homelab.cy-bert.fr\t/miniflux/feeds\tminiflux\thomelab-traefik-miniflux\tvm106,vm107",
+            "other.fr\t/\tno router"
+        ])
+
+    def test_conditional_routes_are_reported(self):
+        """Test that routes depending on other matchers are mentioned rather than picked."""
+        self.assertEqual(self.simulate([("homelab.cy-bert.fr", "/about")]), [
+            "homelab.cy-bert.fr\t/about\tno router\t(may match homepage)"
+        ])
+
+    def test_raw_inspection_outputs_are_decoded(self):
+        """Test that raw inspect-docker.sh outputs, with their labels table, are accepted as snapshot entries."""
+        with open(self.snapshot_path, 'w') as file:
+            json.dump({
+                "vm107": {
+                    "labels": MINIFLUX_LABELS + HOMEPAGE_LABELS,
+                    "containers": [
+                        {"id": "a", "name": "miniflux", "labels": [0, 1, 2]},
+                        {"id": "b", "name": "homepage", "labels": [3, 4, 5]}
+                    ]
+                },
+                "vm106": {"labels": MINIFLUX_LABELS, "containers": [{"id": "a", "name": "miniflux", "labels": [0, 1, 2]}]}
+            }, file)
+
+        self.assertEqual(self.simulate([("homelab.cy-bert.fr", "/miniflux/feeds"), ("homelab.cy-bert.fr", "/about")]), [
+            "homelab.cy-bert.fr\t/miniflux/feeds\tminiflux\thomelab-traefik-miniflux\tvm106,vm107",
+            "homelab.cy-bert.fr\t/about\tno router\t(may match homepage)"
+        ])
+
+    def test_invalid_inspection_outputs_are_rejected(self):
+        """Test that undecodable snapshot entries are reported with their host."""
+        with open(self.snapshot_path, 'w') as file:
+            json.dump({"vm107": {"labels": [], "containers": [{"id": "a", "labels": [3]}]}}, file)
+
+        with self.assertRaisesRegex(ValueError, '^vm107: Invalid discovery output'):
+            load_snapshot(self.snapshot_path)
+
+    def test_parse_request(self):
+        """Test the accepted request formats."""
+        self.assertEqual(parse_request("https://homelab.cy-bert.fr/miniflux?x=1\n"), ("homelab.cy-bert.fr", "/miniflux"))
+        self.assertEqual(parse_request("https://homelab.cy-bert.fr"), ("homelab.cy-bert.fr", "/"))
+        self.assertEqual(parse_request("homelab.cy-bert.fr /miniflux"), ("homelab.cy-bert.fr", "/miniflux"))
+        self.assertEqual(parse_request("homelab.cy-bert.fr"), ("homelab.cy-bert.fr", "/"))
+        self.assertIsNone(parse_request("# comment"))
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test suite for the synthetic benchmark."""
+
+    def test_benchmark(self):
+        """Test that synthetic rule sets are indexed and mostly matched."""
+        results = benchmark(2000, 1000)
+
+        self.assertEqual(results["routers"], 2000)
+        self.assertEqual(results["requests"], 1000)
+        self.assertGreater(results["matched"], 700)
+
+    def test_generated_rules_are_deterministic(self):
+        """Test that benchmarks are comparable between runs."""
+        self.assertEqual(generate_rules(100), generate_rules(100))
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
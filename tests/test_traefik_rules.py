@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the Traefik rule parser and route index (bin/traefik_rules.py).
+"""
+
+import os
+import sys
+import unittest
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+from traefik_rules import (
+    And, Matcher, Not, Or, Route, RouteIndex, RuleSyntaxError,
+    compile_host_regexp, format_routing_report, get_rule_routes, parse_rule
+)
+
+
+class TestParseRule(unittest.TestCase):
+    """Test suite for parsing rules into an AST."""
+
+    def test_precedence(self):
+        """Test that && binds tighter than ||, and ! tighter than both."""
+        ast = parse_rule("Host(`a.com`) || Host(`b.com`) && !PathPrefix(`/admin`)")
+
+        self.assertEqual(ast, Or((
+            Matcher("Host", ("a.com",)),
+            And((Matcher("Host", ("b.com",)), Not(Matcher("PathPrefix", ("/admin",)))))
+        )))
+
+    def test_parentheses_and_quotes(self):
+        """Test grouping, double-quoted values and v2 multi-value matchers."""
+        ast = parse_rule('(Host("a.com", `b.com`) || HostRegexp(`^.+\\.c\\.com$`)) && Method(`GET`)')
+
+        self.assertEqual(ast, And((
+            Or((Matcher("Host", ("a.com", "b.com")), Matcher("HostRegexp", ("^.+\\.c\\.com$",)))),
+            Matcher("Method", ("GET",))
+        )))
+
+    def test_syntax_errors(self):
+        """Test that malformed rules raise RuleSyntaxError."""
+        for rule in ["Host(`a.com`", "Host(`a.com`) &&", "Host(a.com)", "Host(`a.com`) Path(`/`)", "Host(`a.com`) & Path(`/`)"]:
+            with self.subTest(rule=rule):
+                with self.assertRaises(RuleSyntaxError):
+                    parse_rule(rule)
+
+    def test_identical_rules_are_parsed_once(self):
+        """Test that parsing is memoized."""
+        parse_rule.cache_clear()
+        for _ in range(100):
+            parse_rule("Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)")
+
+        self.assertEqual(parse_rule.cache_info().misses, 1)
+
+
+class TestGetRuleRoutes(unittest.TestCase):
+    """Test suite for reducing rules to the (host, path) routes they can match."""
+
+    def test_host_and_path_prefix(self):
+        """Test the most common rule shape."""
+        self.assertEqual(
+            get_rule_routes("Host(`Homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)"),
+            (Route("homelab.cy-bert.fr", False, "prefix", "/miniflux", False),)
+        )
+
+    def test_alternatives_are_expanded(self):
+        """Test that || gives one route per alternative, distributed over &&."""
+        routes = get_rule_routes("(Host(`a.com`) || Host(`b.com`)) && (Path(`/x`) || PathPrefix(`/y`))")
+
+        self.assertEqual(set(routes), {
+            Route("a.com", False, "exact", "/x", False),
+            Route("a.com", False, "prefix", "/y", False),
+            Route("b.com", False, "exact", "/x", False),
+            Route("b.com", False, "prefix", "/y", False)
+        })
+
+    def test_contradictions_are_dropped(self):
+        """Test that alternatives which can never match give no route."""
+        self.assertEqual(get_rule_routes("Host(`a.com`) && Host(`b.com`)"), ())
+        self.assertEqual(get_rule_routes("PathPrefix(`/a`) && PathPrefix(`/b`)"), ())
+        self.assertEqual(
+            get_rule_routes("PathPrefix(`/a`) && PathPrefix(`/a/b`)"),
+            (Route(None, False, "prefix", "/a/b", False),)
+        )
+
+    def test_other_matchers_are_conditional(self):
+        """Test that negations and non host/path matchers make routes conditional."""
+        self.assertEqual(
+            get_rule_routes("Host(`a.com`) && !PathPrefix(`/admin`) && Method(`GET`)"),
+            (Route("a.com", False, "prefix", "/", True),)
+        )
+
+
+class TestRouteIndex(unittest.TestCase):
+    """Test suite for looking routes up and detecting overlaps."""
+
+    def setUp(self):
+        self.index = RouteIndex()
+        self.index.add_router("miniflux", "Host(`homelab.cy-bert.fr`) && PathPrefix(`/miniflux`)")
+        self.index.add_router("mini", "Host(`homelab.cy-bert.fr`) && PathPrefix(`/mini`)")
+        self.index.add_router("homepage", "Host(`homelab.cy-bert.fr`)")
+        self.index.add_router("ping", "Path(`/ping`)", priority=1000)
+        self.index.add_router("wildcard", "HostRegexp(`{subdomain:[a-z]+}.example.com`)")
+
+    def test_lookup_follows_traefik_priorities(self):
+        """Test that the longest rule (default priority) wins, and that explicit priorities are honored."""
+        self.assertEqual(self.index.match("homelab.cy-bert.fr", "/miniflux/feeds").router, "miniflux")
+        self.assertEqual(self.index.match("homelab.cy-bert.fr", "/minimal").router, "mini")
+        self.assertEqual(self.index.match("HOMELAB.cy-bert.fr:443", "/other").router, "homepage")
+        self.assertEqual(self.index.match("homelab.cy-bert.fr", "/ping").router, "ping")
+        self.assertEqual(
+            [entry.router for entry in self.index.lookup("homelab.cy-bert.fr", "/miniflux")],
+            ["miniflux", "mini", "homepage"]
+        )
+
+    def test_lookup_of_unknown_hosts(self):
+        """Test host regular expressions, and requests no router serves."""
+        self.assertEqual(self.index.match("blog.example.com", "/").router, "wildcard")
+        self.assertIsNone(self.index.match("unknown.com", "/"))
+        self.assertIsNone(self.index.match("unknown.com", "/ping/x"))
+
+    def test_host_regexp_placeholders_and_quantifiers(self):
+        """Test that Traefik v2 placeholders are translated, and that regular expression quantifiers are kept."""
+        self.assertTrue(compile_host_regexp("{subdomain:[a-z]+}.example.com").fullmatch("blog.example.com"))
+        self.assertTrue(compile_host_regexp("{sub_domain2}.example.com").fullmatch("blog.example.com"))
+        self.assertFalse(compile_host_regexp("{subdomain}.example.com").fullmatch("a.blog.example.com"))
+
+        self.assertTrue(compile_host_regexp("^[a-z]{2,3}\\.example\\.com$").fullmatch("fr.example.com"))
+        self.assertFalse(compile_host_regexp("^[a-z]{2,3}\\.example\\.com$").fullmatch("blog.example.com"))
+        self.assertTrue(compile_host_regexp("^app[0-9]{2}\\.example\\.com$").fullmatch("app01.example.com"))
+
+        self.index.add_router("countries", "HostRegexp(`^[a-z]{2}\\.example\\.org$`)")
+        self.assertEqual(self.index.match("fr.example.org", "/").router, "countries")
+        self.assertIsNone(self.index.match("www.example.org", "/"))
+
+    def test_overlaps(self):
+        """Test that nested prefixes of different routers on the same host are reported."""
+        overlaps = set(
+            (host, entry.router, other_entry.router)
+            for host, entry, other_entry in self.index.find_overlaps()
+        )
+
+        self.assertEqual(overlaps, {
+            ("homelab.cy-bert.fr", "mini", "homepage"),
+            ("homelab.cy-bert.fr", "miniflux", "homepage"),
+            ("homelab.cy-bert.fr", "miniflux", "mini"),
+            ("homelab.cy-bert.fr", "ping", "homepage")
+        })
+
+    def test_routing_report(self):
+        """Test the per-domain report."""
+        report = self.index.get_routing_report()
+
+        self.assertEqual(report[None], [("exact", "/ping", "ping", False)])
+        self.assertEqual(report["homelab.cy-bert.fr"], [
+            ("prefix", "/", "homepage", False),
+            ("prefix", "/mini", "mini", False),
+            ("prefix", "/miniflux", "miniflux", False)
+        ])
+        self.assertIn("(any host)\n  exact   /ping", format_routing_report(self.index))
+
+    def test_many_routers(self):
+        """Test that thousands of routers sharing a few rule shapes are indexed and looked up."""
+        index = RouteIndex()
+        for idx in range(5000):
+            index.add_router(
+                "app{0}".format(idx),
+                "Host(`host{0}.example.com`) && PathPrefix(`/app{1}`)".format(idx % 50, idx)
+            )
+
+        self.assertEqual(index.match("host7.example.com", "/app1007/x").router, "app1007")
+        self.assertEqual(len(index.get_hosts()), 50)
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
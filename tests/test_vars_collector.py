@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for finding inventory vars files and collecting their variable names (bin/vars_collector.py).
+`ansible-vault` and `ansible-inventory` are faked by commands which serve fixtures from the inventory directory.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+import vars_collector
+from vars_collector import (
+    collect_variable_files_by_name, find_host_group_names, find_vars_file_paths, load_vars_file, read_vars_file
+)
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), '../bin/vars_collector.py')
+
+# Stands in for `ansible-vault view PATH`: prints PATH.plain, or fails if there is none (like with a wrong password)
+FAKE_ANSIBLE_VAULT_SCRIPT = '''#!{python}
+import sys
+try:
+    with open(sys.argv[2] + ".plain") as file:
+        sys.stdout.write(file.read())
+except FileNotFoundError:
+    sys.stderr.write("ERROR! Decryption failed\\n")
+    sys.exit(1)
+'''
+
+# Stands in for `ansible-inventory -i PATH --graph`: prints the graph.txt file next to the inventory hosts file
+FAKE_ANSIBLE_INVENTORY_SCRIPT = '''#!{python}
+import os, sys
+with open(os.path.join(os.path.dirname(sys.argv[2]), "graph.txt")) as file:
+    sys.stdout.write(file.read())
+'''
+
+INVENTORY_GRAPH = """@all:
+  |--@ungrouped:
+  |--@mash_servers:
+  |  |--@mash_example_com:
+  |  |  |--mash.example.com
+  |  |--@mash_other_com:
+  |  |  |--mash.other.com
+  |--@backup_servers:
+  |  |--mash.other.com
+"""
+
+VAULT_HEADER = "$ANSIBLE_VAULT;1.1;AES256\n6162636465666768\n"
+
+INLINE_VAULT_VARS = """---
+miniflux_enabled: true
+miniflux_database_password: !vault |
+  $ANSIBLE_VAULT;1.1;AES256
+  6162636465666768
+defaults: &defaults
+  ignored: 1
+<<: *defaults
+"""
+
+
+class InventoryTestCase(unittest.TestCase):
+    """Creates an inventory in a temporary directory, with fake Ansible commands on the PATH."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.inventory_path = os.path.join(self.temp_dir.name, 'inventory')
+
+        bin_path = os.path.join(self.temp_dir.name, 'bin')
+        os.mkdir(bin_path)
+        for command, script in [
+            ('ansible-vault', FAKE_ANSIBLE_VAULT_SCRIPT),
+            ('ansible-inventory', FAKE_ANSIBLE_INVENTORY_SCRIPT),
+        ]:
+            path = os.path.join(bin_path, command)
+            with open(path, 'w') as file:
+                file.write(script.format(python=sys.executable))
+            os.chmod(path, 0o755)
+
+        patcher = mock.patch.dict(os.environ, {'PATH': bin_path + os.pathsep + os.environ['PATH']})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        read_vars_file.cache_clear()
+
+        self.write('hosts', "[mash_servers:children]\nmash_example_com\nmash_other_com\n")
+        self.write('graph.txt', INVENTORY_GRAPH)
+        self.write('host_vars/mash.example.com/vars.yml', INLINE_VAULT_VARS)
+        self.write('host_vars/mash.example.com/vault.yml', VAULT_HEADER)
+        self.write('host_vars/mash.example.com/vault.yml.plain', "miniflux_admin_password: secret\n")
+        self.write('host_vars/mash.example.com/.hidden.yml', "hidden: true\n")
+        self.write('host_vars/mash.other.com.yml', "gitea_enabled: true\n")
+        self.write('group_vars/all.yml', "mash_playbook_generic_secret_key: ''\n")
+        self.write('group_vars/mash_example_com/vars.yml', "")
+        self.write('group_vars/backup_servers.yml', "borg_enabled: true\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_path(self, relative_path):
+        return os.path.realpath(os.path.join(self.inventory_path, relative_path))
+
+    def write(self, relative_path, contents):
+        path = os.path.join(self.inventory_path, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(contents)
+
+
+class TestFindVarsFilePaths(InventoryTestCase):
+    """Test suite for finding host_vars and group_vars files."""
+
+    def test_all_files(self):
+        """Test that single files and directories are found, skipping hidden files and other extensions."""
+        self.assertEqual(find_vars_file_paths(self.inventory_path), sorted([
+            self.get_path('group_vars/all.yml'),
+            self.get_path('group_vars/backup_servers.yml'),
+            self.get_path('group_vars/mash_example_com/vars.yml'),
+            self.get_path('host_vars/mash.example.com/vars.yml'),
+            self.get_path('host_vars/mash.example.com/vault.yml'),
+            self.get_path('host_vars/mash.other.com.yml'),
+        ]))
+
+    def test_host_groups(self):
+        """Test that a host belongs to the groups above it in the inventory graph, and only to those."""
+        self.assertEqual(
+            find_host_group_names(self.inventory_path, 'mash.example.com'),
+            {"all", "mash_servers", "mash_example_com"}
+        )
+        self.assertEqual(
+            find_host_group_names(self.inventory_path, 'mash.other.com'),
+            {"all", "mash_servers", "mash_other_com", "backup_servers"}
+        )
+        with self.assertRaises(Exception):
+            find_host_group_names(self.inventory_path, 'unknown.example.com')
+
+    def test_host_command(self):
+        """Test that --host only prints the host's own host_vars and the group_vars of its groups."""
+        result = subprocess.run(
+            [sys.executable, SCRIPT_PATH, self.inventory_path, '--host=mash.example.com'],
+            capture_output=True, text=True
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), [
+            self.get_path('group_vars/all.yml'),
+            self.get_path('group_vars/mash_example_com/vars.yml'),
+            self.get_path('host_vars/mash.example.com/vars.yml'),
+            self.get_path('host_vars/mash.example.com/vault.yml'),
+        ])
+
+
+class TestCollectVariableNames(InventoryTestCase):
+    """Test suite for collecting variable names, including from encrypted files and values."""
+
+    def test_inline_vault_values(self):
+        """Test that keys with `!vault` values (and merge keys) are found without decrypting anything."""
+        variable_files_by_name = collect_variable_files_by_name([self.get_path('host_vars/mash.example.com/vars.yml')])
+
+        self.assertEqual(
+            set(variable_files_by_name.keys()),
+            {"miniflux_enabled", "miniflux_database_password", "defaults", "ignored"}
+        )
+        self.assertIsNone(load_vars_file(self.get_path('host_vars/mash.example.com/vars.yml'))["miniflux_database_password"])
+
+    def test_vault_encrypted_files(self):
+        """Test that files encrypted as a whole are decrypted with ansible-vault, once."""
+        paths = find_vars_file_paths(self.inventory_path)
+
+        with mock.patch.object(vars_collector.subprocess, 'run', wraps=subprocess.run) as run:
+            variable_files_by_name = collect_variable_files_by_name(paths)
+            collect_variable_files_by_name(paths)
+
+        self.assertEqual(variable_files_by_name["miniflux_admin_password"], [self.get_path('host_vars/mash.example.com/vault.yml')])
+        self.assertEqual(run.call_count, 1)
+        self.assertNotIn("$ANSIBLE_VAULT;1.1;AES256", variable_files_by_name)
+
+    def test_files_in_order(self):
+        """Test that variables defined in several files list them in the given order, and empty files define none."""
+        self.write('group_vars/mash_servers.yml', "borg_enabled: false\n")
+        paths = [self.get_path('group_vars/mash_servers.yml'), self.get_path('group_vars/mash_example_com/vars.yml'),
+                 self.get_path('group_vars/backup_servers.yml')]
+
+        self.assertEqual(collect_variable_files_by_name(paths), {
+            "borg_enabled": [self.get_path('group_vars/mash_servers.yml'), self.get_path('group_vars/backup_servers.yml')]
+        })
+
+    def test_vault_encrypted_files_are_decrypted_concurrently(self):
+        """Test that several vault-encrypted files are decrypted at the same time, unless jobs is 1."""
+        paths = []
+        for idx in range(4):
+            self.write('group_vars/vault{0}.yml'.format(idx), VAULT_HEADER)
+            self.write('group_vars/vault{0}.yml.plain'.format(idx), "secret{0}: x\n".format(idx))
+            paths.append(self.get_path('group_vars/vault{0}.yml'.format(idx)))
+
+        lock = threading.Lock()
+        counts = {"running": 0, "max_running": 0}
+        run = subprocess.run
+
+        def slow_run(*args, **kwargs):
+            with lock:
+                counts["running"] += 1
+                counts["max_running"] = max(counts["max_running"], counts["running"])
+            time.sleep(0.2)
+            result = run(*args, **kwargs)
+            with lock:
+                counts["running"] -= 1
+            return result
+
+        for jobs, expected_max_running in [(1, 1), (2, 2)]:
+            with self.subTest(jobs=jobs):
+                read_vars_file.cache_clear()
+                counts["max_running"] = 0
+                with mock.patch.object(vars_collector.subprocess, 'run', side_effect=slow_run):
+                    variable_files_by_name = collect_variable_files_by_name(paths, jobs=jobs)
+
+                self.assertEqual(counts["max_running"], expected_max_running)
+                self.assertEqual(variable_files_by_name, {"secret{0}".format(idx): [path] for idx, path in enumerate(paths)})
+
+    def test_decryption_failure(self):
+        """Test that a file which can't be decrypted is reported, rather than treated as defining nothing."""
+        os.unlink(os.path.join(self.inventory_path, 'host_vars/mash.example.com/vault.yml.plain'))
+
+        with self.assertRaisesRegex(Exception, "Decryption failed"):
+            collect_variable_files_by_name([self.get_path('host_vars/mash.example.com/vault.yml')])
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the machine-readable version inventory of bin/versions.py and its `diff` subcommand.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Add the script path to import the functions
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../bin'))
+
+from versions import diff_inventories, read_inventory, write_inventory
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), '../bin/versions.py')
+
+
+def make_record(role, variable, value, roles_directory="galaxy"):
+    return {
+        "role": role,
+        "file": "roles/{0}/{1}/defaults/main.yml".format(roles_directory, role),
+        "variable": variable,
+        "value": value
+    }
+
+
+OLD_RECORDS = [
+    make_record("miniflux", "miniflux_version", "2.2.1"),
+    make_record("gitea", "gitea_version", "1.22.0"),
+    make_record("postgres", "postgres_version", 16),
+]
+
+NEW_RECORDS = [
+    make_record("miniflux", "miniflux_version", "2.2.2"),
+    make_record("postgres", "postgres_version", 16),
+    make_record("forgejo", "forgejo_version", "9.0.0"),
+]
+
+
+class TestInventoryDiff(unittest.TestCase):
+    """Test suite for comparing two version inventories."""
+
+    def test_added_removed_changed(self):
+        """Test that records are matched by role and variable."""
+        added, removed, changed = diff_inventories(OLD_RECORDS, NEW_RECORDS)
+
+        self.assertEqual(added, [NEW_RECORDS[2]])
+        self.assertEqual(removed, [OLD_RECORDS[1]])
+        self.assertEqual(changed, [(OLD_RECORDS[0], NEW_RECORDS[0])])
+
+    def test_same_variable_in_different_roles(self):
+        """Test that a variable defined by several roles is compared per role."""
+        old_records = [make_record("a", "shared_version", "1"), make_record("b", "shared_version", "1")]
+        new_records = [make_record("a", "shared_version", "1"), make_record("b", "shared_version", "2")]
+
+        added, removed, changed = diff_inventories(old_records, new_records)
+
+        self.assertEqual((added, removed), ([], []))
+        self.assertEqual(changed, [(old_records[1], new_records[1])])
+
+    def test_same_role_name_in_different_directories(self):
+        """Test that same-named roles (e.g. under roles/custom and roles/galaxy) are compared per defaults file."""
+        old_records = [make_record("a", "a_version", "1", "custom"), make_record("a", "a_version", "1")]
+        new_records = [make_record("a", "a_version", "1", "custom"), make_record("a", "a_version", "2")]
+
+        added, removed, changed = diff_inventories(old_records, new_records)
+
+        self.assertEqual((added, removed), ([], []))
+        self.assertEqual(changed, [(old_records[1], new_records[1])])
+
+        added, removed, changed = diff_inventories(old_records, new_records[:1])
+
+        self.assertEqual((added, removed, changed), ([], [old_records[1]], []))
+
+    def test_identical_inventories(self):
+        """Test that an inventory has no differences with itself."""
+        self.assertEqual(diff_inventories(OLD_RECORDS, list(reversed(OLD_RECORDS))), ([], [], []))
+
+
+class TestInventoryFiles(unittest.TestCase):
+    """Test suite for writing and reading JSON and CSV inventories."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, file_name, records):
+        path = os.path.join(self.temp_dir.name, file_name)
+        write_inventory(records, path)
+        return path
+
+    def test_json_round_trip(self):
+        """Test that JSON inventories are read back as written, sorted by file and variable, one record per line."""
+        path = self.write('versions.json', OLD_RECORDS)
+
+        self.assertEqual(read_inventory(path), sorted(OLD_RECORDS, key=lambda record: record["file"]))
+        with open(path) as file:
+            self.assertEqual(len(file.read().splitlines()), len(OLD_RECORDS) + 2)
+
+    def test_json_and_csv_compare_equal(self):
+        """Test that values are compared as strings, so that formats can be mixed."""
+        json_path = self.write('versions.json', OLD_RECORDS)
+        csv_path = self.write('versions.csv', OLD_RECORDS)
+
+        self.assertEqual(read_inventory(csv_path)[2]["value"], "16")
+        self.assertEqual(diff_inventories(read_inventory(json_path), read_inventory(csv_path)), ([], [], []))
+
+    def test_diff_command(self):
+        """Test the output and exit code of the `diff` subcommand."""
+        old_path = self.write('old.json', OLD_RECORDS)
+        new_path = self.write('new.csv', NEW_RECORDS)
+
+        result = subprocess.run([sys.executable, SCRIPT_PATH, 'diff', old_path, new_path], capture_output=True, text=True)
+
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout.splitlines(), [
+            "~ roles/galaxy/miniflux/defaults/main.yml miniflux_version: 2.2.1 -> 2.2.2",
+            "+ roles/galaxy/forgejo/defaults/main.yml forgejo_version: 9.0.0",
+            "- roles/galaxy/gitea/defaults/main.yml gitea_version: 1.22.0"
+        ])
+
+        result = subprocess.run([sys.executable, SCRIPT_PATH, 'diff', old_path, old_path], capture_output=True, text=True)
+
+        self.assertEqual((result.returncode, result.stdout), (0, ""))
+
+
+if __name__ == '__main__':
+    # Run tests with verbose output
+    unittest.main(verbosity=2)